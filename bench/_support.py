@@ -0,0 +1,119 @@
+import atexit
+import contextlib
+import importlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import urllib.request
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "s3io"
+
+
+def _install_folder_paths(base: str) -> None:
+    module = types.ModuleType("folder_paths")
+    for name in ("input", "output", "temp", "user"):
+        path = os.path.join(base, name)
+        os.makedirs(path, exist_ok=True)
+        setattr(module, f"get_{name}_directory", lambda path=path: path)
+    module.annotated_filepath = lambda name: (name, None)
+    sys.modules["folder_paths"] = module
+
+
+def _start_moto() -> str:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    atexit.register(process.terminate)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            urllib.request.urlopen(url + "/moto-api/", timeout=1).close()
+            return url
+        except OSError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                raise RuntimeError("moto server did not start; pip install 'moto[server]'")
+            time.sleep(0.1)
+
+
+def load_package(bucket: str = "s3io-bench"):
+    # Uses the S3IO_* settings when S3IO_ENDPOINT_URL (or S3IO_BUCKET) is set,
+    # otherwise starts a local moto server. Runs from the ComfyUI root use the
+    # real folder_paths; elsewhere a temporary directory stands in for it.
+    sys.path.insert(0, os.getcwd())
+    try:
+        import folder_paths  # noqa: F401
+    except ImportError:
+        _install_folder_paths(tempfile.mkdtemp(prefix="s3io-bench-"))
+    local = not (os.environ.get("S3IO_ENDPOINT_URL") or os.environ.get("S3IO_BUCKET"))
+    if local:
+        # In a subprocess, so the benchmark itself stays single-threaded.
+        os.environ.update(
+            S3IO_ACCESS_KEY_ID="bench",
+            S3IO_SECRET_ACCESS_KEY="bench",
+            S3IO_BUCKET=bucket,
+            S3IO_ENDPOINT_URL=_start_moto(),
+            S3IO_REGION="us-east-1",
+        )
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [ROOT]
+    sys.modules[PACKAGE] = package
+    helpers = importlib.import_module(f"{PACKAGE}.s3_helpers")
+    if local:
+        helpers.get_s3_client().create_bucket(Bucket=bucket)
+    print(f"endpoint: {os.environ['S3IO_ENDPOINT_URL']}{' (moto)' if local else ''}")
+    return helpers
+
+
+def load_server():
+    # A stand-in for ComfyUI's PromptServer: the routes s3_server registers
+    # are served by a plain aiohttp app.
+    from aiohttp import web
+
+    class PromptServer:
+        instance = None
+
+        def __init__(self):
+            self.app = web.Application(client_max_size=1024 ** 3)
+            self.routes = web.RouteTableDef()
+            self.last_prompt_id = None
+
+        def send_sync(self, event, data, sid=None):
+            pass
+
+    stub = types.ModuleType("server")
+    stub.web = web
+    stub.PromptServer = PromptServer
+    PromptServer.instance = PromptServer()
+    sys.modules["server"] = stub
+    module("s3_server")
+    PromptServer.instance.app.add_routes(PromptServer.instance.routes)
+    return PromptServer.instance.app
+
+
+def module(name: str):
+    return importlib.import_module(f"{PACKAGE}.{name}")
+
+
+@contextlib.contextmanager
+def timed(label: str, count: int = 0, nbytes: int = 0):
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    line = f"{label:<40} {elapsed:8.3f} s"
+    if count:
+        line += f" {count / elapsed:10.1f} ops/s"
+    if nbytes:
+        line += f" {nbytes / elapsed / (1024 * 1024):10.1f} MB/s"
+    print(line, flush=True)
@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import os
+
+from _support import load_package, module, timed
+
+
+async def _gather_limited(limit: int, coros) -> None:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            await coro
+
+    await asyncio.gather(*[run(coro) for coro in coros])
+
+
+async def _bench(helpers, keys: list[str], data: bytes, concurrency: int) -> None:
+    s3_async = module("s3_async")
+    client = s3_async.get_async_client()
+    boto3_client = helpers.get_s3_client()
+    bucket = helpers.get_config().bucket
+    total = len(keys) * len(data)
+
+    async def boto3_get(key):
+        await s3_async.run_blocking(lambda: boto3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+
+    async def native_get(key):
+        async with await client.get_object(key) as response:
+            await response.read()
+
+    with timed("put  boto3 in executor", len(keys), total):
+        await _gather_limited(concurrency, [
+            s3_async.run_blocking(boto3_client.put_object, Bucket=bucket, Key=key, Body=data) for key in keys
+        ])
+    with timed("put  asyncio client", len(keys), total):
+        await _gather_limited(concurrency, [client.put_object(key, data) for key in keys])
+    with timed("head boto3 in executor", len(keys)):
+        await _gather_limited(concurrency, [
+            s3_async.run_blocking(boto3_client.head_object, Bucket=bucket, Key=key) for key in keys
+        ])
+    with timed("head asyncio client", len(keys)):
+        await _gather_limited(concurrency, [client.head_object(key) for key in keys])
+    with timed("get  boto3 in executor", len(keys), total):
+        await _gather_limited(concurrency, [boto3_get(key) for key in keys])
+    with timed("get  asyncio client", len(keys), total):
+        await _gather_limited(concurrency, [native_get(key) for key in keys])
+
+    await _gather_limited(concurrency, [client.delete_object(key) for key in keys])
+    await s3_async.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the asyncio S3 client with boto3 on the server executor.")
+    parser.add_argument("--objects", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    helpers = load_package()
+    # Both paths get the same number of in-flight requests.
+    os.environ["S3IO_SERVER_WORKERS"] = str(args.concurrency)
+    os.environ["S3IO_MAX_CONCURRENCY"] = str(args.concurrency)
+    keys = [f"bench/async/{index:05d}.bin" for index in range(args.objects)]
+    print(f"{args.objects} objects x {args.size_kb} KiB, {args.concurrency} in flight")
+    asyncio.run(_bench(helpers, keys, os.urandom(args.size_kb * 1024), args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
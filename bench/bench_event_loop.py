@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+from _support import load_package, load_server, module
+
+
+TICK_SECONDS = 0.01
+
+
+async def _measure_lag(stop: asyncio.Event, lags: list[float]) -> None:
+    # How late a 10 ms sleep wakes up is how long the loop was blocked.
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(loop.time() - started - TICK_SECONDS)
+
+
+async def _round(app, names: list[str], label: str) -> None:
+    async with TestClient(TestServer(app)) as client:
+        stop = asyncio.Event()
+        lags: list[float] = []
+        ticker = asyncio.ensure_future(_measure_lag(stop, lags))
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[client.get("/s3io/preview/image", params={"name": name}) for name in names])
+        elapsed = time.perf_counter() - started
+        statuses = {response.status for response in responses}
+        stop.set()
+        await ticker
+    lags.sort()
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    print(
+        f"{label:<28} {elapsed:7.2f} s for {len(names)} previews (status {sorted(statuses)}), loop lag "
+        f"median {statistics.median(lags) * 1000:6.1f} ms, p99 {p99 * 1000:6.1f} ms, max {lags[-1] * 1000:6.1f} ms",
+        flush=True,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Event loop responsiveness under concurrent image previews.")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=2000)
+    args = parser.parse_args()
+
+    helpers = load_package()
+    app = load_server()
+    buffer = io.BytesIO()
+    Image.effect_noise((args.width, args.height), 48).convert("RGB").save(buffer, "JPEG", quality=90)
+    client = helpers.get_s3_client()
+    bucket = helpers.get_config().bucket
+    print(f"{args.requests} concurrent previews of uncached {args.width}x{args.height} JPEGs without thumbnails")
+
+    async def rounds():
+        for label, async_client in (("boto3 on worker threads", "0"), ("asyncio client", "1")):
+            os.environ["S3IO_ASYNC_CLIENT"] = async_client
+            names = [f"bench-loop-{async_client}/{index:03d}.jpg" for index in range(args.requests)]
+            for name in names:
+                client.put_object(Bucket=bucket, Key=helpers.input_key_for(name), Body=buffer.getvalue())
+            await _round(app, names, label)
+        await module("s3_async").close()
+
+    asyncio.run(rounds())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import os
+import tempfile
+
+from _support import load_package, timed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Upload throughput: boto3 defaults vs the S3IO transfer settings.")
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=2)
+    args = parser.parse_args()
+
+    helpers = load_package()
+    client = helpers.get_s3_client()
+    bucket = helpers.get_config().bucket
+    transfer = helpers.get_transfer_config()
+    print(
+        f"{args.size_mb} MiB file; S3IO settings: threshold {transfer.multipart_threshold >> 20} MiB, "
+        f"part {transfer.multipart_chunksize >> 20} MiB, {transfer.max_request_concurrency} threads"
+    )
+    nbytes = args.size_mb * 1024 * 1024
+    with tempfile.NamedTemporaryFile(prefix="s3io-bench-", suffix=".bin") as source:
+        for _ in range(args.size_mb):
+            source.write(os.urandom(1024 * 1024))
+        source.flush()
+        for round_number in range(1, args.rounds + 1):
+            key = f"bench/upload/{round_number}.bin"
+            with timed(f"round {round_number}: boto3 default TransferConfig", nbytes=nbytes):
+                client.upload_file(source.name, bucket, key)
+            with timed(f"round {round_number}: s3_helpers.upload_file", nbytes=nbytes):
+                helpers.upload_file(source.name, key)
+            client.delete_object(Bucket=bucket, Key=key)
+
+
+if __name__ == "__main__":
+    main()
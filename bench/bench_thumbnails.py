@@ -0,0 +1,95 @@
+import argparse
+import io
+import os
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+from _support import load_package, module, timed
+
+
+def _full_decode_thumbnail(source_path: str, target_path: str, max_size: int) -> None:
+    # make_thumbnail before the backfill work: exif_transpose loads the image
+    # at full size before it is scaled down.
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((max_size, max_size), Image.LANCZOS)
+        img.save(target_path, "JPEG", quality=85, optimize=True)
+
+
+def _photo_jpeg(width: int, height: int) -> bytes:
+    # Noise over a gradient: compresses roughly like a photo, unlike a flat fill.
+    noise = Image.effect_noise((width, height), 48).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    buffer = io.BytesIO()
+    Image.blend(noise, gradient, 0.5).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _bench_decode(helpers, sources: list[str], work_dir: str) -> None:
+    render_thumbnail = module("s3_thumbs").render_thumbnail
+    target = os.path.join(work_dir, "thumb.jpg")
+    for label, render in (("full decode (previous)", _full_decode_thumbnail), ("draft + reduce", render_thumbnail)):
+        with timed(f"decode, 1 thread, {label}", len(sources)):
+            for source in sources:
+                render(source, target, helpers.THUMB_MAX_SIZE)
+
+
+def _bench_backfill(helpers, images: int, data: bytes, workers: int, threaded: bool) -> None:
+    s3_backfill = module("s3_backfill")
+    client = helpers.get_s3_client()
+    bucket = helpers.get_config().bucket
+    for index in range(images):
+        client.put_object(Bucket=bucket, Key=helpers.input_key_for(f"bench/{index:05d}.jpg"), Body=data)
+
+    parked = threading.Event()
+    if threaded:
+        # Any extra thread makes the backfill decode on threads, as it does
+        # inside the ComfyUI server.
+        threading.Thread(target=parked.wait, daemon=True).start()
+    label = "threads" if threaded else "forked processes"
+    try:
+        started = time.perf_counter()
+        status = s3_backfill.run_backfill(workers=workers, retry_failed=True)
+        elapsed = time.perf_counter() - started
+    finally:
+        parked.set()
+    print(
+        f"backfill, {workers} {label:<17} {elapsed:8.3f} s {status['done'] / elapsed:10.1f} images/s"
+        f" ({status['done']} done, {status['failed']} failed)",
+        flush=True,
+    )
+    for index in range(images):
+        key = helpers.input_key_for(f"bench/{index:05d}.jpg")
+        client.delete_object(Bucket=bucket, Key=helpers.thumb_key_for(key))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Thumbnail decode and backfill throughput.")
+    parser.add_argument("--images", type=int, default=48)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    helpers = load_package()
+    data = _photo_jpeg(args.width, args.height)
+    print(f"{args.images} JPEGs of {args.width}x{args.height} ({len(data) // 1024} KiB), {args.workers} workers")
+    with tempfile.TemporaryDirectory(prefix="s3io-bench-") as work_dir:
+        sources = []
+        for index in range(min(args.images, 12)):
+            sources.append(os.path.join(work_dir, f"{index}.jpg"))
+            with open(sources[-1], "wb") as handle:
+                handle.write(data)
+        _bench_decode(helpers, sources, work_dir)
+    # Processes first: the threaded run leaves the process multi-threaded.
+    _bench_backfill(helpers, args.images, data, args.workers, threaded=False)
+    _bench_backfill(helpers, args.images, data, args.workers, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,545 @@
+import asyncio
+import datetime
+import functools
+import hashlib
+import hmac
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import quote, urlsplit
+
+import aiohttp
+from yarl import URL
+
+from . import s3_helpers
+from .s3_cache import temp_path_for
+
+
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+DEFAULT_REGION = "us-east-1"
+REQUEST_ATTEMPTS = 3
+RETRY_STATUSES = (500, 502, 503, 504)
+# S3 answers a request sent to the wrong region with one of these and names
+# the bucket's region in x-amz-bucket-region.
+REGION_REDIRECT_STATUSES = (301, 307, 400)
+NOT_FOUND_CODES = ("NoSuchKey", "NotFound", "404")
+
+
+class AsyncS3Error(Exception):
+    def __init__(self, status: int, code: str, message: str = ""):
+        super().__init__(f"S3 request failed ({status} {code}): {message}".rstrip(": "))
+        self.status = status
+        self.code = code
+
+
+def _uri_encode(value: str, safe: str = "") -> str:
+    return quote(value, safe="-_.~" + safe)
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find_text(element: ET.Element, name: str) -> Optional[str]:
+    for child in element:
+        if _local_name(child.tag) == name:
+            return child.text
+    return None
+
+
+def _find_all(element: ET.Element, name: str) -> list[ET.Element]:
+    return [child for child in element if _local_name(child.tag) == name]
+
+
+def _sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+
+
+def _read_part(path: str, offset: int, size: int) -> bytes:
+    with open(path, "rb") as handle:
+        handle.seek(offset)
+        return handle.read(size)
+
+
+def _write_at(path: str, offset: int, data: bytes) -> None:
+    with open(path, "r+b") as handle:
+        handle.seek(offset)
+        handle.write(data)
+
+
+def _head_from_headers(headers) -> dict:
+    head = {
+        "ETag": headers.get("ETag", ""),
+        "ContentLength": int(headers.get("Content-Length") or 0),
+        "ContentType": headers.get("Content-Type"),
+        "Metadata": {
+            name[len("x-amz-meta-"):]: value
+            for name, value in headers.items()
+            if name.lower().startswith("x-amz-meta-")
+        },
+    }
+    if headers.get("Last-Modified"):
+        head["LastModified"] = parsedate_to_datetime(headers["Last-Modified"])
+    return head
+
+
+class AsyncS3Client:
+    def __init__(self, config: s3_helpers.S3Config, max_connections: int, region: Optional[str] = None):
+        self.config = config
+        self.max_connections = max_connections
+        if config.endpoint:
+            parts = urlsplit(config.endpoint.rstrip("/"))
+            self._base = f"{parts.scheme}://{parts.netloc}"
+            self._host = parts.netloc
+            self._bucket_path = "/" + _uri_encode(config.bucket)
+            for default_port in (":80", ":443"):
+                if self._host.endswith(default_port):
+                    self._host = self._host[: -len(default_port)]
+        else:
+            self._bucket_path = ""
+        self._set_region(region or config.region or DEFAULT_REGION)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop = None
+
+    def _set_region(self, region: str) -> None:
+        self.region = region
+        if not self.config.endpoint:
+            self._host = f"{self.config.bucket}.s3.{region}.amazonaws.com"
+            self._base = f"https://{self._host}"
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120),
+                auto_decompress=False,
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _sign(
+        self,
+        method: str,
+        path: str,
+        query: dict,
+        headers: dict,
+        payload_hash: str,
+        now: Optional[datetime.datetime] = None,
+    ) -> dict:
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date_stamp = now.strftime("%Y%m%d")
+        signed = {name.lower(): str(value).strip() for name, value in headers.items()}
+        signed["host"] = self._host
+        signed["x-amz-date"] = amz_date
+        signed["x-amz-content-sha256"] = payload_hash
+        signed_names = sorted(signed)
+        canonical_query = "&".join(
+            f"{_uri_encode(name)}={_uri_encode(str(value))}" for name, value in sorted(query.items())
+        )
+        canonical_request = "\n".join([
+            method,
+            path,
+            canonical_query,
+            "".join(f"{name}:{signed[name]}\n" for name in signed_names),
+            ";".join(signed_names),
+            payload_hash,
+        ])
+        scope = f"{date_stamp}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+        key = _hmac(("AWS4" + self.config.secret_key).encode("utf-8"), date_stamp)
+        for part in (self.region, "s3", "aws4_request"):
+            key = _hmac(key, part)
+        signature = hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        signed["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.config.access_key}/{scope}, "
+            f"SignedHeaders={';'.join(signed_names)}, Signature={signature}"
+        )
+        return signed
+
+    async def _send(
+        self,
+        method: str,
+        key: Optional[str] = None,
+        query: Optional[dict] = None,
+        headers: Optional[dict] = None,
+        data: bytes = b"",
+        ok: tuple = (200,),
+    ) -> aiohttp.ClientResponse:
+        query = query or {}
+        path = self._bucket_path + "/" + (_uri_encode(key, safe="/") if key else "")
+        query_string = "&".join(
+            f"{_uri_encode(name)}={_uri_encode(str(value))}" for name, value in sorted(query.items())
+        )
+        if data:
+            payload_hash = await run_blocking(_sha256_hex, data) if len(data) > 1024 * 1024 else _sha256_hex(data)
+        else:
+            payload_hash = EMPTY_SHA256
+        session = self._get_session()
+        for attempt in range(REQUEST_ATTEMPTS):
+            signed = self._sign(method, path, query, headers or {}, payload_hash)
+            url = self._base + path + ("?" + query_string if query_string else "")
+            try:
+                response = await session.request(
+                    method, URL(url, encoded=True), headers=signed, data=data or None, allow_redirects=False
+                )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == REQUEST_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(0.5 * (attempt + 1))
+                continue
+            if response.status in ok:
+                return response
+            body = await response.read()
+            response.release()
+            bucket_region = response.headers.get("x-amz-bucket-region")
+            redirected = response.status in REGION_REDIRECT_STATUSES and bucket_region and bucket_region != self.region
+            if redirected and attempt < REQUEST_ATTEMPTS - 1:
+                # Same recovery as botocore's S3RegionRedirector: re-sign for
+                # the bucket's region (and use its endpoint on AWS).
+                self._set_region(bucket_region)
+                continue
+            if response.status in RETRY_STATUSES and attempt < REQUEST_ATTEMPTS - 1:
+                await asyncio.sleep(0.5 * (attempt + 1))
+                continue
+            raise self._error(response.status, body, key)
+        raise AssertionError("unreachable")
+
+    @staticmethod
+    def _error(status: int, body: bytes, key: Optional[str]) -> Exception:
+        code, message = str(status), ""
+        if body:
+            try:
+                root = ET.fromstring(body)
+                code = _find_text(root, "Code") or code
+                message = _find_text(root, "Message") or ""
+            except ET.ParseError:
+                pass
+        if status == 404 and code in NOT_FOUND_CODES:
+            return FileNotFoundError(f"S3 object not found: {key}")
+        return AsyncS3Error(status, code, message)
+
+    async def head_object(self, key: str) -> dict:
+        response = await self._send("HEAD", key)
+        response.release()
+        return _head_from_headers(response.headers)
+
+    async def get_object(
+        self,
+        key: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        if_match: Optional[str] = None,
+        if_none_match: Optional[str] = None,
+    ) -> aiohttp.ClientResponse:
+        # The caller owns the response and must release it (``async with response``).
+        headers = {}
+        if start is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        if if_match:
+            headers["If-Match"] = f'"{if_match}"'
+        if if_none_match:
+            headers["If-None-Match"] = f'"{if_none_match}"'
+        return await self._send("GET", key, headers=headers, ok=(200, 206, 304))
+
+    async def put_object(
+        self,
+        key: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        metadata: Optional[dict] = None,
+        if_none_match: Optional[str] = None,
+    ) -> str:
+        headers = self._object_headers(content_type, metadata)
+        if if_none_match:
+            headers["If-None-Match"] = if_none_match
+        response = await self._send("PUT", key, headers=headers, data=data)
+        response.release()
+        return response.headers.get("ETag", "").strip('"')
+
+    async def list_objects(self, prefix: str, page_size: Optional[int] = None) -> list[str]:
+        keys = []
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if page_size:
+                query["max-keys"] = str(page_size)
+            if token:
+                query["continuation-token"] = token
+            async with await self._send("GET", query=query) as response:
+                root = ET.fromstring(await response.read())
+            keys.extend(key for key in (_find_text(item, "Key") for item in _find_all(root, "Contents")) if key)
+            if _find_text(root, "IsTruncated") != "true":
+                return keys
+            token = _find_text(root, "NextContinuationToken")
+
+    async def create_multipart_upload(
+        self, key: str, content_type: Optional[str] = None, metadata: Optional[dict] = None
+    ) -> str:
+        headers = self._object_headers(content_type, metadata)
+        async with await self._send("POST", key, query={"uploads": ""}, headers=headers) as response:
+            root = ET.fromstring(await response.read())
+        return _find_text(root, "UploadId")
+
+    async def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        query = {"partNumber": str(part_number), "uploadId": upload_id}
+        response = await self._send("PUT", key, query=query, data=data)
+        response.release()
+        return response.headers.get("ETag", "").strip('"')
+
+    async def complete_multipart_upload(self, key: str, upload_id: str, parts: list[tuple[int, str]]) -> str:
+        body = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>\"{etag}\"</ETag></Part>"
+            for number, etag in sorted(parts)
+        )
+        data = f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode("utf-8")
+        async with await self._send("POST", key, query={"uploadId": upload_id}, data=data) as response:
+            root = ET.fromstring(await response.read())
+        # S3 may report a failed completion inside a 200 response.
+        if _local_name(root.tag) == "Error":
+            raise AsyncS3Error(200, _find_text(root, "Code") or "", _find_text(root, "Message") or "")
+        return (_find_text(root, "ETag") or "").strip('"')
+
+    async def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        response = await self._send("DELETE", key, query={"uploadId": upload_id}, ok=(200, 204, 404))
+        response.release()
+
+    async def delete_object(self, key: str) -> None:
+        response = await self._send("DELETE", key, ok=(200, 204))
+        response.release()
+
+    @staticmethod
+    def _object_headers(content_type: Optional[str], metadata: Optional[dict]) -> dict:
+        headers = {}
+        if content_type:
+            headers["Content-Type"] = content_type
+        for name, value in (metadata or {}).items():
+            headers[f"x-amz-meta-{name}"] = value
+        return headers
+
+
+_client: Optional[AsyncS3Client] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_download_flights: dict[str, asyncio.Future] = {}
+
+
+async def run_blocking(func, *args, **kwargs):
+    # boto3, file and PIL work must not stall the aiohttp event loop.
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=s3_helpers.server_worker_count(), thread_name_prefix="s3io-server")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def get_async_client() -> AsyncS3Client:
+    global _client
+    if _client is None:
+        transfer = s3_helpers.get_transfer_config()
+        max_connections = max(10, transfer.max_request_concurrency + 4)
+        # The region boto3 resolved (S3IO_REGION, else the AWS config/env), so
+        # both clients sign for the same region.
+        region = s3_helpers.get_s3_client().meta.region_name
+        _client = AsyncS3Client(s3_helpers.get_config(), max_connections, region=region)
+    return _client
+
+
+async def head_object(key: str) -> dict:
+    hit, head = s3_helpers.cached_object_metadata(key)
+    if hit:
+        if head is None:
+            raise FileNotFoundError(f"S3 object not found: {key}")
+        return head
+    try:
+        head = await get_async_client().head_object(key)
+    except FileNotFoundError:
+        s3_helpers.record_object_metadata(key, None)
+        raise
+    s3_helpers.record_object_metadata(key, head)
+    return head
+
+
+async def object_exists(key: str) -> bool:
+    try:
+        await head_object(key)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+async def _write_response(response: aiohttp.ClientResponse, temp_path: str, offset: int) -> int:
+    written = 0
+    async for chunk in response.content.iter_chunked(s3_helpers.DOWNLOAD_CHUNK_SIZE):
+        await run_blocking(_write_at, temp_path, offset + written, chunk)
+        written += len(chunk)
+    return written
+
+
+async def _fetch_range(key: str, etag: str, temp_path: str, start: int, end: int, limit: asyncio.Semaphore) -> None:
+    async with limit:
+        async with await get_async_client().get_object(key, start, end, if_match=etag or None) as response:
+            written = await _write_response(response, temp_path, start)
+    if written != end - start + 1:
+        raise IOError(f"Short read for {key} bytes {start}-{end}: got {written} bytes")
+
+
+async def _fetch_to_cache(key: str, kind: str, cache_path: str) -> None:
+    # Re-checked under the file lock: another process may have just filled it.
+    if await run_blocking(s3_helpers.cached_object_path, key, kind):
+        return
+    local_etag = await run_blocking(s3_helpers.cached_etag_for, cache_path)
+    client = get_async_client()
+    chunk_size = s3_helpers.range_chunk_size()
+    try:
+        response = await client.get_object(key, 0, chunk_size - 1, if_none_match=local_etag)
+    except AsyncS3Error as exc:
+        # Empty objects cannot satisfy any range.
+        if exc.status != 416:
+            raise
+        response = await client.get_object(key, if_none_match=local_etag)
+    except FileNotFoundError:
+        s3_helpers.record_object_metadata(key, None)
+        raise
+    temp_path = temp_path_for(cache_path)
+    try:
+        async with response:
+            if response.status == 304:
+                return
+            head = _head_from_headers(response.headers)
+            total = s3_helpers.parse_content_range_total(response.headers.get("Content-Range"))
+            if total is not None:
+                head["ContentLength"] = total
+            s3_helpers.record_object_metadata(key, head)
+            remote_etag = head["ETag"].strip('"')
+            await run_blocking(_create_file, temp_path, total or 0)
+            written = await _write_response(response, temp_path, 0)
+        if total is not None and total > written:
+            limit = asyncio.Semaphore(s3_helpers.range_concurrency())
+            try:
+                await asyncio.gather(*[
+                    _fetch_range(key, remote_etag, temp_path, start, min(start + chunk_size, total) - 1, limit)
+                    for start in range(written, total, chunk_size)
+                ])
+            except BaseException:
+                s3_helpers.forget_object_metadata(key)
+                raise
+        if total is not None and os.path.getsize(temp_path) != total:
+            raise IOError(f"Incomplete download for {key}: expected {total} bytes")
+        await run_blocking(s3_helpers.commit_cached_file, cache_path, temp_path, remote_etag)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _create_file(path: str, size: int) -> None:
+    # Preallocate (sparse where supported) so ranges can land at their offsets.
+    with open(path, "wb") as handle:
+        handle.truncate(size)
+
+
+async def _locked_fetch(key: str, kind: str, cache_path: str) -> None:
+    lock = s3_helpers.cache_lock_for(cache_path)
+    await run_blocking(lock.__enter__)
+    try:
+        await _fetch_to_cache(key, kind, cache_path)
+    finally:
+        await run_blocking(lock.__exit__, None, None, None)
+
+
+async def download_to_cache(key: str, kind: str = "objects") -> str:
+    cached = await run_blocking(s3_helpers.cached_object_path, key, kind)
+    if cached:
+        return cached
+    cache_path = s3_helpers.cache_path_for(key, kind)
+    flight = _download_flights.get(cache_path)
+    if flight is None:
+        flight = asyncio.ensure_future(_locked_fetch(key, kind, cache_path))
+        _download_flights[cache_path] = flight
+        flight.add_done_callback(lambda _: _download_flights.pop(cache_path, None))
+    await asyncio.shield(flight)
+    return cache_path
+
+
+async def upload_file(
+    local_path: str, key: str, content_type: Optional[str] = None, metadata: Optional[dict] = None
+) -> None:
+    client = get_async_client()
+    transfer = s3_helpers.get_transfer_config()
+    size = os.path.getsize(local_path)
+    if size < transfer.multipart_threshold:
+        data = await run_blocking(_read_part, local_path, 0, size)
+        await client.put_object(key, data, content_type=content_type, metadata=metadata)
+        s3_helpers.record_object_uploaded(key)
+        return
+    part_size = s3_helpers.multipart_part_size(size)
+    upload_id = await client.create_multipart_upload(key, content_type=content_type, metadata=metadata)
+    limit = asyncio.Semaphore(max(1, transfer.max_request_concurrency))
+
+    async def send_part(number: int, offset: int) -> tuple[int, str]:
+        async with limit:
+            data = await run_blocking(_read_part, local_path, offset, part_size)
+            return number, await client.upload_part(key, upload_id, number, data)
+
+    try:
+        parts = await asyncio.gather(*[
+            send_part(number, offset)
+            for number, offset in enumerate(range(0, size, part_size), start=1)
+        ])
+        await client.complete_multipart_upload(key, upload_id, list(parts))
+    except BaseException:
+        await asyncio.shield(client.abort_multipart_upload(key, upload_id))
+        raise
+    s3_helpers.record_object_uploaded(key)
+
+
+async def list_objects(prefix: str) -> list[str]:
+    return await get_async_client().list_objects(prefix)
+
+
+async def create_multipart_upload(key: str, content_type: Optional[str] = None, metadata: Optional[dict] = None) -> str:
+    return await get_async_client().create_multipart_upload(key, content_type=content_type, metadata=metadata)
+
+
+async def upload_part(key: str, upload_id: str, number: int, data: bytes) -> str:
+    return await get_async_client().upload_part(key, upload_id, number, data)
+
+
+async def complete_multipart_upload(key: str, upload_id: str, parts: list[tuple[int, str]]) -> None:
+    await get_async_client().complete_multipart_upload(key, upload_id, parts)
+    s3_helpers.record_object_uploaded(key)
+
+
+async def abort_multipart_upload(key: str, upload_id: str) -> None:
+    try:
+        await get_async_client().abort_multipart_upload(key, upload_id)
+    except AsyncS3Error:
+        pass
+
+
+async def delete_object(key: str) -> None:
+    await get_async_client().delete_object(key)
+    s3_helpers.record_object_deleted(key)
+
+
+async def close() -> None:
+    if _client is not None:
+        await _client.close()
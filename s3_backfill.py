@@ -0,0 +1,248 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script from the ComfyUI root: load this folder as a package so
+    # the imports below resolve, without its __init__ registering nodes and
+    # routes.
+    import types
+
+    __package__ = "s3io_backfill"
+    _package = types.ModuleType(__package__)
+    _package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules[__package__] = _package
+    sys.path.insert(0, os.getcwd())
+
+from . import s3_helpers
+from .s3_cache import write_json_atomic
+from .s3_thumbs import render_thumbnail
+
+
+logger = logging.getLogger(__name__)
+
+# FolderOfImages.IMG_EXTENSIONS, spelled out so the script does not import torch.
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png", "ppm", "bmp", "pgm", "tif", "tiff", "webp")
+STATE_SAVE_INTERVAL_SECONDS = 5
+STATUS_FAILURES_SHOWN = 20
+
+_run_lock = threading.Lock()
+_progress: Optional["BackfillProgress"] = None
+
+
+class BackfillProgress:
+    def __init__(self, path: str, report: Optional[Callable[[dict], None]] = None):
+        self._path = path
+        self._report = report
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+        self._running = False
+        self._state = {
+            "started_at": None,
+            "finished_at": None,
+            "total": 0,
+            "done": 0,
+            "failed": 0,
+            "skipped": 0,
+            "error": None,
+            "failures": {},
+        }
+        self._load()
+
+    def failed_keys(self) -> set[str]:
+        with self._lock:
+            return set(self._state["failures"])
+
+    def start(self, total: int, skipped: int) -> None:
+        with self._lock:
+            self._running = True
+            self._state.update(
+                started_at=time.time(), finished_at=None, total=total, done=0, failed=0, skipped=skipped, error=None
+            )
+        self._save(force=True)
+
+    def record(self, key: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            if error is None:
+                self._state["done"] += 1
+                self._state["failures"].pop(key, None)
+            else:
+                self._state["failed"] += 1
+                self._state["failures"][key] = error
+        self._save()
+
+    def finish(self, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._running = False
+            self._state.update(finished_at=time.time(), error=error)
+        self._save(force=True)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            state = dict(self._state)
+            state["running"] = self._running
+            failures = state.pop("failures")
+        ended_at = state["finished_at"] or time.time()
+        elapsed = ended_at - state["started_at"] if state["started_at"] else 0.0
+        state["per_second"] = round(state["done"] / elapsed, 2) if elapsed > 0 else 0.0
+        state["failures"] = dict(list(failures.items())[:STATUS_FAILURES_SHOWN])
+        state["failures_total"] = len(failures)
+        return state
+
+    def _load(self) -> None:
+        try:
+            with open(self._path, "r", encoding="utf-8") as handle:
+                state = json.load(handle)
+        except (FileNotFoundError, ValueError):
+            return
+        for name in self._state:
+            if name in state:
+                self._state[name] = state[name]
+
+    def _save(self, force: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            if not force and now - self._saved_at < STATE_SAVE_INTERVAL_SECONDS:
+                return
+            self._saved_at = now
+            write_json_atomic(self._path, self._state)
+        if self._report is not None:
+            self._report(self.snapshot())
+
+
+def backfill_running() -> bool:
+    return _run_lock.locked()
+
+
+def backfill_status() -> dict:
+    progress = _progress
+    if progress is None:
+        progress = BackfillProgress(s3_helpers.thumbnail_backfill_state_path())
+    return progress.snapshot()
+
+
+def _render_pool(workers: int):
+    # Decoding holds the GIL, so it gets forked processes when that is safe:
+    # only while this process has a single thread (the command line), since a
+    # child forked from a threaded process (the ComfyUI server) can inherit
+    # locks held by threads that do not exist in it. Spawned workers are not
+    # an option either, as they would re-import ComfyUI's main module.
+    if "fork" in multiprocessing.get_all_start_methods() and threading.active_count() == 1:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+        # The first submit forks every worker, before any transfer thread starts.
+        pool.submit(int).result()
+        return pool
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3io-backfill-render")
+
+
+def _backfill_one(key: str, work_dir: str, renderer, progress: BackfillProgress) -> None:
+    name = uuid.uuid4().hex
+    source_path = os.path.join(work_dir, name + os.path.splitext(key)[1])
+    thumb_path = os.path.join(work_dir, name + ".jpg")
+    try:
+        s3_helpers.download_file(key, source_path)
+        renderer.submit(render_thumbnail, source_path, thumb_path, s3_helpers.THUMB_MAX_SIZE).result()
+        s3_helpers.upload_file(thumb_path, s3_helpers.thumb_key_for(key), content_type="image/jpeg")
+    except BrokenProcessPool:
+        # Not this image's fault; leave it for the next run.
+        raise
+    except Exception as exc:
+        logger.warning("Backfilling the thumbnail of %s failed: %s", key, exc)
+        progress.record(key, str(exc).replace(source_path, key) or type(exc).__name__)
+    else:
+        progress.record(key)
+    finally:
+        for path in (source_path, thumb_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def run_backfill(
+    workers: Optional[int] = None,
+    retry_failed: bool = False,
+    report: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    # Resuming needs no checkpoint of its own: every run diffs the prefixes
+    # again, so thumbnails uploaded before an interruption are not redone.
+    # Keys that failed before are skipped unless retry_failed is set.
+    global _progress
+    if not _run_lock.acquire(blocking=False):
+        raise RuntimeError("A thumbnail backfill is already running")
+    try:
+        workers = workers or s3_helpers.backfill_worker_count()
+        progress = _progress = BackfillProgress(s3_helpers.thumbnail_backfill_state_path(), report)
+        keys = s3_helpers.thumbnail_backlog(IMAGE_EXTENSIONS)
+        skipped = 0
+        if not retry_failed:
+            failed = progress.failed_keys()
+            remaining = [key for key in keys if key not in failed]
+            skipped = len(keys) - len(remaining)
+            keys = remaining
+        progress.start(len(keys), skipped)
+        error = None
+        try:
+            # Two transfer threads per decoder keep one image downloading or
+            # uploading while the other is being decoded. The decoders start
+            # first so they can still be forked.
+            with tempfile.TemporaryDirectory(prefix="s3io-backfill-") as work_dir, _render_pool(
+                workers
+            ) as renderer, ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix="s3io-backfill") as pool:
+                futures = [pool.submit(_backfill_one, key, work_dir, renderer, progress) for key in keys]
+                finished, pending = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in pending:
+                    future.cancel()
+                for future in finished:
+                    future.result()
+        except Exception as exc:
+            error = str(exc) or type(exc).__name__
+            raise
+        finally:
+            progress.finish(error)
+        return progress.snapshot()
+    finally:
+        _run_lock.release()
+
+
+def _print_status(status: dict) -> None:
+    print(
+        f"{status['done'] + status['failed']}/{status['total']} processed, "
+        f"{status['failed']} failed, {status['per_second']}/s",
+        flush=True,
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate missing thumbnails for the images in the S3 input prefix.")
+    parser.add_argument("--workers", type=int, default=None, help="decoder processes (default: S3IO_BACKFILL_WORKERS)")
+    parser.add_argument("--retry-failed", action="store_true", help="retry images that failed in an earlier run")
+    parser.add_argument("--dry-run", action="store_true", help="only count the images without a thumbnail")
+    parser.add_argument("--status", action="store_true", help="print the state of the last run and exit")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    if args.status:
+        print(json.dumps(backfill_status(), indent=2))
+        return 0
+    if args.dry_run:
+        keys = s3_helpers.thumbnail_backlog(IMAGE_EXTENSIONS)
+        failed = backfill_status()["failures_total"]
+        print(f"{len(keys)} images have no thumbnail ({failed} failed in earlier runs)")
+        return 0
+
+    status = run_backfill(workers=args.workers, retry_failed=args.retry_failed, report=_print_status)
+    _print_status(status)
+    return 1 if status["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
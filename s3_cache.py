@@ -0,0 +1,349 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Optional, TypeVar
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+T = TypeVar("T")
+
+
+SIDECAR_SUFFIXES = (".etag",)
+# ioctl(FICLONE) from linux/fs.h: share the source's extents (btrfs, XFS, ...).
+FICLONE = 0x40049409
+
+
+def _sidecar_paths(path: str) -> list[str]:
+    return [path + suffix for suffix in SIDECAR_SUFFIXES]
+
+
+def temp_path_for(path: str) -> str:
+    # Dot-prefixed so partially written files are never picked up by rebuild().
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.{os.getpid()}.{threading.get_ident()}.part")
+
+
+def write_json_atomic(path: str, data: object, durable: bool = False) -> None:
+    # Readers see the old file or the new one, never a torn write. `durable`
+    # also flushes the file and its directory entry, for state that has to
+    # survive the machine going away rather than just the process.
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = temp_path_for(path)
+    try:
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump(data, handle)
+            if durable:
+                handle.flush()
+                os.fsync(handle.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    if durable and fcntl is not None:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def lock_path_for(path: str) -> str:
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.lock")
+
+
+def remove_lock_file(path: str) -> None:
+    # Only taken without waiting: a lock somebody holds stays, and goes the
+    # next time its file is removed. Windows cannot delete an open file.
+    if fcntl is None or not os.path.exists(path):
+        return
+    lock = FileLock(path)
+    if not lock.acquire(blocking=False):
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    finally:
+        lock.release()
+
+
+def link_or_copy(source: str, target: str) -> None:
+    # Cheapest way to give `target` the bytes of `source`: a hardlink, then a
+    # reflink, then copyfile (which uses sendfile/fcopyfile, never a Python
+    # buffer of the whole file).
+    try:
+        os.link(source, target)
+        return
+    except OSError:
+        pass
+    if fcntl is not None and hasattr(fcntl, "ioctl"):
+        try:
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, target)
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class CacheManager:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._pins: set[str] = set()
+        self._pin_owner: Optional[str] = None
+        # Space held by files that are not cache entries yet (streaming
+        # sessions): counted against the budget, never evicted here.
+        self._reserved: dict[str, int] = {}
+        # Hardlinks of an entry (previews in ComfyUI's temp directory): they
+        # share its bytes, so they cost nothing on their own and are removed
+        # with it, or evicting it would free no space.
+        self._links: dict[str, set[str]] = {}
+        self._total_bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def rebuild(self) -> None:
+        found = []
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            names = set(filenames)
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if filename.startswith(".") and filename.endswith(".lock") and filename[1:-5] not in names:
+                    # Left over from a file removed before locks were cleaned up.
+                    remove_lock_file(path)
+                elif self._is_managed(path):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((max(stat.st_atime, stat.st_mtime), path))
+        found.sort()
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = sum(self._reserved.values())
+            for _, path in found:
+                self._track(path)
+        self.evict()
+
+    def add(self, path: str) -> None:
+        with self._lock:
+            self._untrack(path)
+            self._track(path)
+            # Links of a replaced file hold the old bytes, which nothing counts.
+            stale = self._links.pop(path, set())
+        self._delete_links(stale)
+        # The caller is about to use this file, so it is never its own victim,
+        # even when it alone is over budget; it goes on a later eviction.
+        self.evict(keep=path)
+
+    def touch(self, path: str) -> None:
+        with self._lock:
+            if path not in self._entries:
+                self._track(path)
+            else:
+                self._entries.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def remove(self, path: str) -> None:
+        with self._lock:
+            self._untrack(path)
+            self._pins.discard(path)
+            links = self._links.pop(path, set())
+        self._delete_files(path)
+        self._delete_links(links)
+
+    def link(self, path: str, link_path: str) -> bool:
+        # False when `path` is not an entry; the caller then owns the link.
+        with self._lock:
+            if path not in self._entries:
+                return False
+            self._links.setdefault(path, set()).add(link_path)
+        return True
+
+    def reserve(self, name: str, nbytes: int) -> None:
+        with self._lock:
+            self._total_bytes += nbytes - self._reserved.get(name, 0)
+            self._reserved[name] = nbytes
+        self.evict()
+
+    def unreserve(self, name: str) -> None:
+        with self._lock:
+            self._total_bytes -= self._reserved.pop(name, 0)
+
+    def pin(self, path: str, owner: str) -> None:
+        # Pins belong to one owner (the executing prompt); pinning for a new
+        # owner releases everything the previous one held.
+        with self._lock:
+            if owner != self._pin_owner:
+                self._pins.clear()
+                self._pin_owner = owner
+            self._pins.add(path)
+
+    def release(self, owner: Optional[str] = None) -> None:
+        with self._lock:
+            if owner is not None and owner != self._pin_owner:
+                return
+            self._pins.clear()
+            self._pin_owner = None
+        self.evict()
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        if self.max_bytes <= 0:
+            return
+        victims = []
+        with self._lock:
+            for path in list(self._entries):
+                if self._total_bytes <= self.max_bytes:
+                    break
+                if path in self._pins or path == keep:
+                    continue
+                self._untrack(path)
+                victims.append((path, self._links.pop(path, set())))
+        for path, links in victims:
+            self._delete_files(path)
+            self._delete_links(links)
+
+    def _is_managed(self, path: str) -> bool:
+        if path.endswith(SIDECAR_SUFFIXES):
+            return False
+        return not os.path.basename(path).startswith(".")
+
+    def _track(self, path: str) -> None:
+        size = _file_size(path) + sum(_file_size(sidecar) for sidecar in _sidecar_paths(path))
+        self._entries[path] = size
+        self._total_bytes += size
+
+    def _untrack(self, path: str) -> None:
+        size = self._entries.pop(path, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    @staticmethod
+    def _delete_files(path: str) -> None:
+        for target in [path] + _sidecar_paths(path):
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                pass
+        remove_lock_file(lock_path_for(path))
+
+    @staticmethod
+    def _delete_links(links: set[str]) -> None:
+        for link_path in links:
+            try:
+                os.remove(link_path)
+            except FileNotFoundError:
+                pass
+
+
+class FileLock:
+    def __init__(self, path: str):
+        self.path = path
+        self._handle = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        while True:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            handle = open(self.path, "a+b")
+            if fcntl is None:
+                handle.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            handle.close()
+                            return False
+                self._handle = handle
+                return True
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                return False
+            # The file may have been removed (see remove_lock_file) while this
+            # waited for it; holding a lock on a file nobody else can open
+            # would not exclude anyone, so lock the one at the path instead.
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(handle.fileno())
+            if current is not None and (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+                self._handle = handle
+                return True
+            handle.close()
+
+    def release(self) -> None:
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._handle.close()
+            self._handle = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future] = {}
+
+    def run(self, key: str, func: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
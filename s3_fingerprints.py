@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Lookups only note when a path was used; the notes reach the database in
+# batches, since IS_CHANGED looks up every input on every prompt.
+TOUCH_BATCH_SIZE = 256
+TOUCH_FLUSH_SECONDS = 60.0
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        while True:
+            chunk = handle.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _identity(stat: os.stat_result) -> tuple[int, int, int]:
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class FingerprintCache:
+    def __init__(self, path: str, max_entries: int, workers: int = 1):
+        self._max_entries = max(1, max_entries)
+        # Evicting down to a bit below the limit keeps the next stores from
+        # each paying for another eviction.
+        self._evict_to = max(1, self._max_entries - self._max_entries // 10)
+        self._lock = threading.Lock()
+        self._pending: dict[tuple, Future] = {}
+        self._touched: dict[str, float] = {}
+        self._touched_at = time.monotonic()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="s3io-hash")
+        self._db = self._open(path)
+        self._entries = self._count()
+
+    def get(self, path: str) -> str:
+        # sha256 of the file; the bytes are read again only when the file's
+        # inode, size or mtime no longer match what was hashed.
+        path = os.path.abspath(path)
+        identity = _identity(os.stat(path))
+        digest = self._lookup(path, identity)
+        if digest is not None:
+            return digest
+        flight = (path,) + identity
+        with self._lock:
+            future = self._pending.get(flight)
+            if future is None:
+                future = self._pending[flight] = self._pool.submit(self._hash, path, identity)
+                future.add_done_callback(lambda _, flight=flight: self._forget(flight))
+        return future.result()
+
+    def remember(self, path: str, digest: str) -> None:
+        # For callers that hashed the bytes while writing them.
+        path = os.path.abspath(path)
+        self._store(path, _identity(os.stat(path)), digest)
+
+    def _forget(self, flight: tuple) -> None:
+        with self._lock:
+            self._pending.pop(flight, None)
+
+    def _hash(self, path: str, identity: tuple[int, int, int]) -> str:
+        digest = sha256_file(path)
+        if _identity(os.stat(path)) != identity:
+            # Modified while hashing; do not store a digest of mixed contents.
+            return digest
+        self._store(path, identity, digest)
+        return digest
+
+    def _open(self, path: str) -> sqlite3.Connection:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._create(db)
+            return db
+        except (OSError, sqlite3.Error):
+            # A cache that only lives for this session still beats rehashing.
+            logger.warning("Fingerprint cache %s is unavailable; keeping it in memory", path, exc_info=True)
+            db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+            self._create(db)
+            return db
+
+    @staticmethod
+    def _create(db: sqlite3.Connection) -> None:
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+            "digest TEXT NOT NULL, used_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS fingerprints_used_at ON fingerprints (used_at)")
+
+    def _lookup(self, path: str, identity: tuple[int, int, int]) -> Optional[str]:
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    "SELECT digest FROM fingerprints WHERE path = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                    (path, *identity),
+                ).fetchone()
+                if row is not None:
+                    self._touched[path] = time.time()
+                    if len(self._touched) >= TOUCH_BATCH_SIZE or time.monotonic() - self._touched_at >= TOUCH_FLUSH_SECONDS:
+                        self._flush_touched()
+            except sqlite3.Error:
+                logger.debug("Fingerprint cache lookup failed", exc_info=True)
+                return None
+        return None if row is None else row[0]
+
+    def _count(self) -> int:
+        try:
+            return self._db.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def _flush_touched(self) -> None:
+        # Called with the lock held.
+        touched, self._touched = self._touched, {}
+        self._touched_at = time.monotonic()
+        if not touched:
+            return
+        try:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "UPDATE fingerprints SET used_at = ? WHERE path = ?",
+                    [(used_at, path) for path, used_at in touched.items()],
+                )
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            logger.debug("Fingerprint cache update failed", exc_info=True)
+
+    def _evict(self) -> None:
+        # Called with the lock held. Other processes share the file, so the
+        # running count is only a trigger; the real one decides.
+        self._flush_touched()
+        excess = self._count() - self._evict_to
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM fingerprints WHERE path IN "
+                "(SELECT path FROM fingerprints ORDER BY used_at LIMIT ?)",
+                (excess,),
+            )
+        self._entries = self._count()
+
+    def _store(self, path: str, identity: tuple[int, int, int], digest: str) -> None:
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO fingerprints (path, inode, size, mtime_ns, digest, used_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, *identity, digest, time.time()),
+                )
+                self._touched.pop(path, None)
+                # Replacing a row also counts, so this errs towards evicting early.
+                self._entries += 1
+                if self._entries > self._max_entries:
+                    self._evict()
+            except sqlite3.Error:
+                logger.debug("Fingerprint cache update failed", exc_info=True)
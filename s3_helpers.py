@@ -1,18 +1,74 @@
+import atexit
 import hashlib
+import logging
 import os
+import re
+import shutil
+import threading
+import uuid
 import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass
-from typing import Iterable, Optional
+from typing import Callable, Iterable, Optional
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from PIL import Image, ImageOps
 
 import folder_paths
 
-
-LIST_CACHE_TTL_SECONDS = 0
+from .s3_cache import CacheManager, FileLock, SingleFlight, link_or_copy, lock_path_for, temp_path_for
+from .s3_fingerprints import FingerprintCache
+from .s3_journal import UploadJournal
+from .s3_listing import ListingIndex
+from .s3_names import NameAllocator
+from .s3_sessions import UploadSessions
+from .s3_stream import ProgressiveDownload, StreamServer
+from .s3_thumbs import render_thumbnail
+from .s3_uploads import UploadJob, UploadQueue
+
+
+logger = logging.getLogger(__name__)
+
+LIST_TTL_SECONDS_DEFAULT = 300
+HEAD_CACHE_TTL_SECONDS_DEFAULT = 10
+HEAD_CACHE_MAX_ENTRIES = 4096
+FINGERPRINT_CACHE_ENTRIES_DEFAULT = 10000
+HASH_WORKERS_DEFAULT = 2
+FINGERPRINT_METADATA_KEY = "sha256"
+CACHE_MAX_MB_DEFAULT = 10240
+MULTIPART_THRESHOLD_MB_DEFAULT = 16
+MULTIPART_CHUNKSIZE_MB_DEFAULT = 16
+MAX_CONCURRENCY_DEFAULT = 10
+RANGE_CHUNK_MB_DEFAULT = 16
+SERVER_WORKERS_DEFAULT = 8
+UPLOAD_WORKERS_DEFAULT = 2
+UPLOAD_QUEUE_SIZE_DEFAULT = 64
+UPLOAD_QUEUE_MB_DEFAULT = 512
+UPLOAD_DRAIN_SECONDS_DEFAULT = 60
+PRESIGN_EXPIRES_SECONDS_DEFAULT = 3600
+PRESIGNED_URL_CACHE_MAX_ENTRIES = 4096
+# A cached preview URL is replaced once it has less than this left to live.
+PRESIGNED_URL_MARGIN_SECONDS = 60
+UPLOAD_SESSION_MAX_AGE_SECONDS = 7 * 24 * 3600
+MAX_MULTIPART_PARTS = 10000
+# Allowance for clock skew between this machine and S3 when matching LastModified.
+JOURNAL_CLOCK_SKEW_SECONDS = 300
+OUTPUT_NAME_ATTEMPTS = 5
+# A queued upload is retried this many times with doubling delays; a journaled
+# one that still fails is picked up again on the next start, up to
+# UPLOAD_RESUME_LIMIT starts.
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_BACKOFF_SECONDS = 2.0
+UPLOAD_RESUME_LIMIT = 3
+STREAM_READ_AHEAD_CHUNKS = 4
+STREAM_IDLE_SECONDS_DEFAULT = 300
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 THUMB_MAX_SIZE = 256
+THUMB_WORKERS_DEFAULT = 2
+BACKFILL_WORKERS_DEFAULT = 4
 THUMB_PREFIX_DEFAULT = "thumbs"
 ENV_PREFIX = "S3IO_"
 LEGACY_ENV_PREFIX = "S3_"
@@ -40,10 +96,43 @@ class S3Config:
     thumb_prefix: str
 
 
-_list_cache: dict[str, tuple[float, list[str]]] = {}
-_force_refresh = False
 _cached_client = None
 _cached_config: Optional[S3Config] = None
+_cached_transfer_config: Optional[TransferConfig] = None
+_listing_index: Optional[ListingIndex] = None
+_listing_scan: Optional[Callable[[str], list[str]]] = None
+_head_cache: dict[str, tuple[float, Optional[dict]]] = {}
+_head_cache_lock = threading.Lock()
+_presigned_urls: OrderedDict[tuple[str, str], tuple[float, str]] = OrderedDict()
+_presigned_urls_lock = threading.Lock()
+_fingerprint_cache: Optional[FingerprintCache] = None
+_fingerprint_cache_lock = threading.Lock()
+_cache_manager: Optional[CacheManager] = None
+_cache_manager_lock = threading.Lock()
+_pinning_prompt_id: Optional[str] = None
+_pinning_prompt_lock = threading.Lock()
+_download_flights = SingleFlight()
+_range_pool: Optional[ThreadPoolExecutor] = None
+_range_pool_lock = threading.Lock()
+_thumb_pool: Optional[ThreadPoolExecutor] = None
+_thumb_pool_lock = threading.Lock()
+_stream_server: Optional[StreamServer] = None
+_stream_server_lock = threading.Lock()
+_upload_queue: Optional[UploadQueue] = None
+_upload_queue_lock = threading.Lock()
+_transfer_pool: Optional[ThreadPoolExecutor] = None
+_transfer_pool_lock = threading.Lock()
+_part_pool: Optional[ThreadPoolExecutor] = None
+_conditional_writes_supported = True
+_upload_journal: Optional[UploadJournal] = None
+_upload_journal_lock = threading.Lock()
+_upload_sessions: Optional[UploadSessions] = None
+_direct_uploads: Optional[UploadSessions] = None
+_upload_sessions_lock = threading.Lock()
+_journal_resumed = False
+_journal_resume_lock = threading.Lock()
+_name_allocator: Optional[NameAllocator] = None
+_name_allocator_lock = threading.Lock()
 
 
 def _normalize_prefix(prefix: Optional[str]) -> str:
@@ -58,12 +147,6 @@ def _join_prefix(prefix: str, key: str) -> str:
     return prefix.rstrip("/") + "/" + key.lstrip("/")
 
 
-def _strip_prefix(key: str, prefix: str) -> str:
-    if prefix and key.startswith(prefix):
-        return key[len(prefix):]
-    return key
-
-
 def _read_text_file(path: str) -> Optional[str]:
     try:
         with open(path, "r", encoding="utf-8") as handle:
@@ -74,17 +157,114 @@ def _read_text_file(path: str) -> Optional[str]:
 
 def _write_text_file(path: str, content: str) -> None:
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as handle:
+    temp_path = temp_path_for(path)
+    with open(temp_path, "w", encoding="utf-8") as handle:
         handle.write(content)
+    os.replace(temp_path, path)
+
+
+def _setting(name: str, default: str = "") -> str:
+    for prefix in (ENV_PREFIX, LEGACY_ENV_PREFIX):
+        value = os.environ.get(prefix + name)
+        if value:
+            return value
+    return default
+
+
+def _setting_float(name: str, default: float) -> float:
+    value = _setting(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError as exc:
+        raise RuntimeError(f"Invalid S3 IO setting {ENV_PREFIX}{name}: {value}") from exc
+
+
+def _setting_int(name: str, default: int) -> int:
+    value = _setting(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError as exc:
+        raise RuntimeError(f"Invalid S3 IO setting {ENV_PREFIX}{name}: {value}") from exc
+
+
+def _setting_bool(name: str, default: bool) -> bool:
+    value = _setting(name)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _get_state_dir() -> str:
+    state_dir = _setting("STATE_DIR") or os.path.join(folder_paths.get_user_directory(), "s3-io")
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
 
 
 def _get_cache_dir() -> str:
-    base_dir = folder_paths.get_temp_directory()
-    cache_dir = os.path.join(base_dir, "s3-io")
+    cache_dir = os.path.abspath(_setting("CACHE_DIR") or os.path.join(folder_paths.get_temp_directory(), "s3-io"))
     os.makedirs(cache_dir, exist_ok=True)
     return cache_dir
 
 
+def _get_cache_manager() -> CacheManager:
+    global _cache_manager
+    with _cache_manager_lock:
+        if _cache_manager is None:
+            max_bytes = int(_setting_float("CACHE_MAX_MB", CACHE_MAX_MB_DEFAULT) * 1024 * 1024)
+            _cache_manager = CacheManager(_get_cache_dir(), max_bytes)
+            _cache_manager.rebuild()
+        return _cache_manager
+
+
+def _current_prompt_id() -> Optional[str]:
+    try:
+        import server
+    except ImportError:
+        return None
+    instance = getattr(server.PromptServer, "instance", None)
+    return getattr(instance, "last_prompt_id", None)
+
+
+def _pinning_prompt() -> Optional[str]:
+    # ComfyUI has no hook for the end of a prompt, so what one prompt pinned
+    # is released when the next one starts pinning.
+    global _pinning_prompt_id
+    prompt_id = _current_prompt_id()
+    with _pinning_prompt_lock:
+        previous, _pinning_prompt_id = _pinning_prompt_id, prompt_id or _pinning_prompt_id
+    if prompt_id and previous and previous != prompt_id:
+        release_cached_files(previous)
+    return prompt_id
+
+
+def _pin_cached_file(path: str) -> None:
+    prompt_id = _pinning_prompt()
+    if prompt_id:
+        _get_cache_manager().pin(path, prompt_id)
+
+
+def release_cached_files(prompt_id: Optional[str] = None) -> None:
+    # Files and video streams the prompt pinned become evictable again.
+    if _cache_manager is not None:
+        _cache_manager.release(prompt_id)
+    if _stream_server is not None:
+        _stream_server.release(prompt_id)
+
+
+def _use_cached_file(path: str, pin: bool, added: bool = False) -> None:
+    manager = _get_cache_manager()
+    if pin:
+        _pin_cached_file(path)
+    if added:
+        manager.add(path)
+    else:
+        manager.touch(path)
+
+
 def _cache_path_for_key(key: str, kind: str) -> str:
     safe_key = key.replace("/", os.sep)
     return os.path.join(_get_cache_dir(), kind, safe_key)
@@ -166,29 +346,87 @@ def get_s3_client():
         kwargs["region_name"] = config.region
     if config.endpoint:
         kwargs["endpoint_url"] = config.endpoint
+    # Leave room for every upload thread (whole files, inline batches and the
+    # shared part pool) plus regular requests from other threads.
+    upload_threads = 2 * _transfer_config().max_request_concurrency
+    upload_threads += _setting_int("UPLOAD_WORKERS", UPLOAD_WORKERS_DEFAULT)
+    max_pool_connections = max(10, upload_threads + 4)
+    kwargs["config"] = Config(max_pool_connections=max_pool_connections)
     _cached_client = boto3.client("s3", **kwargs)
     return _cached_client
 
 
+def _transfer_config() -> TransferConfig:
+    global _cached_transfer_config
+    if _cached_transfer_config is not None:
+        return _cached_transfer_config
+    mb = 1024 * 1024
+    _cached_transfer_config = TransferConfig(
+        multipart_threshold=_setting_int("MULTIPART_THRESHOLD_MB", MULTIPART_THRESHOLD_MB_DEFAULT) * mb,
+        multipart_chunksize=_setting_int("MULTIPART_CHUNKSIZE_MB", MULTIPART_CHUNKSIZE_MB_DEFAULT) * mb,
+        max_concurrency=_setting_int("MAX_CONCURRENCY", MAX_CONCURRENCY_DEFAULT),
+    )
+    return _cached_transfer_config
+
+
 def get_config() -> S3Config:
     return _resolve_config()
 
 
-def invalidate_list_cache() -> None:
-    global _force_refresh
-    _force_refresh = True
+def get_transfer_config() -> TransferConfig:
+    return _transfer_config()
 
 
-def list_objects(prefix: str, refresh: bool = False) -> list[str]:
-    global _force_refresh
-    now = time.time()
-    if LIST_CACHE_TTL_SECONDS <= 0:
-        refresh = True
-    cached = _list_cache.get(prefix)
-    if not refresh and not _force_refresh and cached:
-        cached_at, keys = cached
-        if now - cached_at < LIST_CACHE_TTL_SECONDS:
-            return keys
+def server_worker_count() -> int:
+    return max(1, _setting_int("SERVER_WORKERS", SERVER_WORKERS_DEFAULT))
+
+
+def backfill_worker_count() -> int:
+    return max(1, _setting_int("BACKFILL_WORKERS", BACKFILL_WORKERS_DEFAULT))
+
+
+def async_client_enabled() -> bool:
+    return _setting_bool("ASYNC_CLIENT", True)
+
+
+def range_chunk_size() -> int:
+    return _setting_int("RANGE_CHUNK_MB", RANGE_CHUNK_MB_DEFAULT) * 1024 * 1024
+
+
+def range_concurrency() -> int:
+    return max(1, _setting_int("RANGE_CONCURRENCY", _transfer_config().max_request_concurrency))
+
+
+def multipart_part_size(size: int) -> int:
+    return max(_transfer_config().multipart_chunksize, -(-size // MAX_MULTIPART_PARTS))
+
+
+def direct_uploads_enabled() -> bool:
+    return _setting_bool("DIRECT_UPLOADS", False)
+
+
+def presign_expires_seconds() -> int:
+    return max(1, _setting_int("PRESIGN_EXPIRES_SECONDS", PRESIGN_EXPIRES_SECONDS_DEFAULT))
+
+
+def presigned_preview_enabled() -> bool:
+    return _setting_bool("PRESIGNED_PREVIEW", False)
+
+
+def _get_listing_index() -> ListingIndex:
+    global _listing_index
+    if _listing_index is not None:
+        return _listing_index
+    config = _resolve_config()
+    _listing_index = ListingIndex(
+        _scan_listing,
+        ttl_seconds=_setting_float("LIST_TTL_SECONDS", LIST_TTL_SECONDS_DEFAULT),
+        state_path=os.path.join(_get_state_dir(), f"listing-{config.bucket}.json"),
+    )
+    return _listing_index
+
+
+def list_objects(prefix: str) -> list[str]:
     client = get_s3_client()
     config = _resolve_config()
     keys = []
@@ -199,34 +437,126 @@ def list_objects(prefix: str, refresh: bool = False) -> list[str]:
             if not key:
                 continue
             keys.append(key)
-    _list_cache[prefix] = (now, keys)
-    _force_refresh = False
     return keys
 
 
+def set_listing_scan(scan: Optional[Callable[[str], list[str]]]) -> None:
+    # The routes module lists through the asyncio client while its loop runs.
+    global _listing_scan
+    _listing_scan = scan
+
+
+def _scan_listing(prefix: str) -> list[str]:
+    scan = _listing_scan
+    return scan(prefix) if scan is not None else list_objects(prefix)
+
+
 def list_media_keys(prefix: str, extensions: Iterable[str], refresh: bool = False) -> list[str]:
-    normalized_exts = {ext.lower().lstrip(".") for ext in extensions}
-    keys = list_objects(prefix, refresh=refresh)
-    results = []
-    for key in keys:
-        if key.endswith("/"):
-            continue
-        rel = _strip_prefix(key, prefix)
-        if not rel:
+    return _get_listing_index().get(prefix, extensions, refresh=refresh)
+
+
+def thumbnail_backlog(extensions: Iterable[str]) -> list[str]:
+    # Input keys with no thumbnail, diffed from a fresh scan of both prefixes.
+    config = _resolve_config()
+    index = _get_listing_index()
+    index.rescan(config.input_prefix)
+    index.rescan(config.thumb_prefix)
+    thumbs = {_join_prefix(config.thumb_prefix, rel) for rel in index.get(config.thumb_prefix, ("jpg",))}
+    keys = []
+    for rel in index.get(config.input_prefix, extensions):
+        key = _join_prefix(config.input_prefix, rel)
+        if config.thumb_prefix and key.startswith(config.thumb_prefix):
             continue
-        ext = os.path.splitext(rel)[1].lower().lstrip(".")
-        if ext in normalized_exts:
-            results.append(rel)
-    return sorted(results)
+        if thumb_key_for(key) not in thumbs:
+            keys.append(key)
+    return keys
+
+
+def _error_status(exc: ClientError) -> Optional[int]:
+    return exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+
+
+def _is_not_found(exc: ClientError) -> bool:
+    return _error_status(exc) == 404 or exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+def _is_not_modified(exc: ClientError) -> bool:
+    return _error_status(exc) == 304 or exc.response.get("Error", {}).get("Code") in ("304", "NotModified")
+
+
+def _is_precondition_failed(exc: ClientError) -> bool:
+    return _error_status(exc) == 412 or exc.response.get("Error", {}).get("Code") in ("412", "PreconditionFailed")
+
+
+def _is_not_implemented(exc: ClientError) -> bool:
+    return _error_status(exc) == 501 or exc.response.get("Error", {}).get("Code") in ("501", "NotImplemented")
+
+
+def _cached_head(key: str) -> tuple[bool, Optional[dict]]:
+    with _head_cache_lock:
+        cached = _head_cache.get(key)
+    if cached is None:
+        return False, None
+    expires_at, head = cached
+    if time.time() >= expires_at:
+        return False, None
+    return True, head
+
+
+def _remember_head(key: str, head: Optional[dict]) -> None:
+    now = time.time()
+    expires_at = now + _setting_float("HEAD_CACHE_TTL_SECONDS", HEAD_CACHE_TTL_SECONDS_DEFAULT)
+    with _head_cache_lock:
+        if len(_head_cache) >= HEAD_CACHE_MAX_ENTRIES:
+            for cached_key in [k for k, (exp, _) in _head_cache.items() if exp <= now]:
+                del _head_cache[cached_key]
+            if len(_head_cache) >= HEAD_CACHE_MAX_ENTRIES:
+                _head_cache.clear()
+        _head_cache[key] = (expires_at, head)
+
+
+def forget_object_metadata(key: str) -> None:
+    with _head_cache_lock:
+        _head_cache.pop(key, None)
+
+
+def cached_object_metadata(key: str) -> tuple[bool, Optional[dict]]:
+    return _cached_head(key)
+
+
+def record_object_metadata(key: str, head: Optional[dict]) -> None:
+    _remember_head(key, head)
+
+
+def record_object_uploaded(key: str) -> None:
+    forget_object_metadata(key)
+    if _listing_index is not None:
+        _listing_index.add_key(key)
+
+
+def record_object_deleted(key: str) -> None:
+    _remember_head(key, None)
+    if _listing_index is not None:
+        _listing_index.remove_key(key)
 
 
 def head_object(key: str) -> dict:
+    hit, head = _cached_head(key)
+    if hit:
+        if head is None:
+            raise FileNotFoundError(f"S3 object not found: {key}")
+        return head
     client = get_s3_client()
     config = _resolve_config()
     try:
-        return client.head_object(Bucket=config.bucket, Key=key)
+        head = client.head_object(Bucket=config.bucket, Key=key)
     except ClientError as exc:
-        raise FileNotFoundError(f"S3 object not found: {key}") from exc
+        if _is_not_found(exc):
+            _remember_head(key, None)
+            raise FileNotFoundError(f"S3 object not found: {key}") from exc
+        raise
+    _remember_head(key, head)
+    return head
 
 
 def object_exists(key: str) -> bool:
@@ -237,34 +567,317 @@ def object_exists(key: str) -> bool:
         return False
 
 
-def download_to_cache(key: str, refresh: bool = False, kind: str = "objects") -> str:
+def _cached_etag(cache_path: str, refresh: bool) -> Optional[str]:
+    if refresh or not os.path.exists(cache_path):
+        return None
+    return _read_text_file(_etag_path_for_cache(cache_path))
+
+
+def _cache_is_current(key: str, local_etag: Optional[str]) -> bool:
+    hit, head = _cached_head(key)
+    if not hit:
+        return False
+    if head is None:
+        raise FileNotFoundError(f"S3 object not found: {key}")
+    return bool(local_etag) and head.get("ETag", "").strip('"') == local_etag
+
+
+def cache_path_for(key: str, kind: str = "objects") -> str:
+    return _cache_path_for_key(key, kind)
+
+
+def cached_object_path(key: str, kind: str = "objects") -> Optional[str]:
+    cache_path = _cache_path_for_key(key, kind)
+    if not _cache_is_current(key, _cached_etag(cache_path, False)):
+        return None
+    _use_cached_file(cache_path, False)
+    return cache_path
+
+
+def open_cached_object(key: str, etag: str, kind: str = "objects"):
+    # Opened under the cache lock, where every refresh commits, so the handle
+    # holds the bytes of `etag` for as long as the caller reads: a later
+    # refresh or eviction replaces the path, not the open file.
+    cache_path = _cache_path_for_key(key, kind)
+    if not etag or not os.path.exists(cache_path):
+        return None
+    with cache_lock_for(cache_path):
+        if _cached_etag(cache_path, False) != etag:
+            return None
+        try:
+            handle = open(cache_path, "rb")
+        except FileNotFoundError:
+            return None
+    _use_cached_file(cache_path, False)
+    return handle
+
+
+def cached_etag_for(cache_path: str) -> Optional[str]:
+    return _cached_etag(cache_path, False)
+
+
+def cache_lock_for(cache_path: str) -> FileLock:
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    return FileLock(lock_path_for(cache_path))
+
+
+def commit_cached_file(cache_path: str, temp_path: str, etag: Optional[str]) -> None:
+    # Data first, sidecar second: a reader never pairs a new ETag with old bytes.
+    os.replace(temp_path, cache_path)
+    etag_path = _etag_path_for_cache(cache_path)
+    if etag:
+        _write_text_file(etag_path, etag)
+    elif os.path.exists(etag_path):
+        os.remove(etag_path)
+    _use_cached_file(cache_path, False, added=True)
+
+
+def offer_cached_file(key: str, temp_path: str, etag: str, kind: str = "objects") -> None:
+    # For bytes that were fetched anyway (e.g. streamed to a browser): kept
+    # unless another download already filled the cache.
+    cache_path = _cache_path_for_key(key, kind)
+    with cache_lock_for(cache_path):
+        if _cached_etag(cache_path, False) == etag:
+            os.remove(temp_path)
+            return
+        commit_cached_file(cache_path, temp_path, etag)
+
+
+def open_object_range(key: str, start: int, end: int, etag: Optional[str] = None):
+    config = _resolve_config()
+    request = {"Bucket": config.bucket, "Key": key, "Range": f"bytes={start}-{end}"}
+    if etag:
+        request["IfMatch"] = f'"{etag}"'
+    try:
+        return get_s3_client().get_object(**request)["Body"]
+    except ClientError as exc:
+        if _is_not_found(exc):
+            _remember_head(key, None)
+            raise FileNotFoundError(f"S3 object not found: {key}") from exc
+        raise
+
+
+def _get_range_pool() -> ThreadPoolExecutor:
+    global _range_pool
+    with _range_pool_lock:
+        if _range_pool is None:
+            _range_pool = ThreadPoolExecutor(max_workers=range_concurrency(), thread_name_prefix="s3io-range")
+        return _range_pool
+
+
+def parse_content_range_total(value: Optional[str]) -> Optional[int]:
+    if not value or "/" not in value:
+        return None
+    total = value.rsplit("/", 1)[1]
+    return int(total) if total.isdigit() else None
+
+
+def _write_body(body, handle) -> int:
+    written = 0
+    for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+        handle.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def _get_first_range(request: dict, chunk_size: int) -> dict:
+    client = get_s3_client()
+    try:
+        return client.get_object(Range=f"bytes=0-{chunk_size - 1}", **request)
+    except ClientError as exc:
+        # Empty objects cannot satisfy any range.
+        if _error_status(exc) != 416:
+            raise
+    return client.get_object(**request)
+
+
+def _fetch_range(key: str, etag: str, temp_path: str, start: int, end: int) -> None:
     client = get_s3_client()
     config = _resolve_config()
+    request = {"Bucket": config.bucket, "Key": key, "Range": f"bytes={start}-{end}"}
+    if etag:
+        request["IfMatch"] = f'"{etag}"'
+    response = client.get_object(**request)
+    with open(temp_path, "r+b") as handle:
+        handle.seek(start)
+        written = _write_body(response["Body"], handle)
+    if written != end - start + 1:
+        raise IOError(f"Short read for {key} bytes {start}-{end}: got {written} bytes")
+
+
+def _fetch_remaining_ranges(key: str, etag: str, temp_path: str, offset: int, total: int, chunk_size: int) -> None:
+    pool = _get_range_pool()
+    futures = [
+        pool.submit(_fetch_range, key, etag, temp_path, start, min(start + chunk_size, total) - 1)
+        for start in range(offset, total, chunk_size)
+    ]
+    done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+    for future in pending:
+        future.cancel()
+    wait(pending)
+    for future in futures:
+        if future.done() and not future.cancelled() and future.exception() is not None:
+            forget_object_metadata(key)
+            raise future.exception()
+
+
+def _fetch_to_cache(key: str, cache_path: str, refresh: bool) -> bool:
+    config = _resolve_config()
+    # Re-checked under the file lock: another process may have just filled it.
+    local_etag = _cached_etag(cache_path, refresh)
+    if not refresh and _cache_is_current(key, local_etag):
+        return False
+    request = {"Bucket": config.bucket, "Key": key}
+    if local_etag:
+        request["IfNoneMatch"] = f'"{local_etag}"'
+    chunk_size = range_chunk_size()
+    try:
+        response = _get_first_range(request, chunk_size)
+    except ClientError as exc:
+        if local_etag and _is_not_modified(exc):
+            return False
+        if _is_not_found(exc):
+            _remember_head(key, None)
+            raise FileNotFoundError(f"S3 object not found: {key}") from exc
+        raise
+    total = parse_content_range_total(response.get("ContentRange"))
+    head = {name: value for name, value in response.items() if name not in ("Body", "ContentRange")}
+    if total is not None:
+        head["ContentLength"] = total
+    _remember_head(key, head)
+    remote_etag = response.get("ETag", "").strip('"')
+    temp_path = temp_path_for(cache_path)
+    try:
+        with open(temp_path, "wb") as handle:
+            written = _write_body(response["Body"], handle)
+            if total is not None and total > written:
+                # Preallocate (sparse where supported) so ranges can land at their offsets.
+                handle.truncate(total)
+        if total is not None and total > written:
+            _fetch_remaining_ranges(key, remote_etag, temp_path, written, total, chunk_size)
+        if total is not None and os.path.getsize(temp_path) != total:
+            raise IOError(f"Incomplete download for {key}: expected {total} bytes")
+        commit_cached_file(cache_path, temp_path, remote_etag)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+def download_to_cache(key: str, refresh: bool = False, kind: str = "objects", pin: bool = False) -> str:
     cache_path = _cache_path_for_key(key, kind)
-    etag_path = _etag_path_for_cache(cache_path)
-    remote = head_object(key)
-    remote_etag = remote.get("ETag", "").strip('"')
-    local_etag = _read_text_file(etag_path)
-    if refresh or not os.path.exists(cache_path) or (remote_etag and local_etag != remote_etag):
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-        client.download_file(config.bucket, key, cache_path)
-        if remote_etag:
-            _write_text_file(etag_path, remote_etag)
+    if pin:
+        # Before the download, so the file cannot be evicted between being
+        # committed to the cache and being handed back.
+        _pin_cached_file(cache_path)
+    if not refresh and _cache_is_current(key, _cached_etag(cache_path, refresh)):
+        _use_cached_file(cache_path, pin)
+        return cache_path
+
+    def fetch() -> bool:
+        with cache_lock_for(cache_path):
+            return _fetch_to_cache(key, cache_path, refresh)
+
+    _download_flights.run(cache_path, fetch)
+    _use_cached_file(cache_path, pin)
     return cache_path
 
 
-def upload_file(local_path: str, key: str, content_type: Optional[str] = None, attempts: int = 3) -> None:
+def stream_video_enabled() -> bool:
+    return _setting_bool("STREAM_VIDEO", False)
+
+
+def _get_stream_server() -> StreamServer:
+    global _stream_server
+    with _stream_server_lock:
+        if _stream_server is None:
+            _stream_server = StreamServer(
+                idle_seconds=_setting_float("STREAM_IDLE_SECONDS", STREAM_IDLE_SECONDS_DEFAULT),
+            )
+        return _stream_server
+
+
+def open_object_stream(key: str, pin: bool = False) -> str:
+    head = head_object(key)
+    remote_etag = head.get("ETag", "").strip('"')
+    size = int(head.get("ContentLength") or 0)
+    chunk_size = range_chunk_size()
+    cache_path = _cache_path_for_key(key, "objects")
+    if size <= chunk_size or (remote_etag and _cached_etag(cache_path, False) == remote_etag):
+        return download_to_cache(key, pin=pin)
+    client = get_s3_client()
+    config = _resolve_config()
+    manager = _get_cache_manager()
+    stream_path = f"{temp_path_for(cache_path)}.{uuid.uuid4().hex[:8]}"
+
+    def fetch_range(start: int, end: int) -> bytes:
+        request = {"Bucket": config.bucket, "Key": key, "Range": f"bytes={start}-{end}"}
+        if remote_etag:
+            request["IfMatch"] = f'"{remote_etag}"'
+        return client.get_object(**request)["Body"].read()
+
+    def on_complete(stream_path: str) -> None:
+        # Link the finished stream into the cache; the session keeps reading its own copy.
+        with cache_lock_for(cache_path):
+            staged = temp_path_for(cache_path)
+            try:
+                os.link(stream_path, staged)
+            except OSError:
+                shutil.copyfile(stream_path, staged)
+            commit_cached_file(cache_path, staged, remote_etag)
+        if pin:
+            _pin_cached_file(cache_path)
+        # The cache entry now accounts for these bytes.
+        manager.unreserve(stream_path)
+
+    # The sparse file fills up to `size` as the decoder reads, so the whole
+    # size counts against the cache budget while the session lives.
+    manager.reserve(stream_path, size)
+    try:
+        download = ProgressiveDownload(
+            size,
+            chunk_size,
+            stream_path,
+            fetch_range,
+            on_complete,
+            read_ahead=STREAM_READ_AHEAD_CHUNKS,
+            content_type=head.get("ContentType"),
+            on_close=lambda: manager.unreserve(stream_path),
+        )
+    except BaseException:
+        manager.unreserve(stream_path)
+        raise
+    return _get_stream_server().register(download, _pinning_prompt() if pin else None)
+
+
+def download_file(key: str, local_path: str) -> None:
+    # Outside the cache, for bulk jobs that should not evict what users touch.
+    config = _resolve_config()
+    get_s3_client().download_file(config.bucket, key, local_path, Config=_transfer_config())
+
+
+def upload_file(
+    local_path: str,
+    key: str,
+    content_type: Optional[str] = None,
+    attempts: int = 3,
+    metadata: Optional[dict] = None,
+) -> None:
     client = get_s3_client()
     config = _resolve_config()
     extra_args = {}
     if content_type:
         extra_args["ContentType"] = content_type
+    if metadata:
+        extra_args["Metadata"] = metadata
     for attempt in range(attempts):
         try:
             if extra_args:
-                client.upload_file(local_path, config.bucket, key, ExtraArgs=extra_args)
+                client.upload_file(local_path, config.bucket, key, ExtraArgs=extra_args, Config=_transfer_config())
             else:
-                client.upload_file(local_path, config.bucket, key)
+                client.upload_file(local_path, config.bucket, key, Config=_transfer_config())
+            record_object_uploaded(key)
             return
         except ClientError:
             if attempt == attempts - 1:
@@ -272,23 +885,707 @@ def upload_file(local_path: str, key: str, content_type: Optional[str] = None, a
             time.sleep(0.5 * (attempt + 1))
 
 
-def _delete_cache_path(cache_path: str) -> None:
-    if os.path.exists(cache_path):
-        os.remove(cache_path)
-    etag_path = _etag_path_for_cache(cache_path)
-    if os.path.exists(etag_path):
-        os.remove(etag_path)
+def _get_fingerprint_cache() -> FingerprintCache:
+    global _fingerprint_cache
+    with _fingerprint_cache_lock:
+        if _fingerprint_cache is None:
+            _fingerprint_cache = FingerprintCache(
+                os.path.join(_get_state_dir(), "fingerprints.sqlite"),
+                max_entries=_setting_int("FINGERPRINT_CACHE_ENTRIES", FINGERPRINT_CACHE_ENTRIES_DEFAULT),
+                workers=_setting_int("HASH_WORKERS", HASH_WORKERS_DEFAULT),
+            )
+        return _fingerprint_cache
+
+
+def local_fingerprint(path: str) -> str:
+    return _get_fingerprint_cache().get(path)
+
+
+def remember_fingerprint(path: str, digest: str) -> None:
+    _get_fingerprint_cache().remember(path, digest)
+
+
+def fingerprint_metadata(local_path: str) -> dict:
+    return {FINGERPRINT_METADATA_KEY: local_fingerprint(local_path)}
+
+
+def sync_input_file(local_path: str, key: str) -> bool:
+    # Uploads only when S3 does not already hold these exact bytes; returns
+    # whether an upload happened.
+    metadata = fingerprint_metadata(local_path)
+    try:
+        head = head_object(key)
+    except FileNotFoundError:
+        head = None
+    if head is not None and (head.get("Metadata") or {}).get(FINGERPRINT_METADATA_KEY) == metadata[FINGERPRINT_METADATA_KEY]:
+        return False
+    upload_file(local_path, key, content_type=content_type_for_path(local_path), metadata=metadata)
+    return True
+
+
+def background_uploads_enabled() -> bool:
+    return _setting_bool("BACKGROUND_UPLOADS", True)
+
+
+def _notify_upload(event: dict) -> None:
+    try:
+        import server
+    except ImportError:
+        return
+    instance = getattr(server.PromptServer, "instance", None)
+    if instance is not None:
+        instance.send_sync("s3io.upload", event)
+
+
+def thumbnail_backfill_state_path() -> str:
+    config = _resolve_config()
+    return os.path.join(_get_state_dir(), f"thumb-backfill-{config.bucket}.json")
+
+
+def get_upload_sessions() -> UploadSessions:
+    global _upload_sessions
+    with _upload_sessions_lock:
+        if _upload_sessions is None:
+            config = _resolve_config()
+            _upload_sessions = UploadSessions(os.path.join(_get_state_dir(), f"upload-sessions-{config.bucket}.json"))
+        return _upload_sessions
+
+
+def get_direct_uploads() -> UploadSessions:
+    # Multipart uploads the browser sends straight to S3, keyed by upload id;
+    # kept on disk so a restart cannot orphan them.
+    global _direct_uploads
+    with _upload_sessions_lock:
+        if _direct_uploads is None:
+            config = _resolve_config()
+            _direct_uploads = UploadSessions(os.path.join(_get_state_dir(), f"direct-uploads-{config.bucket}.json"))
+        return _direct_uploads
+
+
+def abort_stale_uploads() -> int:
+    # Uploads a browser started and never finished, from this run or an
+    # earlier one. Direct uploads are stale once their part URLs expired.
+    try:
+        stale = get_direct_uploads().expire(2 * presign_expires_seconds())
+        stale += get_upload_sessions().expire(UPLOAD_SESSION_MAX_AGE_SECONDS)
+    except RuntimeError:
+        # S3 is not configured; there is nothing to abort.
+        return 0
+    for upload in stale:
+        try:
+            abort_multipart_upload(upload["key"], upload["upload_id"])
+        except Exception:
+            logger.warning("Aborting the unfinished upload of %s failed", upload["key"], exc_info=True)
+    return len(stale)
+
+
+def _get_upload_journal() -> UploadJournal:
+    global _upload_journal
+    with _upload_journal_lock:
+        if _upload_journal is None:
+            config = _resolve_config()
+            _upload_journal = UploadJournal(os.path.join(_get_state_dir(), f"uploads-{config.bucket}.json"))
+        return _upload_journal
+
+
+def _list_uploaded_parts(key: str, upload_id: str) -> Optional[dict[int, str]]:
+    # None when S3 no longer knows the upload (completed or aborted).
+    client = get_s3_client()
+    config = _resolve_config()
+    parts = {}
+    request = {"Bucket": config.bucket, "Key": key, "UploadId": upload_id}
+    while True:
+        try:
+            response = client.list_parts(**request)
+        except ClientError as exc:
+            if _is_not_found(exc) or exc.response.get("Error", {}).get("Code") == "NoSuchUpload":
+                return None
+            raise
+        for part in response.get("Parts", []):
+            parts[part["PartNumber"]] = part["ETag"].strip('"')
+        if not response.get("IsTruncated"):
+            return parts
+        request["PartNumberMarker"] = response["NextPartNumberMarker"]
+
+
+def create_multipart_upload(key: str, content_type: Optional[str] = None, metadata: Optional[dict] = None) -> str:
+    config = _resolve_config()
+    request = {"Bucket": config.bucket, "Key": key}
+    if content_type:
+        request["ContentType"] = content_type
+    if metadata:
+        request["Metadata"] = metadata
+    return get_s3_client().create_multipart_upload(**request)["UploadId"]
+
+
+def complete_multipart_upload(key: str, upload_id: str, parts: list[tuple[int, str]]) -> None:
+    config = _resolve_config()
+    get_s3_client().complete_multipart_upload(
+        Bucket=config.bucket,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={"Parts": [{"PartNumber": number, "ETag": f'"{etag}"'} for number, etag in sorted(parts)]},
+    )
+    record_object_uploaded(key)
+
+
+def presigned_get_url(key: str, etag: str) -> str:
+    # Handing out the same URL for an unchanged object lets the browser cache it.
+    expires = presign_expires_seconds()
+    margin = min(PRESIGNED_URL_MARGIN_SECONDS, expires / 2)
+    now = time.time()
+    with _presigned_urls_lock:
+        cached = _presigned_urls.get((key, etag))
+        if cached is not None and cached[0] - now > margin:
+            _presigned_urls.move_to_end((key, etag))
+            return cached[1]
+    config = _resolve_config()
+    url = get_s3_client().generate_presigned_url(
+        "get_object", Params={"Bucket": config.bucket, "Key": key}, ExpiresIn=expires
+    )
+    with _presigned_urls_lock:
+        _presigned_urls[(key, etag)] = (now + expires, url)
+        _presigned_urls.move_to_end((key, etag))
+        while len(_presigned_urls) > PRESIGNED_URL_CACHE_MAX_ENTRIES:
+            _presigned_urls.popitem(last=False)
+    return url
+
+
+def presign_upload_parts(key: str, upload_id: str, part_count: int) -> list[str]:
+    # Presigning is local signing work; no request reaches S3 here.
+    config = _resolve_config()
+    client = get_s3_client()
+    expires = presign_expires_seconds()
+    return [
+        client.generate_presigned_url(
+            "upload_part",
+            Params={"Bucket": config.bucket, "Key": key, "UploadId": upload_id, "PartNumber": number},
+            ExpiresIn=expires,
+        )
+        for number in range(1, part_count + 1)
+    ]
+
+
+def abort_multipart_upload(key: str, upload_id: str) -> None:
+    config = _resolve_config()
+    try:
+        get_s3_client().abort_multipart_upload(Bucket=config.bucket, Key=key, UploadId=upload_id)
+    except ClientError:
+        pass
+
+
+def _upload_part(local_path: str, key: str, upload_id: str, number: int, part_size: int) -> str:
+    with open(local_path, "rb") as handle:
+        handle.seek((number - 1) * part_size)
+        data = handle.read(part_size)
+    return upload_part_data(key, upload_id, number, data)
+
+
+def upload_part_data(key: str, upload_id: str, number: int, data: bytes) -> str:
+    config = _resolve_config()
+    response = get_s3_client().upload_part(
+        Bucket=config.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data
+    )
+    return response["ETag"].strip('"')
+
+
+def _journaled_upload_landed(key: str, entry: dict, size: int) -> bool:
+    # The upload vanished from S3's in-progress list: it was either completed
+    # just before the crash or aborted. Only a matching object means completed.
+    forget_object_metadata(key)
+    try:
+        head = head_object(key)
+    except FileNotFoundError:
+        return False
+    modified = head.get("LastModified")
+    if modified is None or int(head.get("ContentLength") or 0) != size:
+        return False
+    return modified.timestamp() >= entry["created_at"] - JOURNAL_CLOCK_SKEW_SECONDS
+
+
+def _start_multipart(journal: UploadJournal, entry_id: str, entry: dict, stat: os.stat_result) -> dict:
+    config = _resolve_config()
+    request = {"Bucket": config.bucket, "Key": entry["key"]}
+    if entry["content_type"]:
+        request["ContentType"] = entry["content_type"]
+    upload_id = get_s3_client().create_multipart_upload(**request)["UploadId"]
+    part_size = multipart_part_size(stat.st_size)
+    journal.update(
+        entry_id,
+        upload_id=upload_id,
+        part_size=part_size,
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        parts={},
+    )
+    return journal.get(entry_id)
+
+
+def _write_exclusive(write, exclusive: bool, **request):
+    # `exclusive` writes send If-None-Match so they fail with 412 instead of
+    # replacing an object another writer created. Stores without conditional
+    # writes answer 501; from then on they get unconditional ones.
+    global _conditional_writes_supported
+    if exclusive and _conditional_writes_supported:
+        try:
+            return write(IfNoneMatch="*", **request)
+        except ClientError as exc:
+            if not _is_not_implemented(exc):
+                raise
+            _conditional_writes_supported = False
+            logger.warning("The S3 store does not support conditional writes; outputs may overwrite each other")
+        body = request.get("Body")
+        if hasattr(body, "seek"):
+            body.seek(0)
+    return write(**request)
+
+
+def _put_body(body, key: str, content_type: Optional[str], exclusive: bool) -> None:
+    config = _resolve_config()
+    request = {"Bucket": config.bucket, "Key": key}
+    if content_type:
+        request["ContentType"] = content_type
+    _write_exclusive(get_s3_client().put_object, exclusive, Body=body, **request)
+    record_object_uploaded(key)
+
+
+def _put_file(local_path: str, key: str, content_type: Optional[str], exclusive: bool) -> None:
+    with open(local_path, "rb") as handle:
+        _put_body(handle, key, content_type, exclusive)
+
+
+def _put_bytes(data: bytes, key: str, content_type: Optional[str], exclusive: bool) -> None:
+    transfer = _transfer_config()
+    if len(data) < transfer.multipart_threshold:
+        _put_body(data, key, content_type, exclusive)
+        return
+    client = get_s3_client()
+    config = _resolve_config()
+    request = {"Bucket": config.bucket, "Key": key}
+    if content_type:
+        request["ContentType"] = content_type
+    upload_id = client.create_multipart_upload(**request)["UploadId"]
+    part_size = multipart_part_size(len(data))
+    try:
+        pool = _get_part_pool()
+        futures = [
+            _submit(
+                pool,
+                client.upload_part,
+                Bucket=config.bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=data[offset:offset + part_size],
+            )
+            for number, offset in enumerate(range(0, len(data), part_size), start=1)
+        ]
+        try:
+            parts = [{"PartNumber": number, "ETag": future.result()["ETag"]} for number, future in enumerate(futures, start=1)]
+        finally:
+            # The parts still in flight must not land after the abort.
+            for future in futures:
+                future.cancel()
+            wait(futures)
+        complete = {"Bucket": config.bucket, "Key": key, "UploadId": upload_id, "MultipartUpload": {"Parts": parts}}
+        _write_exclusive(client.complete_multipart_upload, exclusive, **complete)
+    except BaseException:
+        abort_multipart_upload(key, upload_id)
+        raise
+    record_object_uploaded(key)
+
+
+def _upload_journaled(journal: UploadJournal, entry_id: str) -> None:
+    entry = journal.get(entry_id)
+    local_path, key = entry["local_path"], entry["key"]
+    stat = os.stat(local_path)
+    if stat.st_size < _transfer_config().multipart_threshold:
+        if entry["upload_id"]:
+            abort_multipart_upload(key, entry["upload_id"])
+            journal.update(entry_id, upload_id=None, parts={})
+        _put_file(local_path, key, entry["content_type"], entry["exclusive"])
+        return
+    parts = None
+    if entry["upload_id"]:
+        if (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            abort_multipart_upload(key, entry["upload_id"])
+        else:
+            parts = _list_uploaded_parts(key, entry["upload_id"])
+            if parts is None and _journaled_upload_landed(key, entry, stat.st_size):
+                record_object_uploaded(key)
+                return
+    if parts is None:
+        entry = _start_multipart(journal, entry_id, entry, stat)
+        parts = {}
+    upload_id, part_size = entry["upload_id"], entry["part_size"]
+    part_count = max(1, -(-stat.st_size // part_size))
+    missing = [number for number in range(1, part_count + 1) if number not in parts]
+    error = None
+    pool = _get_part_pool()
+    futures = {
+        _submit(pool, _upload_part, local_path, key, upload_id, number, part_size): number
+        for number in missing
+    }
+    # Record every part that made it, even after a failure, so a resume
+    # only re-sends what is actually missing.
+    for future in as_completed(futures):
+        if future.cancelled():
+            continue
+        number = futures[future]
+        try:
+            parts[number] = future.result()
+        except Exception as exc:
+            if error is None:
+                error = exc
+                for pending in futures:
+                    pending.cancel()
+            continue
+        journal.add_part(entry_id, number, parts[number])
+    if error is not None:
+        raise error
+    config = _resolve_config()
+    request = {
+        "Bucket": config.bucket,
+        "Key": key,
+        "UploadId": upload_id,
+        "MultipartUpload": {
+            "Parts": [{"PartNumber": number, "ETag": f'"{parts[number]}"'} for number in sorted(parts)]
+        },
+    }
+    try:
+        _write_exclusive(get_s3_client().complete_multipart_upload, entry["exclusive"], **request)
+    except ClientError as exc:
+        if _is_precondition_failed(exc):
+            # The parts belong to a key someone else now owns.
+            abort_multipart_upload(key, upload_id)
+            journal.update(entry_id, upload_id=None, parts={})
+        raise
+    record_object_uploaded(key)
+
+
+class _NameTaken(Exception):
+    pass
+
+
+def _run_queued_upload(job: UploadJob) -> None:
+    for attempt in range(UPLOAD_RETRIES + 1):
+        try:
+            _run_queued_upload_once(job)
+            return
+        except (FileNotFoundError, _NameTaken):
+            raise
+        except Exception:
+            if attempt == UPLOAD_RETRIES:
+                if job.journal_id is not None:
+                    _get_upload_journal().record_failure(job.journal_id)
+                raise
+            delay = UPLOAD_RETRY_BACKOFF_SECONDS * 2 ** attempt
+            logger.warning("S3 upload of %s failed, retrying in %.0f s", job.key, delay, exc_info=True)
+            time.sleep(delay)
+
+
+def _run_queued_upload_once(job: UploadJob) -> None:
+    if job.data is not None:
+        for attempt in range(OUTPUT_NAME_ATTEMPTS):
+            try:
+                _put_bytes(job.data, job.key, job.content_type, job.exclusive)
+                return
+            except ClientError as exc:
+                if not job.exclusive or not _is_precondition_failed(exc) or attempt == OUTPUT_NAME_ATTEMPTS - 1:
+                    raise
+                job.key = _reallocate_output_keys([job.key])[0]
+    if job.journal_id is None:
+        upload_file(job.local_path, job.key, content_type=job.content_type)
+        return
+    journal = _get_upload_journal()
+    entry = journal.get(job.journal_id)
+    if entry is None or entry["uploaded"]:
+        return
+    job.key = entry["key"]
+    try:
+        _upload_journaled(journal, job.journal_id)
+    except FileNotFoundError:
+        # The output is gone; nothing left to deliver.
+        if entry["upload_id"]:
+            abort_multipart_upload(entry["key"], entry["upload_id"])
+        journal.remove(job.journal_id)
+        raise
+    except ClientError as exc:
+        if entry["exclusive"] and _is_precondition_failed(exc):
+            # Another writer took the name between allocation and upload.
+            raise _NameTaken(job.key) from exc
+        raise
+    # Removed from the journal once the rest of its group is done too.
+    journal.update(job.journal_id, uploaded=True)
+
+
+def _run_upload_group(jobs: list[UploadJob]) -> list[Optional[BaseException]]:
+    # A group is one job, or journaled outputs named together (a video and
+    # its preview image). If another writer took any of the group's names,
+    # the whole group moves to its next free suffix.
+    journal = None if jobs[0].journal_id is None else _get_upload_journal()
+    for attempt in range(OUTPUT_NAME_ATTEMPTS):
+        errors: list[Optional[BaseException]] = []
+        for index, job in enumerate(jobs):
+            try:
+                _run_queued_upload(job)
+            except _NameTaken as exc:
+                errors.extend([exc] * (len(jobs) - index))
+                break
+            except Exception as exc:
+                errors.append(exc)
+                continue
+            errors.append(None)
+        if journal is None or attempt == OUTPUT_NAME_ATTEMPTS - 1:
+            break
+        if not any(isinstance(error, _NameTaken) for error in errors):
+            break
+        try:
+            _reallocate_upload_group(journal, jobs)
+        except Exception as exc:
+            return [exc] * len(jobs)
+    if journal is None:
+        return errors
+    if all(error is None or isinstance(error, FileNotFoundError) for error in errors):
+        for job in jobs:
+            journal.remove(job.journal_id)
+    elif any(isinstance(error, _NameTaken) for error in errors):
+        # Counts towards giving up, like any other failed run.
+        journal.record_failure(jobs[0].journal_id)
+    return errors
+
+
+def _reallocate_upload_group(journal: UploadJournal, jobs: list[UploadJob]) -> None:
+    new_keys = _reallocate_output_keys([job.key for job in jobs])
+    for job, new_key in zip(jobs, new_keys):
+        entry = journal.get(job.journal_id)
+        if entry is None:
+            continue
+        if entry["upload_id"]:
+            abort_multipart_upload(entry["key"], entry["upload_id"])
+        if entry["uploaded"]:
+            # Written by this group under the old name; it moves with the rest.
+            delete_object(entry["key"])
+        journal.update(job.journal_id, key=new_key, upload_id=None, parts={}, uploaded=False)
+        job.key = new_key
+
+
+def _get_transfer_pool() -> ThreadPoolExecutor:
+    # Shared by every batch so concurrent files stay within MAX_CONCURRENCY.
+    # Multipart parts run on the part pool, so a file never waits on a slot
+    # held by another file.
+    global _transfer_pool
+    with _transfer_pool_lock:
+        if _transfer_pool is None:
+            workers = max(1, _transfer_config().max_concurrency)
+            _transfer_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3io-transfer")
+        return _transfer_pool
+
+
+def _get_part_pool() -> ThreadPoolExecutor:
+    # One pool for the parts of every multipart upload, so the files of a
+    # batch split MAX_CONCURRENCY part transfers between them instead of
+    # each opening that many.
+    global _part_pool
+    with _transfer_pool_lock:
+        if _part_pool is None:
+            workers = max(1, _transfer_config().max_concurrency)
+            _part_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3io-part")
+        return _part_pool
+
+
+def _submit(pool: ThreadPoolExecutor, fn, *args, **kwargs) -> Future:
+    # Executors refuse new work once interpreter shutdown has begun, which is
+    # when the atexit drain runs; the work then runs on the calling thread.
+    try:
+        return pool.submit(fn, *args, **kwargs)
+    except RuntimeError:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return future
+
+
+def _run_upload_batch(jobs: list[UploadJob]) -> list[Optional[BaseException]]:
+    groups: dict[object, list[UploadJob]] = {}
+    for job in jobs:
+        groups.setdefault(job.group or id(job), []).append(job)
+    if len(groups) == 1:
+        results = [_run_upload_group(jobs)]
+    else:
+        futures = [_submit(_get_transfer_pool(), _run_upload_group, group) for group in groups.values()]
+        results = [future.result() for future in futures]
+    errors = {
+        id(job): error
+        for group, group_errors in zip(groups.values(), results)
+        for job, error in zip(group, group_errors)
+    }
+    return [errors[id(job)] for job in jobs]
+
+
+def _get_upload_queue() -> UploadQueue:
+    global _upload_queue
+    with _upload_queue_lock:
+        if _upload_queue is None:
+            _upload_queue = UploadQueue(
+                _run_upload_batch,
+                workers=_setting_int("UPLOAD_WORKERS", UPLOAD_WORKERS_DEFAULT),
+                max_pending=_setting_int("UPLOAD_QUEUE_SIZE", UPLOAD_QUEUE_SIZE_DEFAULT),
+                notify=_notify_upload,
+                max_pending_bytes=_setting_int("UPLOAD_QUEUE_MB", UPLOAD_QUEUE_MB_DEFAULT) * 1024 * 1024,
+            )
+            # Outputs queued before shutdown still reach S3.
+            atexit.register(drain_uploads)
+        return _upload_queue
+
+
+def drain_uploads() -> None:
+    # Shutdown waits this long at most; journaled uploads left behind are
+    # picked up again by resume_pending_uploads on the next start.
+    if _upload_queue is not None:
+        _upload_queue.drain(timeout=_setting_float("UPLOAD_DRAIN_SECONDS", UPLOAD_DRAIN_SECONDS_DEFAULT))
+
+
+def enqueue_uploads(
+    items: list[tuple[str, str, Optional[str]]],
+    exclusive: bool = False,
+    grouped: bool = False,
+) -> None:
+    # `items` are (local_path, key, content_type) and are uploaded concurrently.
+    # `exclusive` uploads never overwrite: a name taken meanwhile by another
+    # writer is replaced with the next free one. `grouped` items were named
+    # together and are renamed together.
+    if not items:
+        return
+    resume_pending_uploads()
+    group = uuid.uuid4().hex if grouped else None
+    journal_ids = _get_upload_journal().add_many(items, exclusive, group)
+    prompt_id = _current_prompt_id()
+    jobs = [
+        UploadJob(local_path, key, content_type, prompt_id, journal_id, group=group)
+        for (local_path, key, content_type), journal_id in zip(items, journal_ids)
+    ]
+    if background_uploads_enabled():
+        _get_upload_queue().submit(jobs)
+        return
+    errors = [error for error in _run_upload_batch(jobs) if error is not None]
+    if errors:
+        raise errors[0]
+
+
+def enqueue_data_uploads(items: list[tuple[bytes, str, Optional[str]]], exclusive: bool = False) -> None:
+    # In-memory counterpart of enqueue_uploads for outputs that never touch
+    # disk. There is no file to resume from, so these are not journaled.
+    if not items:
+        return
+    prompt_id = _current_prompt_id()
+    jobs = [
+        UploadJob(None, key, content_type, prompt_id, data=data, exclusive=exclusive)
+        for data, key, content_type in items
+    ]
+    if background_uploads_enabled():
+        _get_upload_queue().submit(jobs)
+        return
+    errors = [error for error in _run_upload_batch(jobs) if error is not None]
+    if errors:
+        raise errors[0]
+
+
+def save_local_output_enabled() -> bool:
+    return _setting_bool("SAVE_LOCAL_OUTPUT", True)
+
+
+def output_preview_dir() -> str:
+    # Where previews of outputs kept only in S3 go, under ComfyUI's temp directory.
+    return os.path.join(folder_paths.get_temp_directory(), "s3-io", "output")
+
+
+def output_preview_path(subfolder: str, filename: str) -> tuple[str, str, str]:
+    # (path, temp subfolder, filename) for a UI preview of an output kept only in S3.
+    temp_dir = folder_paths.get_temp_directory()
+    rel_dir = os.path.relpath(os.path.join(output_preview_dir(), subfolder), temp_dir)
+    os.makedirs(os.path.join(temp_dir, rel_dir), exist_ok=True)
+    return os.path.join(temp_dir, rel_dir, filename), rel_dir.replace(os.sep, "/"), filename
+
+
+def next_output_counter(subfolder: str, filename_prefix: str) -> int:
+    # Mirrors ComfyUI's local counter, but over the S3 output folder. A
+    # %batch_num% left in the prefix matches any batch number.
+    pattern = re.compile(
+        r"\d+".join(re.escape(part) for part in filename_prefix.split("%batch_num%")) + r"_(\d+)_"
+    )
+    counters = [
+        int(match.group(1))
+        for name in _get_name_allocator().names(output_key_for(subfolder, ""))
+        if (match := pattern.match(name))
+    ]
+    return max(counters, default=0) + 1
+
+
+def queued_upload(key: str) -> Optional[UploadJob]:
+    if _upload_queue is None:
+        return None
+    return _upload_queue.job(key)
+
+
+def resume_pending_uploads() -> int:
+    # Runs once per process, before this session journals anything, so only
+    # uploads left over from a previous run are picked up.
+    global _journal_resumed
+    with _journal_resume_lock:
+        if _journal_resumed:
+            return 0
+        _journal_resumed = True
+        try:
+            journal = _get_upload_journal()
+        except RuntimeError:
+            # S3 is not configured; there is nothing to resume.
+            return 0
+        entries = journal.entries()
+        abandoned = {
+            entry["group"] or entry_id
+            for entry_id, entry in entries.items()
+            if entry["failures"] >= UPLOAD_RESUME_LIMIT
+        }
+        jobs = []
+        for entry_id, entry in entries.items():
+            if (entry["group"] or entry_id) in abandoned:
+                # Its whole group goes, so the outputs keep matching names.
+                logger.error("Giving up on the S3 upload of %s after repeated failures", entry["key"])
+                if entry["upload_id"]:
+                    abort_multipart_upload(entry["key"], entry["upload_id"])
+                journal.remove(entry_id)
+                continue
+            jobs.append(
+                UploadJob(entry["local_path"], entry["key"], entry["content_type"], None, entry_id, group=entry["group"])
+            )
+    if not jobs:
+        return 0
+    if background_uploads_enabled():
+        _get_upload_queue().submit(jobs)
+    else:
+        for error in _run_upload_batch(jobs):
+            if error is not None:
+                logger.error("Resumed S3 upload failed", exc_info=error)
+    return len(jobs)
+
+
+def upload_status(prompt_id: Optional[str]) -> dict:
+    return _get_upload_queue().status(prompt_id)
 
 
 def delete_cached_object(key: str, kind: str = "objects") -> None:
     cache_path = _cache_path_for_key(key, kind)
-    _delete_cache_path(cache_path)
+    _get_cache_manager().remove(cache_path)
 
 
 def delete_object(key: str) -> None:
     client = get_s3_client()
     config = _resolve_config()
     client.delete_object(Bucket=config.bucket, Key=key)
+    record_object_deleted(key)
 
 
 def input_key_for(name: str) -> str:
@@ -312,22 +1609,49 @@ def output_key_for(subfolder: str, filename: str) -> str:
     return _join_prefix(config.output_prefix, filename)
 
 
-def _apply_suffix(filename: str, suffix: int) -> str:
-    if suffix <= 0:
-        return filename
-    stem, ext = os.path.splitext(filename)
-    return f"{stem} ({suffix}){ext}"
+def _list_folder_names(prefix: str) -> list[str]:
+    client = get_s3_client()
+    config = _resolve_config()
+    paginator = client.get_paginator("list_objects_v2")
+    names = []
+    for page in paginator.paginate(Bucket=config.bucket, Prefix=prefix, Delimiter="/"):
+        for item in page.get("Contents", []):
+            names.append(item["Key"][len(prefix):])
+    return names
+
+
+def _get_name_allocator() -> NameAllocator:
+    global _name_allocator
+    with _name_allocator_lock:
+        if _name_allocator is None:
+            _name_allocator = NameAllocator(
+                _list_folder_names,
+                ttl_seconds=_setting_float("LIST_TTL_SECONDS", LIST_TTL_SECONDS_DEFAULT),
+            )
+        return _name_allocator
+
+
+def _reallocate_output_keys(keys: list[str]) -> list[str]:
+    # The keys of one group, which share a folder.
+    folder, _ = keys[0].rsplit("/", 1) if "/" in keys[0] else ("", keys[0])
+    folder = folder + "/" if folder else ""
+    names = [key[len(folder):] for key in keys]
+    return [folder + name for name in _get_name_allocator().reallocate(folder, names)]
 
 
 def resolve_unique_output_filenames(subfolder: str, filenames: Iterable[str]) -> tuple[list[str], list[str]]:
-    names = list(filenames)
-    suffix = 0
-    while True:
-        candidate_names = [_apply_suffix(name, suffix) for name in names]
-        candidate_keys = [output_key_for(subfolder, name) for name in candidate_names]
-        if not any(object_exists(key) for key in candidate_keys):
-            return candidate_names, candidate_keys
-        suffix += 1
+    # Names come from one listing per output folder plus the names handed out
+    # since; conditional writes (see enqueue_uploads) catch other writers.
+    folder = output_key_for(subfolder, "")
+    names = _get_name_allocator().allocate(folder, list(filenames))
+    return names, [folder + name for name in names]
+
+
+def allocate_output_filenames(subfolder: str, filenames: Iterable[str]) -> tuple[list[str], list[str]]:
+    # Like resolve_unique_output_filenames, but each name gets its own suffix.
+    folder = output_key_for(subfolder, "")
+    names = _get_name_allocator().allocate_each(folder, list(filenames))
+    return names, [folder + name for name in names]
 
 
 def thumb_key_for(source_key: str) -> str:
@@ -336,44 +1660,85 @@ def thumb_key_for(source_key: str) -> str:
     return _join_prefix(config.thumb_prefix, base + ".jpg")
 
 
-def ensure_thumbnail(local_path: str, source_key: str) -> str:
+def make_thumbnail(local_path: str, source_key: str, pin: bool = False, refresh: bool = False) -> tuple[str, str]:
     thumb_key = thumb_key_for(source_key)
     thumb_path = _cache_path_for_key(thumb_key, "thumbs")
-    if not os.path.exists(thumb_path):
+    if os.path.exists(thumb_path) and not refresh:
+        _use_cached_file(thumb_path, pin)
+    else:
         os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
-        with Image.open(local_path) as img:
-            img = ImageOps.exif_transpose(img)
-            if img.mode not in ("RGB", "L"):
-                img = img.convert("RGB")
-            img.thumbnail((THUMB_MAX_SIZE, THUMB_MAX_SIZE), Image.LANCZOS)
-            img.save(thumb_path, "JPEG", quality=85, optimize=True)
-    upload_file(thumb_path, thumb_key, content_type="image/jpeg")
+        temp_path = temp_path_for(thumb_path)
+        render_thumbnail(local_path, temp_path, THUMB_MAX_SIZE)
+        os.replace(temp_path, thumb_path)
+        _use_cached_file(thumb_path, pin, added=True)
+    return thumb_path, thumb_key
+
+
+def cached_thumbnail(source_key: str) -> Optional[tuple[str, str]]:
+    thumb_key = thumb_key_for(source_key)
+    thumb_path = _cache_path_for_key(thumb_key, "thumbs")
+    if not os.path.exists(thumb_path):
+        return None
+    _use_cached_file(thumb_path, False)
+    return thumb_path, thumb_key
+
+
+def get_thumbnail_pool() -> ThreadPoolExecutor:
+    # Kept apart from the server workers so a burst of decodes cannot stall
+    # the routes' S3 and file work.
+    global _thumb_pool
+    with _thumb_pool_lock:
+        if _thumb_pool is None:
+            workers = max(1, _setting_int("THUMB_WORKERS", THUMB_WORKERS_DEFAULT))
+            _thumb_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3io-thumb")
+        return _thumb_pool
+
+
+def ensure_thumbnail(local_path: str, source_key: str, pin: bool = False, refresh: bool = False) -> str:
+    # A cached thumbnail was either downloaded from S3 or uploaded when it was
+    # made, so only a new one needs uploading.
+    cached = not refresh and os.path.exists(_cache_path_for_key(thumb_key_for(source_key), "thumbs"))
+    thumb_path, thumb_key = make_thumbnail(local_path, source_key, pin=pin, refresh=refresh)
+    if not cached:
+        upload_file(thumb_path, thumb_key, content_type="image/jpeg")
     return thumb_path
 
 
-def local_temp_preview_path(source_path: str) -> tuple[str, str]:
-    temp_dir = folder_paths.get_temp_directory()
-    if source_path.startswith(temp_dir):
+def _preview_dir_name(source_path: str, key: Optional[str]) -> str:
+    # Same key and ETag (or same local file state) -> same preview path, so a
+    # changed object or another key with the same filename never reuses it.
+    etag = cached_etag_for(source_path) if key else None
+    if etag:
+        identity = f"{key}\0{etag}"
+    else:
+        stat = os.stat(source_path)
+        identity = f"{key or os.path.abspath(source_path)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+
+
+def local_temp_preview_path(source_path: str, key: Optional[str] = None) -> tuple[str, str]:
+    temp_dir = os.path.abspath(folder_paths.get_temp_directory())
+    source_path = os.path.abspath(source_path)
+    if os.path.commonpath((temp_dir, source_path)) == temp_dir:
         rel = os.path.relpath(source_path, temp_dir)
         return os.path.dirname(rel), os.path.basename(rel)
-    filename = os.path.basename(source_path)
-    preview_dir = os.path.join(temp_dir, "s3-io", "preview")
-    os.makedirs(preview_dir, exist_ok=True)
-    preview_path = os.path.join(preview_dir, filename)
-    if source_path != preview_path:
-        if not os.path.exists(preview_path):
-            with open(source_path, "rb") as src, open(preview_path, "wb") as dst:
-                dst.write(src.read())
+    preview_dir = os.path.join(temp_dir, "s3-io", "preview", _preview_dir_name(source_path, key))
+    preview_path = os.path.join(preview_dir, os.path.basename(source_path))
+    if not os.path.exists(preview_path):
+        os.makedirs(preview_dir, exist_ok=True)
+        temp_path = temp_path_for(preview_path)
+        try:
+            link_or_copy(source_path, temp_path)
+            os.replace(temp_path, preview_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        manager = _get_cache_manager()
+        # A hardlink of a cache entry shares its bytes and is removed with it;
+        # a copy in the cache directory is an entry of its own.
+        linked = os.path.samefile(source_path, preview_path) and manager.link(source_path, preview_path)
+        if not linked and os.path.commonpath((manager.root, preview_path)) == manager.root:
+            manager.add(preview_path)
     rel = os.path.relpath(preview_path, temp_dir)
     return os.path.dirname(rel), os.path.basename(rel)
-
-
-def file_hash(path: str) -> str:
-    m = hashlib.sha256()
-    with open(path, "rb") as handle:
-        while True:
-            chunk = handle.read(1024 * 1024)
-            if not chunk:
-                break
-            m.update(chunk)
-    return m.digest().hex()
@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+import uuid
+from typing import Optional
+
+from .s3_cache import write_json_atomic
+
+
+class UploadJournal:
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = {}
+        self._load()
+
+    def add_many(
+        self,
+        items: list[tuple[str, str, Optional[str]]],
+        exclusive: bool = False,
+        group: Optional[str] = None,
+    ) -> list[str]:
+        entry_ids = []
+        with self._lock:
+            for local_path, key, content_type in items:
+                entry_id = uuid.uuid4().hex
+                self._entries[entry_id] = {
+                    "local_path": local_path,
+                    "key": key,
+                    "content_type": content_type,
+                    "exclusive": exclusive,
+                    "group": group,
+                    "created_at": time.time(),
+                    "upload_id": None,
+                    "part_size": None,
+                    "size": None,
+                    "mtime_ns": None,
+                    "parts": {},
+                    "failures": 0,
+                    "uploaded": False,
+                }
+                entry_ids.append(entry_id)
+            self._save()
+        return entry_ids
+
+    def get(self, entry_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            return None if entry is None else dict(entry, parts=dict(entry["parts"]))
+
+    def entries(self) -> dict[str, dict]:
+        with self._lock:
+            return {entry_id: dict(entry, parts=dict(entry["parts"])) for entry_id, entry in self._entries.items()}
+
+    def update(self, entry_id: str, **fields) -> None:
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return
+            entry.update(fields)
+            self._save()
+
+    def add_part(self, entry_id: str, number: int, etag: str) -> None:
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return
+            entry["parts"][str(number)] = etag
+            self._save()
+
+    def record_failure(self, entry_id: str) -> None:
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return
+            entry["failures"] += 1
+            self._save()
+
+    def remove(self, entry_id: str) -> None:
+        with self._lock:
+            if self._entries.pop(entry_id, None) is not None:
+                self._save()
+
+    def _load(self) -> None:
+        try:
+            with open(self._path, "r", encoding="utf-8") as handle:
+                state = json.load(handle)
+        except (FileNotFoundError, ValueError):
+            return
+        for entry_id, entry in state.get("uploads", {}).items():
+            if entry.get("local_path") and entry.get("key"):
+                entry.setdefault("parts", {})
+                entry.setdefault("exclusive", False)
+                entry.setdefault("failures", 0)
+                entry.setdefault("group", None)
+                entry.setdefault("uploaded", False)
+                self._entries[entry_id] = entry
+
+    def _save(self) -> None:
+        # Called with the lock held so snapshots reach disk in order; durable
+        # because the journal exists to survive the machine going away.
+        write_json_atomic(self._path, {"uploads": self._entries}, durable=True)
@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Optional
+
+from .s3_cache import write_json_atomic
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _PrefixListing:
+    scanned_at: float
+    by_extension: dict[str, set[str]] = field(default_factory=dict)
+
+    def apply(self, rel: str, present: bool) -> None:
+        if present:
+            self.by_extension.setdefault(_extension_of(rel), set()).add(rel)
+        else:
+            self.by_extension.get(_extension_of(rel), set()).discard(rel)
+
+
+def _extension_of(rel: str) -> str:
+    return os.path.splitext(rel)[1].lower().lstrip(".")
+
+
+class ListingIndex:
+    def __init__(
+        self,
+        scan: Callable[[str], list[str]],
+        ttl_seconds: float,
+        state_path: Optional[str] = None,
+    ):
+        self._scan = scan
+        self._ttl_seconds = ttl_seconds
+        self._state_path = state_path
+        self._lock = threading.Lock()
+        self._scan_locks: dict[str, threading.Lock] = {}
+        self._refreshing: set[str] = set()
+        self._listings: dict[str, _PrefixListing] = {}
+        # Keys added or removed while a prefix is being scanned, replayed on
+        # top of the scan so they are not lost when it replaces the listing.
+        self._journals: dict[str, list[tuple[str, bool]]] = {}
+        self._loaded = False
+
+    def get(self, prefix: str, extensions: Iterable[str], refresh: bool = False) -> list[str]:
+        normalized_exts = {ext.lower().lstrip(".") for ext in extensions}
+        if refresh:
+            self.rescan(prefix)
+        listing = self._listing_for(prefix)
+        if self._is_stale(listing):
+            self._refresh_in_background(prefix)
+        with self._lock:
+            results = []
+            for ext in normalized_exts:
+                results.extend(listing.by_extension.get(ext, ()))
+        return sorted(results)
+
+    def add_key(self, key: str) -> None:
+        self._record(key, True)
+
+    def remove_key(self, key: str) -> None:
+        self._record(key, False)
+
+    def rescan(self, prefix: str) -> None:
+        # Synchronous refresh, for callers that must not act on a stale snapshot.
+        self._load_state()
+        with self._lock:
+            scan_lock = self._scan_locks.setdefault(prefix, threading.Lock())
+        with scan_lock:
+            self._rescan(prefix)
+
+    def _listing_for(self, prefix: str) -> _PrefixListing:
+        self._load_state()
+        with self._lock:
+            listing = self._listings.get(prefix)
+            if listing is not None:
+                return listing
+            scan_lock = self._scan_locks.setdefault(prefix, threading.Lock())
+        # Only one caller scans a cold prefix; the others wait for its result.
+        with scan_lock:
+            with self._lock:
+                listing = self._listings.get(prefix)
+            if listing is None:
+                listing = self._rescan(prefix)
+        return listing
+
+    def _is_stale(self, listing: _PrefixListing) -> bool:
+        return time.time() - listing.scanned_at >= self._ttl_seconds
+
+    def _refresh_in_background(self, prefix: str) -> None:
+        with self._lock:
+            if prefix in self._refreshing:
+                return
+            self._refreshing.add(prefix)
+            scan_lock = self._scan_locks.setdefault(prefix, threading.Lock())
+
+        def run():
+            try:
+                with scan_lock:
+                    self._rescan(prefix)
+            except Exception:
+                # Keep serving the previous snapshot; the next lookup retries.
+                logger.debug("Background listing refresh of %s failed", prefix, exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(prefix)
+
+        threading.Thread(target=run, name="s3io-listing-refresh", daemon=True).start()
+
+    def _record(self, key: str, present: bool) -> None:
+        with self._lock:
+            for prefix in self._listings.keys() | self._journals.keys():
+                rel = self._relative_key(key, prefix)
+                if not rel:
+                    continue
+                listing = self._listings.get(prefix)
+                if listing is not None:
+                    listing.apply(rel, present)
+                journal = self._journals.get(prefix)
+                if journal is not None:
+                    journal.append((rel, present))
+
+    def _rescan(self, prefix: str) -> _PrefixListing:
+        # Callers hold the prefix's scan lock, so there is one journal per prefix.
+        started_at = time.time()
+        listing = _PrefixListing(scanned_at=started_at)
+        with self._lock:
+            self._journals[prefix] = []
+        try:
+            for key in self._scan(prefix):
+                rel = self._relative_key(key, prefix)
+                if rel:
+                    listing.apply(rel, True)
+        except BaseException:
+            with self._lock:
+                self._journals.pop(prefix, None)
+            raise
+        with self._lock:
+            for rel, present in self._journals.pop(prefix):
+                listing.apply(rel, present)
+            self._listings[prefix] = listing
+        self._save_state()
+        return listing
+
+    @staticmethod
+    def _relative_key(key: str, prefix: str) -> Optional[str]:
+        if key.endswith("/") or not key.startswith(prefix):
+            return None
+        return key[len(prefix):] or None
+
+    def _load_state(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self._state_path:
+                return
+            try:
+                with open(self._state_path, "r", encoding="utf-8") as handle:
+                    state = json.load(handle)
+            except (FileNotFoundError, ValueError):
+                return
+            for prefix, entry in state.get("prefixes", {}).items():
+                listing = _PrefixListing(scanned_at=float(entry.get("scanned_at", 0)))
+                for rel in entry.get("keys", []):
+                    listing.apply(rel, True)
+                self._listings[prefix] = listing
+
+    def _save_state(self) -> None:
+        if not self._state_path:
+            return
+        with self._lock:
+            state = {
+                "prefixes": {
+                    prefix: {
+                        "scanned_at": listing.scanned_at,
+                        "keys": sorted(rel for rels in listing.by_extension.values() for rel in rels),
+                    }
+                    for prefix, listing in self._listings.items()
+                }
+            }
+        write_json_atomic(self._state_path, state)
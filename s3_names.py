@@ -0,0 +1,107 @@
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Sequence
+
+
+SUFFIX_PATTERN = re.compile(r"^(?P<stem>.*) \((?P<suffix>\d+)\)$")
+
+
+def apply_suffix(filename: str, suffix: int) -> str:
+    if suffix <= 0:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f"{stem} ({suffix}){ext}"
+
+
+def strip_suffix(filename: str) -> str:
+    stem, ext = os.path.splitext(filename)
+    match = SUFFIX_PATTERN.match(stem)
+    return match.group("stem") + ext if match else filename
+
+
+@dataclass
+class _Folder:
+    scanned_at: float
+    names: set[str] = field(default_factory=set)
+    next_suffix: dict[tuple[str, ...], int] = field(default_factory=dict)
+
+
+class NameAllocator:
+    def __init__(self, scan: Callable[[str], Iterable[str]], ttl_seconds: float):
+        self._scan = scan
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._scan_locks: dict[str, threading.Lock] = {}
+        self._folders: dict[str, _Folder] = {}
+
+    def allocate(self, folder: str, filenames: Sequence[str]) -> list[str]:
+        # A group (e.g. a video and its preview image) shares one suffix.
+        group = tuple(filenames)
+        state = self._folder(folder)
+        with self._lock:
+            suffix = state.next_suffix.get(group, 0)
+            while True:
+                candidates = [apply_suffix(name, suffix) for name in group]
+                if not any(name in state.names for name in candidates):
+                    break
+                suffix += 1
+            state.names.update(candidates)
+            state.next_suffix[group] = suffix + 1
+        return candidates
+
+    def allocate_each(self, folder: str, filenames: Sequence[str]) -> list[str]:
+        # Independent names for a batch, under one scan and one lock.
+        state = self._folder(folder)
+        allocated = []
+        with self._lock:
+            for name in filenames:
+                suffix = state.next_suffix.get((name,), 0)
+                while apply_suffix(name, suffix) in state.names:
+                    suffix += 1
+                candidate = apply_suffix(name, suffix)
+                state.names.add(candidate)
+                state.next_suffix[(name,)] = suffix + 1
+                allocated.append(candidate)
+        return allocated
+
+    def reallocate(self, folder: str, filenames: Sequence[str]) -> list[str]:
+        # Someone else wrote one of a group's names first; the group moves to
+        # its next free suffix together, and the old names stay taken.
+        for filename in filenames:
+            self.mark_taken(folder, filename)
+        return self.allocate(folder, [strip_suffix(filename) for filename in filenames])
+
+    def names(self, folder: str) -> set[str]:
+        state = self._folder(folder)
+        with self._lock:
+            return set(state.names)
+
+    def mark_taken(self, folder: str, filename: str) -> None:
+        state = self._folder(folder)
+        with self._lock:
+            state.names.add(filename)
+
+    def _folder(self, folder: str) -> _Folder:
+        with self._lock:
+            state = self._folders.get(folder)
+            if state is not None and time.time() - state.scanned_at < self._ttl_seconds:
+                return state
+            scan_lock = self._scan_locks.setdefault(folder, threading.Lock())
+        with scan_lock:
+            with self._lock:
+                state = self._folders.get(folder)
+                if state is not None and time.time() - state.scanned_at < self._ttl_seconds:
+                    return state
+            scanned_at = time.time()
+            names = set(self._scan(folder))
+            with self._lock:
+                state = self._folders.get(folder)
+                if state is None:
+                    state = self._folders[folder] = _Folder(scanned_at)
+                # Keep names handed out since the last scan; their uploads may still be queued.
+                state.names |= names
+                state.scanned_at = scanned_at
+            return state
@@ -1,17 +1,22 @@
+import io
+import json
 import os
 from typing import Optional
 
 import numpy as np
 import torch
 from PIL import Image, ImageOps, ImageSequence
+from PIL.PngImagePlugin import PngInfo
 
 import folder_paths
 import node_helpers
+from comfy.cli_args import args
 from comfy.k_diffusion.utils import FolderOfImages
 
 import nodes as comfy_nodes
 
 from . import s3_helpers
+from .s3_thumbs import save_thumbnail
 from .s3_vhs import load_video_nodes as vhs_load_video
 from .s3_vhs import nodes as vhs_nodes
 
@@ -138,15 +143,15 @@ class LoadImageS3:
 
         if os.path.exists(local_path):
             s3_key = s3_helpers.input_key_for(name)
-            s3_helpers.upload_file(local_path, s3_key, content_type=s3_helpers.content_type_for_path(local_path))
-            preview_path = s3_helpers.ensure_thumbnail(local_path, s3_key)
+            uploaded = s3_helpers.sync_input_file(local_path, s3_key)
+            preview_path = s3_helpers.ensure_thumbnail(local_path, s3_key, pin=True, refresh=uploaded)
             image_path = local_path
         else:
             s3_key = s3_helpers.resolve_input_key(name)
-            image_path = s3_helpers.download_to_cache(s3_key)
+            image_path = s3_helpers.download_to_cache(s3_key, pin=True)
             thumb_key = s3_helpers.thumb_key_for(s3_key)
             if s3_helpers.object_exists(thumb_key):
-                preview_path = s3_helpers.download_to_cache(thumb_key, kind="thumbs")
+                preview_path = s3_helpers.download_to_cache(thumb_key, kind="thumbs", pin=True)
             else:
                 preview_path = image_path
 
@@ -159,7 +164,7 @@ class LoadImageS3:
         name = _strip_annotation(image)
         local_path = _resolve_local_path(image)
         if os.path.exists(local_path):
-            return s3_helpers.file_hash(local_path)
+            return s3_helpers.local_fingerprint(local_path)
         s3_key = s3_helpers.resolve_input_key(name)
         try:
             head = s3_helpers.head_object(s3_key)
@@ -194,18 +199,68 @@ class SaveImageS3(comfy_nodes.SaveImage):
     CATEGORY = "image"
 
     def save_images(self, images, filename_prefix="ComfyUI", prompt=None, extra_pnginfo=None):
+        if not s3_helpers.save_local_output_enabled():
+            return self._save_images_to_s3(images, filename_prefix, prompt, extra_pnginfo)
         results = super().save_images(images, filename_prefix=filename_prefix, prompt=prompt, extra_pnginfo=extra_pnginfo)
+        batches = {}
         for entry in results.get("ui", {}).get("images", []):
             filename = entry.get("filename")
             subfolder = entry.get("subfolder") or ""
             if not filename:
                 continue
-            local_path = os.path.join(self.output_dir, subfolder, filename)
-            _, s3_keys = s3_helpers.resolve_unique_output_filenames(subfolder, [filename])
-            s3_key = s3_keys[0]
-            s3_helpers.upload_file(local_path, s3_key, content_type="image/png")
+            batches.setdefault(subfolder, []).append(filename)
+        uploads = []
+        for subfolder, filenames in batches.items():
+            _, s3_keys = s3_helpers.allocate_output_filenames(subfolder, filenames)
+            for filename, s3_key in zip(filenames, s3_keys):
+                uploads.append((os.path.join(self.output_dir, subfolder, filename), s3_key, "image/png"))
+        s3_helpers.enqueue_uploads(uploads, exclusive=True)
         return results
 
+    def _save_images_to_s3(self, images, filename_prefix, prompt, extra_pnginfo):
+        # Same naming and PNG metadata as SaveImage, but the PNG only exists in
+        # memory; the UI gets a small JPEG preview from the temp directory and a
+        # download reference to the PNG in S3. The path is resolved against the
+        # preview directory so no output folder is created.
+        filename_prefix += self.prefix_append
+        _, filename, _, subfolder, filename_prefix = folder_paths.get_save_image_path(
+            filename_prefix, s3_helpers.output_preview_dir(), images[0].shape[1], images[0].shape[0]
+        )
+        counter = s3_helpers.next_output_counter(subfolder, filename)
+        metadata = None
+        if not args.disable_metadata:
+            metadata = PngInfo()
+            if prompt is not None:
+                metadata.add_text("prompt", json.dumps(prompt))
+            if extra_pnginfo is not None:
+                for x in extra_pnginfo:
+                    metadata.add_text(x, json.dumps(extra_pnginfo[x]))
+        encoded = []
+        filenames = []
+        for (batch_number, image) in enumerate(images):
+            i = 255. * image.cpu().numpy()
+            img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG", pnginfo=metadata, compress_level=self.compress_level)
+            encoded.append((img, buffer.getvalue()))
+            filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
+            filenames.append(f"{filename_with_batch_num}_{counter:05}_.png")
+            counter += 1
+        s3_names, s3_keys = s3_helpers.allocate_output_filenames(subfolder, filenames)
+        s3_helpers.enqueue_data_uploads(
+            [(data, s3_key, "image/png") for (_, data), s3_key in zip(encoded, s3_keys)],
+            exclusive=True,
+        )
+        results = []
+        downloads = []
+        for (img, _), s3_name in zip(encoded, s3_names):
+            stem, _ = os.path.splitext(s3_name)
+            preview_path, preview_subfolder, preview_name = s3_helpers.output_preview_path(subfolder, f"{stem}.jpg")
+            save_thumbnail(img, preview_path, s3_helpers.THUMB_MAX_SIZE)
+            results.append({"filename": preview_name, "subfolder": preview_subfolder, "type": "temp"})
+            downloads.append({"filename": s3_name, "subfolder": subfolder, "type": "s3-output"})
+        return {"ui": {"images": results, "downloads": downloads}}
+
 
 class LoadVideoUploadS3:
     @classmethod
@@ -248,11 +303,14 @@ class LoadVideoUploadS3:
         local_path = _resolve_local_path(video)
         if os.path.exists(local_path):
             s3_key = s3_helpers.input_key_for(name)
-            s3_helpers.upload_file(local_path, s3_key, content_type=s3_helpers.content_type_for_path(local_path))
+            s3_helpers.sync_input_file(local_path, s3_key)
             video_path = local_path
         else:
             s3_key = s3_helpers.resolve_input_key(name)
-            video_path = s3_helpers.download_to_cache(s3_key)
+            if s3_helpers.stream_video_enabled():
+                video_path = s3_helpers.open_object_stream(s3_key, pin=True)
+            else:
+                video_path = s3_helpers.download_to_cache(s3_key, pin=True)
         kwargs["video"] = video_path
         return vhs_load_video.load_video(**kwargs)
 
@@ -261,7 +319,7 @@ class LoadVideoUploadS3:
         name = _strip_annotation(video)
         local_path = _resolve_local_path(video)
         if os.path.exists(local_path):
-            return vhs_load_video.calculate_file_hash(local_path)
+            return s3_helpers.local_fingerprint(local_path)
         s3_key = s3_helpers.resolve_input_key(name)
         try:
             head = s3_helpers.head_object(s3_key)
@@ -327,12 +385,11 @@ class VideoCombineS3(vhs_nodes.VideoCombine):
         for (subfolder, _), entries in grouped_files.items():
             filenames = [entry[1] for entry in entries]
             _, s3_keys = s3_helpers.resolve_unique_output_filenames(subfolder, filenames)
-            for (file_path, _), s3_key in zip(entries, s3_keys):
-                s3_helpers.upload_file(
-                    file_path,
-                    s3_key,
-                    content_type=s3_helpers.content_type_for_path(file_path),
-                )
+            uploads = [
+                (file_path, s3_key, s3_helpers.content_type_for_path(file_path))
+                for (file_path, _), s3_key in zip(entries, s3_keys)
+            ]
+            s3_helpers.enqueue_uploads(uploads, exclusive=True, grouped=True)
         return result
 
 
@@ -1,13 +1,161 @@
+import asyncio
+import functools
+import hashlib
+import logging
 import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Optional
 
+import aiohttp
 import folder_paths
-import node_helpers
 import server
 
-from . import s3_helpers
+from . import s3_async, s3_backfill, s3_helpers
+from .s3_async import run_blocking as _run_blocking
 
 
 web = server.web
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_SPOOL_PREFIX = ".s3io-upload-"
+# Older than any upload still being received; newer ones may belong to a
+# second server sharing the input directory.
+UPLOAD_SPOOL_MAX_AGE_SECONDS = 3600
+FORM_FIELD_MAX_BYTES = 64 * 1024
+FORM_FIELDS_MAX = 32
+OUTPUT_DOWNLOAD_WAIT_SECONDS = 300
+OUTPUT_DOWNLOAD_POLL_SECONDS = 0.25
+
+
+# (rendered, uploaded) futures per (key, refresh).
+_thumb_flights: dict[tuple[str, bool], tuple[asyncio.Future, asyncio.Future]] = {}
+_background_tasks: set[asyncio.Task] = set()
+_backfill_thread: Optional[threading.Thread] = None
+
+
+async def _close_async_client(app) -> None:
+    await s3_async.close()
+
+
+server.PromptServer.instance.app.on_cleanup.append(_close_async_client)
+
+
+def _list_on_loop(loop: asyncio.AbstractEventLoop, prefix: str) -> list[str]:
+    # Listing scans run on threads; from those, the pages come through the
+    # asyncio client on the server's loop. On the loop's own thread (a node's
+    # INPUT_TYPES runs there) waiting for the loop would deadlock, so boto3.
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop or loop.is_closed() or not s3_helpers.async_client_enabled():
+        return s3_helpers.list_objects(prefix)
+    return asyncio.run_coroutine_threadsafe(s3_async.list_objects(prefix), loop).result()
+
+
+async def _list_through_async_client(app) -> None:
+    s3_helpers.set_listing_scan(functools.partial(_list_on_loop, asyncio.get_running_loop()))
+
+
+async def _list_through_boto3(app) -> None:
+    s3_helpers.set_listing_scan(None)
+
+
+server.PromptServer.instance.app.on_startup.append(_list_through_async_client)
+server.PromptServer.instance.app.on_cleanup.insert(0, _list_through_boto3)
+
+
+def _resume_uploads() -> None:
+    s3_helpers.resume_pending_uploads()
+    s3_helpers.abort_stale_uploads()
+
+
+threading.Thread(target=_resume_uploads, name="s3io-upload-resume", daemon=True).start()
+
+
+def _sweep_upload_spool() -> None:
+    # Spool files outlive a crash mid-upload; nothing else ever removes them.
+    upload_dir = folder_paths.get_input_directory()
+    cutoff = time.time() - UPLOAD_SPOOL_MAX_AGE_SECONDS
+    try:
+        entries = list(os.scandir(upload_dir))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if not (entry.name.startswith(UPLOAD_SPOOL_PREFIX) and entry.name.endswith(".part")):
+            continue
+        try:
+            if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            logger.warning("Could not remove stale upload spool file %s", entry.path, exc_info=True)
+
+
+threading.Thread(target=_sweep_upload_spool, name="s3io-upload-sweep", daemon=True).start()
+
+
+async def _object_exists(key: str) -> bool:
+    if s3_helpers.async_client_enabled():
+        return await s3_async.object_exists(key)
+    return await _run_blocking(s3_helpers.object_exists, key)
+
+
+async def _head_object(key: str) -> dict:
+    if s3_helpers.async_client_enabled():
+        return await s3_async.head_object(key)
+    return await _run_blocking(s3_helpers.head_object, key)
+
+
+async def _download_to_cache(key: str, kind: str = "objects") -> str:
+    if s3_helpers.async_client_enabled():
+        return await s3_async.download_to_cache(key, kind=kind)
+    return await _run_blocking(s3_helpers.download_to_cache, key, kind=kind)
+
+
+async def _upload_file(local_path: str, key: str, content_type=None, metadata=None) -> None:
+    if s3_helpers.async_client_enabled():
+        await s3_async.upload_file(local_path, key, content_type=content_type, metadata=metadata)
+    else:
+        await _run_blocking(s3_helpers.upload_file, local_path, key, content_type=content_type, metadata=metadata)
+
+
+async def _create_multipart(key: str, content_type=None) -> str:
+    if s3_helpers.async_client_enabled():
+        return await s3_async.create_multipart_upload(key, content_type=content_type)
+    return await _run_blocking(s3_helpers.create_multipart_upload, key, content_type=content_type)
+
+
+async def _complete_multipart(key: str, upload_id: str, parts: list[tuple[int, str]]) -> None:
+    if s3_helpers.async_client_enabled():
+        await s3_async.complete_multipart_upload(key, upload_id, parts)
+    else:
+        await _run_blocking(s3_helpers.complete_multipart_upload, key, upload_id, parts)
+
+
+async def _upload_part(key: str, upload_id: str, number: int, data: bytes) -> str:
+    if s3_helpers.async_client_enabled():
+        return await s3_async.upload_part(key, upload_id, number, data)
+    return await _run_blocking(s3_helpers.upload_part_data, key, upload_id, number, data)
+
+
+async def _abort_multipart(key: str, upload_id: str) -> None:
+    if s3_helpers.async_client_enabled():
+        await s3_async.abort_multipart_upload(key, upload_id)
+    else:
+        await _run_blocking(s3_helpers.abort_multipart_upload, key, upload_id)
+
+
+async def _delete_object(key: str) -> None:
+    if s3_helpers.async_client_enabled():
+        await s3_async.delete_object(key)
+    else:
+        await _run_blocking(s3_helpers.delete_object, key)
 
 
 def _safe_subfolder(value: str) -> str:
@@ -33,83 +181,221 @@ def _safe_object_name(value: str) -> str:
     return "/".join(parts)
 
 
-def _compare_file_hash(filepath: str, payload) -> bool:
-    hasher = node_helpers.hasher()
-    if os.path.exists(filepath):
-        local = hasher()
-        uploaded = hasher()
-        with open(filepath, "rb") as handle:
-            local.update(handle.read())
-            uploaded.update(payload.file.read())
-            payload.file.seek(0)
-        return local.hexdigest() == uploaded.hexdigest()
-    return False
+@dataclass
+class _ReceivedUpload:
+    filename: str
+    temp_path: str
+    digest: Optional[str] = None
 
 
-@server.PromptServer.instance.routes.post("/s3io/upload/image")
-async def upload_image_to_s3(request):
-    post = await request.post()
-    image = post.get("image")
-    overwrite = post.get("overwrite")
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
-    if image is None or not getattr(image, "file", None):
-        return web.Response(status=400)
 
-    filename = os.path.basename(image.filename or "")
-    if not filename:
-        return web.Response(status=400)
+def _write_chunk(handle, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    handle.write(chunk)
+
 
+async def _spool_part(part, upload: _ReceivedUpload, max_size: int) -> None:
+    # Written and hashed chunk by chunk; the digest doubles as the duplicate
+    # check and the S3 fingerprint, so the file is never read back.
+    digest = hashlib.sha256()
+    size = 0
+    handle = await _run_blocking(open, upload.temp_path, "wb")
     try:
-        subfolder = _safe_subfolder(post.get("subfolder", ""))
-    except ValueError:
-        return web.Response(status=400)
+        while True:
+            chunk = await part.read_chunk(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_size and size > max_size:
+                raise web.HTTPRequestEntityTooLarge(max_size=max_size, actual_size=size)
+            await _run_blocking(_write_chunk, handle, digest, chunk)
+    finally:
+        await _run_blocking(handle.close)
+    upload.digest = digest.hexdigest()
 
-    upload_dir = folder_paths.get_input_directory()
-    full_output_folder = os.path.join(upload_dir, subfolder)
-    filepath = os.path.abspath(os.path.join(full_output_folder, filename))
 
-    if os.path.commonpath((upload_dir, filepath)) != upload_dir:
-        return web.Response(status=400)
+async def _read_field(part) -> str:
+    data = bytearray()
+    while True:
+        chunk = await part.read_chunk(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        data.extend(chunk)
+        if len(data) > FORM_FIELD_MAX_BYTES:
+            raise web.HTTPRequestEntityTooLarge(max_size=FORM_FIELD_MAX_BYTES, actual_size=len(data))
+    try:
+        return data.decode(part.get_charset(default="utf-8"))
+    except (LookupError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text="Undecodable form field")
 
-    if not os.path.exists(full_output_folder):
-        os.makedirs(full_output_folder)
 
+async def _receive_upload(request, file_fields: tuple[str, ...], upload_dir: str) -> tuple[dict, Optional[_ReceivedUpload]]:
+    fields = {}
+    upload = None
+    reader = await request.multipart()
+    try:
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            if not isinstance(part, aiohttp.BodyPartReader):
+                continue
+            if part.filename is None:
+                if len(fields) >= FORM_FIELDS_MAX:
+                    raise web.HTTPBadRequest(text="Too many form fields")
+                fields[part.name] = await _read_field(part)
+            elif upload is None and part.name in file_fields:
+                # The subfolder may arrive after the file, so spool next to the
+                # input directory and move into place once the form is read.
+                upload = _ReceivedUpload(part.filename, os.path.join(upload_dir, f"{UPLOAD_SPOOL_PREFIX}{uuid.uuid4().hex}.part"))
+                await _spool_part(part, upload, getattr(request, "client_max_size", 0))
+            else:
+                await part.release()
+    except BaseException:
+        if upload is not None:
+            await _run_blocking(_remove_quietly, upload.temp_path)
+        raise
+    return fields, upload
+
+
+def _local_upload_state(filepath: str, digest: str) -> tuple[bool, bool]:
+    if not os.path.exists(filepath):
+        return False, False
+    return True, os.path.isfile(filepath) and s3_helpers.local_fingerprint(filepath) == digest
+
+
+def _place_upload(upload: _ReceivedUpload, filepath: str) -> None:
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    os.replace(upload.temp_path, filepath)
+    s3_helpers.remember_fingerprint(filepath, upload.digest)
+
+
+async def _store_upload(upload: _ReceivedUpload, full_output_folder: str, subfolder: str, filename: str, overwrite, thumbnail: bool) -> str:
+    filepath = os.path.join(full_output_folder, filename)
     split = os.path.splitext(filename)
-    image_is_duplicate = False
+    is_duplicate = False
 
     if overwrite is not None and (overwrite == "true" or overwrite == "1"):
         pass
     else:
         i = 1
         while True:
-            local_exists = os.path.exists(filepath)
-            if local_exists and _compare_file_hash(filepath, image):
-                image_is_duplicate = True
+            local_exists, is_duplicate = await _run_blocking(_local_upload_state, filepath, upload.digest)
+            if is_duplicate:
                 break
             rel_name = os.path.join(subfolder, filename) if subfolder else filename
-            if not local_exists and not s3_helpers.object_exists(s3_helpers.input_key_for(rel_name)):
+            if not local_exists and not await _object_exists(s3_helpers.input_key_for(rel_name)):
                 break
             filename = f"{split[0]} ({i}){split[1]}"
             filepath = os.path.join(full_output_folder, filename)
             i += 1
 
-    if not image_is_duplicate:
-        with open(filepath, "wb") as handle:
-            handle.write(image.file.read())
+    if not is_duplicate:
+        await _run_blocking(_place_upload, upload, filepath)
 
     rel_name = os.path.join(subfolder, filename) if subfolder else filename
     s3_key = s3_helpers.input_key_for(rel_name)
-    s3_helpers.upload_file(
-        filepath,
-        s3_key,
-        content_type=s3_helpers.content_type_for_path(filepath),
-    )
-    s3_helpers.ensure_thumbnail(filepath, s3_key)
-    s3_helpers.invalidate_list_cache()
+    # Fingerprinted so the load nodes can tell this file is already in S3.
+    metadata = {s3_helpers.FINGERPRINT_METADATA_KEY: upload.digest}
+    await _upload_file(filepath, s3_key, content_type=s3_helpers.content_type_for_path(filepath), metadata=metadata)
+    if thumbnail:
+        thumb_path, thumb_key = await _run_blocking(s3_helpers.make_thumbnail, filepath, s3_key, refresh=True)
+        await _upload_file(thumb_path, thumb_key, content_type="image/jpeg")
+    return filename
+
+
+async def _handle_upload(request, file_fields: tuple[str, ...], thumbnail: bool):
+    if request.content_type != "multipart/form-data":
+        return web.Response(status=400)
+
+    upload_dir = folder_paths.get_input_directory()
+    fields, upload = await _receive_upload(request, file_fields, upload_dir)
+    if upload is None:
+        return web.Response(status=400)
+
+    try:
+        filename = os.path.basename(upload.filename or "")
+        if not filename:
+            return web.Response(status=400)
+
+        try:
+            subfolder = _safe_subfolder(fields.get("subfolder", ""))
+        except ValueError:
+            return web.Response(status=400)
+
+        full_output_folder = os.path.join(upload_dir, subfolder)
+        filepath = os.path.abspath(os.path.join(full_output_folder, filename))
+
+        if os.path.commonpath((upload_dir, filepath)) != upload_dir:
+            return web.Response(status=400)
+
+        filename = await _store_upload(upload, full_output_folder, subfolder, filename, fields.get("overwrite"), thumbnail)
+    finally:
+        # Gone already unless the upload was a duplicate or was rejected.
+        await _run_blocking(_remove_quietly, upload.temp_path)
 
     return web.json_response({"name": filename, "subfolder": subfolder, "type": "input"})
 
 
+@server.PromptServer.instance.routes.post("/s3io/upload/image")
+async def upload_image_to_s3(request):
+    return await _handle_upload(request, ("image",), True)
+
+
+async def _image_preview_entry(s3_key: str) -> tuple[str, str]:
+    thumb_key = s3_helpers.thumb_key_for(s3_key)
+    try:
+        local_path = await _download_to_cache(thumb_key, kind="thumbs")
+        preview_key = thumb_key
+    except FileNotFoundError:
+        try:
+            local_path, preview_key = await _thumbnail_for(s3_key)
+        except FileNotFoundError:
+            raise
+        except Exception:
+            # Not something Pillow can shrink; show the original instead. If
+            # the original is not cached, fetching it is what failed.
+            local_path = await _run_blocking(s3_helpers.cached_object_path, s3_key)
+            if local_path is None:
+                raise
+            logger.warning("Thumbnail for %s failed", s3_key, exc_info=True)
+            preview_key = s3_key
+    return await _run_blocking(s3_helpers.local_temp_preview_path, local_path, preview_key)
+
+
+async def _presigned_url(s3_key: str) -> str:
+    head = await _head_object(s3_key)
+    return s3_helpers.presigned_get_url(s3_key, head.get("ETag", "").strip('"'))
+
+
+async def _presigned_image_url(s3_key: str) -> str:
+    try:
+        return await _presigned_url(s3_helpers.thumb_key_for(s3_key))
+    except FileNotFoundError:
+        pass
+    # As without presigning, a missing thumbnail is made on demand: the
+    # browser should never be handed the full-size original for a preview.
+    try:
+        _thumb_path, thumb_key = await _thumbnail_for(s3_key, uploaded=True)
+    except FileNotFoundError:
+        raise
+    except Exception:
+        logger.warning("Thumbnail for %s failed", s3_key, exc_info=True)
+        return await _presigned_url(s3_key)
+    return await _presigned_url(thumb_key)
+
+
+async def _video_preview_entry(s3_key: str) -> tuple[str, str]:
+    local_path = await _download_to_cache(s3_key)
+    return await _run_blocking(s3_helpers.local_temp_preview_path, local_path, s3_key)
+
+
 @server.PromptServer.instance.routes.get("/s3io/preview/image")
 async def preview_image_from_s3(request):
     name = request.rel_url.query.get("name", "")
@@ -119,15 +405,19 @@ async def preview_image_from_s3(request):
     except ValueError:
         return web.Response(status=400)
     s3_key = s3_helpers.resolve_input_key(name)
-    thumb_key = s3_helpers.thumb_key_for(s3_key)
-    try:
+    if s3_helpers.presigned_preview_enabled():
         try:
-            local_path = s3_helpers.download_to_cache(thumb_key, kind="thumbs")
+            url = await _presigned_image_url(s3_key)
         except FileNotFoundError:
-            local_path = s3_helpers.download_to_cache(s3_key)
+            return web.Response(status=404)
+        return web.json_response({"url": url})
+    try:
+        subfolder, filename = await _image_preview_entry(s3_key)
     except FileNotFoundError:
         return web.Response(status=404)
-    subfolder, filename = s3_helpers.local_temp_preview_path(local_path)
+    except Exception:
+        logger.warning("Preview of %s failed", s3_key, exc_info=True)
+        return web.Response(status=502)
     return web.json_response({"filename": filename, "subfolder": subfolder, "type": "temp"})
 
 
@@ -140,14 +430,210 @@ async def preview_video_from_s3(request):
     except ValueError:
         return web.Response(status=400)
     s3_key = s3_helpers.resolve_input_key(name)
+    if s3_helpers.presigned_preview_enabled():
+        try:
+            url = await _presigned_url(s3_key)
+        except FileNotFoundError:
+            return web.Response(status=404)
+        return web.json_response({"url": url})
     try:
-        local_path = s3_helpers.download_to_cache(s3_key)
+        subfolder, filename = await _video_preview_entry(s3_key)
     except FileNotFoundError:
         return web.Response(status=404)
-    subfolder, filename = s3_helpers.local_temp_preview_path(local_path)
+    except Exception:
+        logger.warning("Preview of %s failed", s3_key, exc_info=True)
+        return web.Response(status=502)
     return web.json_response({"filename": filename, "subfolder": subfolder, "type": "temp"})
 
 
+def _byte_range(request, size: int) -> Optional[tuple[int, int]]:
+    # None serves the whole object; ValueError means the range is unsatisfiable.
+    try:
+        requested = request.http_range
+    except ValueError:
+        return None
+    start, stop = requested.start, requested.stop
+    if (start is None and stop is None) or size == 0:
+        return None
+    if start is None:
+        start = 0
+    elif start < 0:
+        start, stop = max(0, size + start), size
+    stop = size if stop is None else min(stop, size)
+    if start >= stop:
+        raise ValueError("Unsatisfiable range")
+    return start, stop - 1
+
+
+def _not_modified(request, etag: str, last_modified) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def _file_chunks(handle, start: int, end: int) -> AsyncIterator[bytes]:
+    await _run_blocking(handle.seek, start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await _run_blocking(handle.read, min(UPLOAD_CHUNK_SIZE, remaining))
+        if not chunk:
+            # Shorter than its HEAD said; end the response short rather than pad it.
+            raise IOError("Cached file ended early")
+        remaining -= len(chunk)
+        yield chunk
+
+
+async def _open_s3_chunks(
+    key: str, start: int, end: int, etag: str
+) -> tuple[AsyncIterator[bytes], Callable[[], Awaitable[None]]]:
+    # Opened before the response is prepared, so S3 errors can still become
+    # a proper status code. Returns the chunks and a close() the caller must
+    # await however streaming ends: a generator that never started would not
+    # run its own cleanup.
+    if s3_helpers.async_client_enabled():
+        response = await s3_async.get_async_client().get_object(key, start, end, if_match=etag)
+
+        async def chunks():
+            async for chunk in response.content.iter_chunked(UPLOAD_CHUNK_SIZE):
+                yield chunk
+
+        async def close():
+            response.release()
+
+        return chunks(), close
+    body = await _run_blocking(s3_helpers.open_object_range, key, start, end, etag)
+
+    async def chunks():
+        while True:
+            chunk = await _run_blocking(body.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    async def close():
+        await _run_blocking(body.close)
+
+    return chunks(), close
+
+
+async def _stream_object(request, s3_key: str):
+    try:
+        head = await _head_object(s3_key)
+    except FileNotFoundError:
+        return web.Response(status=404)
+    etag = head.get("ETag", "").strip('"')
+    size = int(head.get("ContentLength") or 0)
+    last_modified = head.get("LastModified")
+    headers = {
+        "ETag": f'"{etag}"',
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "no-cache",
+        "Content-Type": head.get("ContentType") or s3_helpers.content_type_for_path(s3_key) or "application/octet-stream",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    if _not_modified(request, etag, last_modified):
+        return web.Response(status=304, headers=headers)
+
+    byte_range = None
+    if request.headers.get("If-Range", etag).strip('"') == etag:
+        try:
+            byte_range = _byte_range(request, size)
+        except ValueError:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range or (0, size - 1)
+
+    # Every chunk comes from this one handle, so the body always matches the
+    # ETag sent, whatever happens to the cache path meanwhile.
+    cached = await _run_blocking(s3_helpers.open_cached_object, s3_key, etag)
+    from_s3 = cached is None
+    if cached is not None:
+        chunks = _file_chunks(cached, start, end)
+        close_chunks = functools.partial(_run_blocking, cached.close)
+    elif size == 0:
+        return web.Response(status=200, headers=headers)
+    else:
+        try:
+            chunks, close_chunks = await _open_s3_chunks(s3_key, start, end, etag)
+        except FileNotFoundError:
+            return web.Response(status=404)
+        except Exception:
+            # Most likely the object changed since it was last seen.
+            s3_helpers.forget_object_metadata(s3_key)
+            logger.warning("Streaming %s failed", s3_key, exc_info=True)
+            return web.Response(status=502)
+
+    response = web.StreamResponse(status=200 if byte_range is None else 206, headers=headers)
+    response.content_length = end - start + 1
+    if byte_range is not None:
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    tee_path = None
+    tee = None
+    try:
+        if from_s3 and start == 0 and end == size - 1:
+            # A full read is a download anyway; keep it for the next request.
+            cache_path = s3_helpers.cache_path_for(s3_key)
+            await _run_blocking(os.makedirs, os.path.dirname(cache_path), exist_ok=True)
+            tee_path = os.path.join(os.path.dirname(cache_path), f".{uuid.uuid4().hex}.part")
+            tee = await _run_blocking(open, tee_path, "wb")
+        await response.prepare(request)
+        written = 0
+        async for chunk in chunks:
+            await response.write(chunk)
+            if tee is not None:
+                await _run_blocking(tee.write, chunk)
+            written += len(chunk)
+        await response.write_eof()
+        if tee is not None:
+            await _run_blocking(tee.close)
+            tee = None
+            if written == size:
+                await _run_blocking(s3_helpers.offer_cached_file, s3_key, tee_path, etag)
+    finally:
+        await close_chunks()
+        if tee is not None:
+            await _run_blocking(tee.close)
+        if tee_path is not None:
+            await _run_blocking(_remove_quietly, tee_path)
+    return response
+
+
+@server.PromptServer.instance.routes.get("/s3io/stream/input")
+async def stream_input_from_s3(request):
+    name = request.rel_url.query.get("name", "")
+    name = folder_paths.annotated_filepath(name)[0]
+    try:
+        name = _safe_object_name(name)
+    except ValueError:
+        return web.Response(status=400)
+    s3_key = s3_helpers.resolve_input_key(name)
+    if s3_helpers.presigned_preview_enabled():
+        # The browser follows the redirect and sends its range requests to S3.
+        try:
+            url = await _presigned_url(s3_key)
+        except FileNotFoundError:
+            return web.Response(status=404)
+        raise web.HTTPFound(url)
+    return await _stream_object(request, s3_key)
+
+
+async def _delete_input(s3_key: str, media_type: str) -> None:
+    await _delete_object(s3_key)
+    await _run_blocking(s3_helpers.delete_cached_object, s3_key)
+    if media_type == "image":
+        thumb_key = s3_helpers.thumb_key_for(s3_key)
+        await _delete_object(thumb_key)
+        await _run_blocking(s3_helpers.delete_cached_object, thumb_key, kind="thumbs")
+
+
 @server.PromptServer.instance.routes.post("/s3io/delete/input")
 async def delete_input_from_s3(request):
     post = await request.post()
@@ -161,77 +647,415 @@ async def delete_input_from_s3(request):
 
     s3_key = s3_helpers.resolve_input_key(name)
     try:
-        s3_helpers.delete_object(s3_key)
-        s3_helpers.delete_cached_object(s3_key)
-        if media_type == "image":
-            thumb_key = s3_helpers.thumb_key_for(s3_key)
-            s3_helpers.delete_object(thumb_key)
-            s3_helpers.delete_cached_object(thumb_key, kind="thumbs")
+        await _delete_input(s3_key, media_type)
     except Exception:
         return web.Response(status=500)
 
-    s3_helpers.invalidate_list_cache()
     return web.json_response({"name": name, "deleted": True})
 
 
+@server.PromptServer.instance.routes.get("/s3io/download/output")
+async def download_output_from_s3(request):
+    query = request.rel_url.query
+    try:
+        filename = _safe_object_name(query.get("filename", ""))
+        subfolder = _safe_object_name(query["subfolder"]) if query.get("subfolder") else ""
+    except ValueError:
+        return web.Response(status=400)
+    s3_key = s3_helpers.output_key_for(subfolder, filename)
+    # Outputs that skip the local directory are named before their upload
+    # runs; wait for it, and follow the name if it had to be reallocated.
+    job = s3_helpers.queued_upload(s3_key)
+    if job is not None:
+        deadline = time.monotonic() + OUTPUT_DOWNLOAD_WAIT_SECONDS
+        while job.status in ("queued", "uploading"):
+            if time.monotonic() > deadline:
+                return web.Response(status=504)
+            await asyncio.sleep(OUTPUT_DOWNLOAD_POLL_SECONDS)
+        if job.status == "failed":
+            return web.Response(status=502)
+        s3_key = job.key
+    return await _stream_object(request, s3_key)
+
+
 @server.PromptServer.instance.routes.post("/s3io/upload/video")
 async def upload_video_to_s3(request):
-    post = await request.post()
-    video = post.get("video") or post.get("image")
-    overwrite = post.get("overwrite")
+    return await _handle_upload(request, ("video", "image"), False)
 
-    if video is None or not getattr(video, "file", None):
-        return web.Response(status=400)
 
-    filename = os.path.basename(video.filename or "")
-    if not filename:
-        return web.Response(status=400)
+def _spawn(coro) -> None:
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _generate_thumbnail(s3_key: str, flight: asyncio.Future, uploaded: asyncio.Future, refresh: bool) -> None:
+    try:
+        # A thumbnail rendered earlier whose upload failed is still good, as
+        # long as the original has not been replaced since (that refreshes).
+        cached = None if refresh else await _run_blocking(s3_helpers.cached_thumbnail, s3_key)
+        if cached is not None:
+            thumb_path, thumb_key = cached
+        else:
+            local_path = await _download_to_cache(s3_key)
+            thumb_path, thumb_key = await asyncio.get_running_loop().run_in_executor(
+                s3_helpers.get_thumbnail_pool(),
+                functools.partial(s3_helpers.make_thumbnail, local_path, s3_key, refresh=True),
+            )
+    except Exception as exc:
+        _thumb_flights.pop((s3_key, refresh), None)
+        flight.set_exception(exc)
+        uploaded.set_exception(exc)
+        return
+    flight.set_result((thumb_path, thumb_key))
+    # The flight stays registered until the upload lands, so requests in the
+    # meantime reuse this thumbnail instead of making another.
+    try:
+        await _upload_file(thumb_path, thumb_key, content_type="image/jpeg")
+    except Exception as exc:
+        logger.warning("Uploading the thumbnail for %s failed", s3_key, exc_info=True)
+        uploaded.set_exception(exc)
+    else:
+        uploaded.set_result(None)
+    finally:
+        _thumb_flights.pop((s3_key, refresh), None)
 
+
+def _retrieve_exception(future: asyncio.Future) -> None:
+    # Waiters may all have gone (a closed preview request); the failure is
+    # theirs to report, so it must not also surface as "never retrieved".
+    if not future.cancelled():
+        future.exception()
+
+
+async def _thumbnail_for(s3_key: str, refresh: bool = False, uploaded: bool = False) -> tuple[str, str]:
+    # (local thumbnail path, thumbnail key); made at most once at a time per
+    # key. With `uploaded`, also waits until the thumbnail is in S3.
+    futures = _thumb_flights.get((s3_key, refresh))
+    if futures is None:
+        loop = asyncio.get_running_loop()
+        futures = _thumb_flights[(s3_key, refresh)] = (loop.create_future(), loop.create_future())
+        for future in futures:
+            future.add_done_callback(_retrieve_exception)
+        _spawn(_generate_thumbnail(s3_key, *futures, refresh))
+    flight, upload = futures
+    result = await asyncio.shield(flight)
+    if uploaded:
+        await asyncio.shield(upload)
+    return result
+
+
+async def _thumbnail_in_background(s3_key: str) -> None:
+    # After an upload: the object is new, so any local thumbnail is stale.
     try:
-        subfolder = _safe_subfolder(post.get("subfolder", ""))
+        await _thumbnail_for(s3_key, refresh=True)
+    except Exception:
+        logger.warning("Thumbnail for %s failed", s3_key, exc_info=True)
+
+
+async def _free_input_name(full_output_folder: str, subfolder: str, filename: str) -> str:
+    # No bytes to compare yet, so any existing file (or one being uploaded
+    # directly right now) pushes the name to the next suffix.
+    split = os.path.splitext(filename)
+    reserved = s3_helpers.get_direct_uploads().keys() | s3_helpers.get_upload_sessions().keys()
+    candidate = filename
+    i = 1
+    while True:
+        rel_name = os.path.join(subfolder, candidate) if subfolder else candidate
+        s3_key = s3_helpers.input_key_for(rel_name)
+        if (
+            s3_key not in reserved
+            and not os.path.exists(os.path.join(full_output_folder, candidate))
+            and not await _object_exists(s3_key)
+        ):
+            return candidate
+        candidate = f"{split[0]} ({i}){split[1]}"
+        i += 1
+
+
+async def _json_body(request) -> Optional[dict]:
+    try:
+        body = await request.json()
     except ValueError:
-        return web.Response(status=400)
+        return None
+    return body if isinstance(body, dict) else None
+
+
+async def _multipart_target(body: dict) -> Optional[tuple[str, str, str, int]]:
+    # Validates a new upload's name, subfolder and size and picks a free
+    # input name; None means a bad request.
+    filename = os.path.basename(str(body.get("filename") or ""))
+    if not filename:
+        return None
+
+    try:
+        subfolder = _safe_subfolder(str(body.get("subfolder") or ""))
+        size = int(body.get("size"))
+    except (TypeError, ValueError):
+        return None
+    if size < 0:
+        return None
 
     upload_dir = folder_paths.get_input_directory()
     full_output_folder = os.path.join(upload_dir, subfolder)
     filepath = os.path.abspath(os.path.join(full_output_folder, filename))
 
     if os.path.commonpath((upload_dir, filepath)) != upload_dir:
+        return None
+
+    if str(body.get("overwrite")).lower() not in ("true", "1"):
+        filename = await _free_input_name(full_output_folder, subfolder, filename)
+
+    rel_name = os.path.join(subfolder, filename) if subfolder else filename
+    return filename, subfolder, s3_helpers.input_key_for(rel_name), size
+
+
+@server.PromptServer.instance.routes.post("/s3io/upload/direct/start")
+async def start_direct_upload(request):
+    if not s3_helpers.direct_uploads_enabled():
+        return web.Response(status=404)
+    body = await _json_body(request)
+    if body is None:
         return web.Response(status=400)
 
-    if not os.path.exists(full_output_folder):
-        os.makedirs(full_output_folder)
+    _spawn(_run_blocking(s3_helpers.abort_stale_uploads))
+    target = await _multipart_target(body)
+    if target is None:
+        return web.Response(status=400)
+    filename, subfolder, s3_key, size = target
 
-    split = os.path.splitext(filename)
-    video_is_duplicate = False
+    upload_id = await _create_multipart(s3_key, content_type=s3_helpers.content_type_for_path(filename))
+    part_size = s3_helpers.multipart_part_size(size)
+    part_count = max(1, -(-size // part_size))
+    urls = await _run_blocking(s3_helpers.presign_upload_parts, s3_key, upload_id, part_count)
+    await _run_blocking(
+        s3_helpers.get_direct_uploads().create,
+        s3_key, filename, subfolder, size, part_size, upload_id, body.get("media_type") == "image",
+        session_id=upload_id,
+    )
 
-    if overwrite is not None and (overwrite == "true" or overwrite == "1"):
-        pass
-    else:
-        i = 1
-        while True:
-            local_exists = os.path.exists(filepath)
-            if local_exists and _compare_file_hash(filepath, video):
-                video_is_duplicate = True
-                break
-            rel_name = os.path.join(subfolder, filename) if subfolder else filename
-            if not local_exists and not s3_helpers.object_exists(s3_helpers.input_key_for(rel_name)):
-                break
-            filename = f"{split[0]} ({i}){split[1]}"
-            filepath = os.path.join(full_output_folder, filename)
-            i += 1
+    return web.json_response({
+        "upload_id": upload_id,
+        "name": filename,
+        "subfolder": subfolder,
+        "part_size": part_size,
+        "urls": urls,
+    })
 
-    if not video_is_duplicate:
-        with open(filepath, "wb") as handle:
-            handle.write(video.file.read())
 
-    rel_name = os.path.join(subfolder, filename) if subfolder else filename
-    s3_key = s3_helpers.input_key_for(rel_name)
-    s3_helpers.upload_file(
-        filepath,
-        s3_key,
-        content_type=s3_helpers.content_type_for_path(filepath),
+@server.PromptServer.instance.routes.post("/s3io/upload/direct/complete")
+async def complete_direct_upload(request):
+    if not s3_helpers.direct_uploads_enabled():
+        return web.Response(status=404)
+    body = await _json_body(request)
+    if body is None:
+        return web.Response(status=400)
+    upload_id = str(body.get("upload_id") or "")
+    uploads = s3_helpers.get_direct_uploads()
+    upload = uploads.get(upload_id)
+    if upload is None:
+        return web.Response(status=404)
+
+    try:
+        parts = [(int(part["part_number"]), str(part["etag"]).strip('"')) for part in body.get("parts") or []]
+    except (KeyError, TypeError, ValueError):
+        return web.Response(status=400)
+    if not parts:
+        return web.Response(status=400)
+
+    try:
+        await _complete_multipart(upload["key"], upload_id, parts)
+    except Exception:
+        logger.warning("Completing the direct upload of %s failed", upload["key"], exc_info=True)
+        return web.Response(status=502)
+    await _run_blocking(uploads.remove, upload_id)
+    if upload["thumbnail"]:
+        # The browser already has the image; the thumbnail can follow.
+        _spawn(_thumbnail_in_background(upload["key"]))
+
+    return web.json_response({"name": upload["name"], "subfolder": upload["subfolder"], "type": "input"})
+
+
+@server.PromptServer.instance.routes.post("/s3io/upload/direct/abort")
+async def abort_direct_upload(request):
+    if not s3_helpers.direct_uploads_enabled():
+        return web.Response(status=404)
+    body = await _json_body(request)
+    if body is None:
+        return web.Response(status=400)
+    upload_id = str(body.get("upload_id") or "")
+    upload = await _run_blocking(s3_helpers.get_direct_uploads().remove, upload_id)
+    if upload is None:
+        return web.Response(status=404)
+    await _abort_multipart(upload["key"], upload_id)
+    return web.json_response({"upload_id": upload_id, "aborted": True})
+
+
+def _session_progress(session_id: str, session: dict) -> dict:
+    size = session["size"]
+    part_size = session["part_size"]
+    parts = sorted(int(number) for number in session["parts"])
+    return {
+        "session_id": session_id,
+        "name": session["name"],
+        "subfolder": session["subfolder"],
+        "size": size,
+        "part_size": part_size,
+        "part_count": max(1, -(-size // part_size)),
+        "parts": parts,
+        "received": sum(min(part_size, size - (number - 1) * part_size) for number in parts),
+    }
+
+
+async def _read_body(request, length: int) -> Optional[bytes]:
+    # Read in pieces so a chunk larger than a part is refused early.
+    data = bytearray()
+    async for piece in request.content.iter_chunked(UPLOAD_CHUNK_SIZE):
+        data += piece
+        if len(data) > length:
+            return None
+    return bytes(data) if len(data) == length else None
+
+
+@server.PromptServer.instance.routes.post("/s3io/upload/sessions")
+async def create_upload_session(request):
+    body = await _json_body(request)
+    if body is None:
+        return web.Response(status=400)
+
+    sessions = s3_helpers.get_upload_sessions()
+    _spawn(_run_blocking(s3_helpers.abort_stale_uploads))
+
+    target = await _multipart_target(body)
+    if target is None:
+        return web.Response(status=400)
+    filename, subfolder, s3_key, size = target
+
+    upload_id = await _create_multipart(s3_key, content_type=s3_helpers.content_type_for_path(filename))
+    part_size = s3_helpers.multipart_part_size(size)
+    session_id = await _run_blocking(
+        sessions.create, s3_key, filename, subfolder, size, part_size, upload_id, body.get("media_type") == "image"
     )
-    s3_helpers.invalidate_list_cache()
+    return web.json_response(_session_progress(session_id, sessions.get(session_id)))
 
-    return web.json_response({"name": filename, "subfolder": subfolder, "type": "input"})
+
+@server.PromptServer.instance.routes.get("/s3io/upload/sessions/{session_id}")
+async def upload_session_progress(request):
+    session_id = request.match_info["session_id"]
+    session = s3_helpers.get_upload_sessions().get(session_id)
+    if session is None:
+        return web.Response(status=404)
+    return web.json_response(_session_progress(session_id, session))
+
+
+@server.PromptServer.instance.routes.put("/s3io/upload/sessions/{session_id}")
+async def upload_session_chunk(request):
+    session_id = request.match_info["session_id"]
+    sessions = s3_helpers.get_upload_sessions()
+    session = sessions.get(session_id)
+    if session is None:
+        return web.Response(status=404)
+
+    # Chunks are S3 parts: they start on a part boundary and fill the part.
+    size = session["size"]
+    part_size = session["part_size"]
+    try:
+        offset = int(request.rel_url.query.get("offset", ""))
+    except ValueError:
+        return web.Response(status=400)
+    if offset < 0 or offset % part_size or (offset >= size and offset > 0):
+        return web.Response(status=400)
+    data = await _read_body(request, min(part_size, size - offset))
+    if data is None:
+        return web.Response(status=400)
+
+    number = offset // part_size + 1
+    try:
+        etag = await _upload_part(session["key"], session["upload_id"], number, data)
+    except Exception:
+        logger.warning("Uploading part %d of %s failed", number, session["key"], exc_info=True)
+        return web.Response(status=502)
+    await _run_blocking(sessions.add_part, session_id, number, etag)
+    session = sessions.get(session_id)
+    if session is None:
+        return web.Response(status=404)
+    return web.json_response(_session_progress(session_id, session))
+
+
+@server.PromptServer.instance.routes.post("/s3io/upload/sessions/{session_id}/finish")
+async def finish_upload_session(request):
+    session_id = request.match_info["session_id"]
+    sessions = s3_helpers.get_upload_sessions()
+    session = sessions.get(session_id)
+    if session is None:
+        return web.Response(status=404)
+
+    progress = _session_progress(session_id, session)
+    if len(progress["parts"]) != progress["part_count"]:
+        return web.json_response(progress, status=409)
+
+    parts = [(int(number), etag) for number, etag in session["parts"].items()]
+    try:
+        await _complete_multipart(session["key"], session["upload_id"], parts)
+    except Exception:
+        logger.warning("Completing the upload of %s failed", session["key"], exc_info=True)
+        return web.Response(status=502)
+    await _run_blocking(sessions.remove, session_id)
+    if session["thumbnail"]:
+        _spawn(_thumbnail_in_background(session["key"]))
+
+    return web.json_response({"name": session["name"], "subfolder": session["subfolder"], "type": "input"})
+
+
+@server.PromptServer.instance.routes.delete("/s3io/upload/sessions/{session_id}")
+async def cancel_upload_session(request):
+    session_id = request.match_info["session_id"]
+    session = await _run_blocking(s3_helpers.get_upload_sessions().remove, session_id)
+    if session is None:
+        return web.Response(status=404)
+    await _abort_multipart(session["key"], session["upload_id"])
+    return web.json_response({"session_id": session_id, "cancelled": True})
+
+
+@server.PromptServer.instance.routes.get("/s3io/uploads")
+async def upload_status(request):
+    prompt_id = request.rel_url.query.get("prompt_id") or None
+    return web.json_response(s3_helpers.upload_status(prompt_id))
+
+
+def _report_backfill(status: dict) -> None:
+    server.PromptServer.instance.send_sync("s3io.backfill", status)
+
+
+def _run_backfill(workers: Optional[int], retry_failed: bool) -> None:
+    try:
+        s3_backfill.run_backfill(workers=workers, retry_failed=retry_failed, report=_report_backfill)
+    except Exception:
+        logger.warning("Thumbnail backfill failed", exc_info=True)
+
+
+@server.PromptServer.instance.routes.post("/s3io/thumbs/backfill")
+async def start_thumbnail_backfill(request):
+    body = await _json_body(request)
+    if body is None:
+        return web.Response(status=400)
+    workers = body.get("workers")
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        return web.Response(status=400)
+    global _backfill_thread
+    if s3_backfill.backfill_running() or (_backfill_thread is not None and _backfill_thread.is_alive()):
+        return web.json_response(await _run_blocking(s3_backfill.backfill_status), status=409)
+
+    _backfill_thread = threading.Thread(
+        target=_run_backfill,
+        args=(workers, bool(body.get("retry_failed"))),
+        name="s3io-thumb-backfill",
+        daemon=True,
+    )
+    _backfill_thread.start()
+    return web.json_response({"started": True}, status=202)
+
+
+@server.PromptServer.instance.routes.get("/s3io/thumbs/backfill")
+async def thumbnail_backfill_status(request):
+    return web.json_response(await _run_blocking(s3_backfill.backfill_status))
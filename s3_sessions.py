@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+import uuid
+from typing import Optional
+
+from .s3_cache import write_json_atomic
+
+
+class UploadSessions:
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._sessions: dict[str, dict] = {}
+        self._load()
+
+    def create(
+        self,
+        key: str,
+        name: str,
+        subfolder: str,
+        size: int,
+        part_size: int,
+        upload_id: str,
+        thumbnail: bool,
+        session_id: Optional[str] = None,
+    ) -> str:
+        session_id = session_id or uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = {
+                "key": key,
+                "name": name,
+                "subfolder": subfolder,
+                "size": size,
+                "part_size": part_size,
+                "upload_id": upload_id,
+                "thumbnail": thumbnail,
+                "created_at": time.time(),
+                "parts": {},
+            }
+            self._save()
+        return session_id
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return None if session is None else dict(session, parts=dict(session["parts"]))
+
+    def keys(self) -> set[str]:
+        with self._lock:
+            return {session["key"] for session in self._sessions.values()}
+
+    def add_part(self, session_id: str, number: int, etag: str) -> None:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session["parts"][str(number)] = etag
+            self._save()
+
+    def remove(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._save()
+            return session
+
+    def expire(self, max_age_seconds: float) -> list[dict]:
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            expired = [session_id for session_id, session in self._sessions.items() if session["created_at"] < cutoff]
+            removed = [self._sessions.pop(session_id) for session_id in expired]
+            if removed:
+                self._save()
+        return removed
+
+    def _load(self) -> None:
+        try:
+            with open(self._path, "r", encoding="utf-8") as handle:
+                state = json.load(handle)
+        except (FileNotFoundError, ValueError):
+            return
+        for session_id, session in state.get("sessions", {}).items():
+            if session.get("key") and session.get("upload_id"):
+                session.setdefault("parts", {})
+                self._sessions[session_id] = session
+
+    def _save(self) -> None:
+        # Same discipline as the upload journal: written under the lock and
+        # durable, since a session is only useful if it outlives the process.
+        write_json_atomic(self._path, {"sessions": self._sessions}, durable=True)
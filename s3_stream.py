@@ -0,0 +1,293 @@
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+SEND_BUFFER_SIZE = 256 * 1024
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class ProgressiveDownload:
+    def __init__(
+        self,
+        size: int,
+        chunk_size: int,
+        temp_path: str,
+        fetch_range: Callable[[int, int], bytes],
+        on_complete: Callable[[str], None],
+        read_ahead: int = 4,
+        content_type: Optional[str] = None,
+        on_close: Optional[Callable[[], None]] = None,
+    ):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.temp_path = temp_path
+        self.content_type = content_type or "application/octet-stream"
+        self._fetch_range = fetch_range
+        self._on_complete = on_complete
+        self._on_close = on_close
+        self._read_ahead = read_ahead
+        self._chunk_count = max(1, -(-size // chunk_size))
+        self._present: set[int] = set()
+        self._inflight: set[int] = set()
+        self._high_water = 0
+        self._frontier = 0
+        self._closed = False
+        self._completed = False
+        self._cond = threading.Condition()
+        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+        with open(temp_path, "wb") as handle:
+            handle.truncate(size)
+        threading.Thread(target=self._prefetch, name="s3io-stream-prefetch", daemon=True).start()
+
+    def read(self, start: int, end: int) -> bytes:
+        first, last = start // self.chunk_size, end // self.chunk_size
+        with self._cond:
+            # Only reads near the sequential front move the prefetch window;
+            # a decoder probing the tail (e.g. an mp4 moov atom) does not.
+            if last > self._high_water and first <= self._frontier + self._read_ahead:
+                self._high_water = last
+                self._cond.notify_all()
+        for index in range(first, last + 1):
+            self._ensure_chunk(index)
+        with open(self.temp_path, "rb") as handle:
+            handle.seek(start)
+            return handle.read(end - start + 1)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+        if self._on_close is not None:
+            self._on_close()
+
+    def _ensure_chunk(self, index: int) -> None:
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise IOError("Stream closed")
+                if index in self._present:
+                    return
+                if index not in self._inflight:
+                    self._inflight.add(index)
+                    break
+                self._cond.wait()
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, self.size) - 1
+        try:
+            data = self._fetch_range(start, end)
+            if len(data) != end - start + 1:
+                raise IOError(f"Short read for bytes {start}-{end}: got {len(data)} bytes")
+            with open(self.temp_path, "r+b") as handle:
+                handle.seek(start)
+                handle.write(data)
+        except BaseException:
+            with self._cond:
+                self._inflight.discard(index)
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self._inflight.discard(index)
+            self._present.add(index)
+            complete = len(self._present) == self._chunk_count and not self._completed
+            self._cond.notify_all()
+        if complete:
+            # The callback must leave temp_path in place; reads keep using it.
+            self._on_complete(self.temp_path)
+            self._completed = True
+
+    def _prefetch(self) -> None:
+        # Stay at most `read_ahead` chunks past the furthest byte the reader
+        # asked for, so a decoder that stops early stops the download too.
+        index = 0
+        while True:
+            with self._cond:
+                while index < self._chunk_count and index in self._present:
+                    index += 1
+                self._frontier = index
+                while not self._closed and index <= self._chunk_count - 1 and index > self._high_water + self._read_ahead:
+                    self._cond.wait()
+                if self._closed or index >= self._chunk_count:
+                    return
+            try:
+                self._ensure_chunk(index)
+            except Exception:
+                return
+
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    server_version = "S3IOStream/1.0"
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, send_body: bool) -> None:
+        token = self.path.lstrip("/")
+        download = self.server.sessions.open(token)
+        if download is None:
+            self.send_error(404)
+            return
+        try:
+            self._send(download, send_body)
+        finally:
+            self.server.sessions.done(token)
+
+    def _send(self, download: ProgressiveDownload, send_body: bool) -> None:
+        start, end = 0, download.size - 1
+        status = 200
+        match = RANGE_PATTERN.fullmatch(self.headers.get("Range", "").strip())
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), download.size - 1)
+            else:
+                start = max(0, download.size - int(match.group(2)))
+            if start >= download.size or start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{download.size}")
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", download.content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{download.size}")
+        self.end_headers()
+        if not send_body or download.size == 0:
+            return
+        offset = start
+        try:
+            while offset <= end:
+                slice_end = min(offset + SEND_BUFFER_SIZE, end + 1) - 1
+                self.wfile.write(download.read(offset, slice_end))
+                offset = slice_end + 1
+        except (BrokenPipeError, ConnectionResetError):
+            # The decoder seeked elsewhere or finished early.
+            pass
+
+
+class StreamServer:
+    # Sessions are closed least recently used first beyond `max_sessions`, or
+    # after `idle_seconds` without a request. Sessions pinned by the running
+    # prompt and sessions being read are never closed.
+    def __init__(self, max_sessions: int = 8, idle_seconds: float = 300):
+        self._max_sessions = max_sessions
+        self._idle_seconds = idle_seconds
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _StreamHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.sessions = _Sessions()
+        threading.Thread(target=self._httpd.serve_forever, name="s3io-stream-server", daemon=True).start()
+        threading.Thread(target=self._expire_idle, name="s3io-stream-expiry", daemon=True).start()
+
+    def register(self, download: ProgressiveDownload, owner: Optional[str] = None) -> str:
+        token = secrets.token_urlsafe(16)
+        self._close(self._httpd.sessions.add(token, download, owner, self._max_sessions))
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/{token}"
+
+    def release(self, owner: Optional[str] = None) -> None:
+        self._close(self._httpd.sessions.release(owner, self._max_sessions))
+
+    def _expire_idle(self) -> None:
+        while True:
+            time.sleep(max(1.0, self._idle_seconds / 4))
+            cutoff = time.monotonic() - self._idle_seconds
+            self._close(self._httpd.sessions.evict(self._max_sessions, cutoff))
+
+    @staticmethod
+    def _close(downloads: list[ProgressiveDownload]) -> None:
+        for download in downloads:
+            download.close()
+
+
+@dataclass
+class _Session:
+    download: ProgressiveDownload
+    # The prompt that pinned it, if any.
+    owner: Optional[str]
+    last_used: float
+    readers: int = 0
+
+
+class _Sessions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items: OrderedDict[str, _Session] = OrderedDict()
+
+    def open(self, token: str) -> Optional[ProgressiveDownload]:
+        with self._lock:
+            session = self._items.get(token)
+            if session is None:
+                return None
+            self._items.move_to_end(token)
+            session.readers += 1
+            session.last_used = time.monotonic()
+            return session.download
+
+    def done(self, token: str) -> None:
+        with self._lock:
+            session = self._items.get(token)
+            if session is not None:
+                session.readers -= 1
+                session.last_used = time.monotonic()
+
+    def add(
+        self,
+        token: str,
+        download: ProgressiveDownload,
+        owner: Optional[str],
+        limit: int,
+    ) -> list[ProgressiveDownload]:
+        with self._lock:
+            if owner is not None:
+                # Like cache pins: a new prompt's pin releases the previous prompt's.
+                for session in self._items.values():
+                    if session.owner != owner:
+                        session.owner = None
+            self._items[token] = _Session(download, owner, time.monotonic())
+        return self.evict(limit, keep=token)
+
+    def release(self, owner: Optional[str], limit: int) -> list[ProgressiveDownload]:
+        now = time.monotonic()
+        with self._lock:
+            for session in self._items.values():
+                if session.owner is not None and owner in (None, session.owner):
+                    session.owner = None
+                    session.last_used = now
+        return self.evict(limit)
+
+    def evict(
+        self,
+        limit: int,
+        idle_before: Optional[float] = None,
+        keep: Optional[str] = None,
+    ) -> list[ProgressiveDownload]:
+        evicted = []
+        with self._lock:
+            for token, session in list(self._items.items()):
+                if session.owner is not None or session.readers > 0 or token == keep:
+                    continue
+                idle = idle_before is not None and session.last_used < idle_before
+                if idle or len(self._items) > limit:
+                    del self._items[token]
+                    evicted.append(session.download)
+        return evicted
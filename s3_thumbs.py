@@ -0,0 +1,24 @@
+from PIL import Image, ImageOps
+
+
+# thumbnail() reduce()s by whole factors until the image is within this
+# multiple of the target, then resamples only the remainder with LANCZOS.
+THUMB_REDUCING_GAP = 2.0
+
+
+def render_thumbnail(source_path: str, target_path: str, max_size: int, quality: int = 85) -> None:
+    # Kept free of S3 and ComfyUI imports so it can run in a worker process.
+    with Image.open(source_path) as img:
+        # JPEGs decode straight to 1/2..1/8 scale; must happen before
+        # exif_transpose, which loads the full image.
+        draft_size = int(max_size * THUMB_REDUCING_GAP)
+        img.draft("RGB", (draft_size, draft_size))
+        save_thumbnail(ImageOps.exif_transpose(img), target_path, max_size, quality)
+
+
+def save_thumbnail(img: Image.Image, target_path: str, max_size: int, quality: int = 85) -> None:
+    # May shrink `img` in place; callers pass an image they are done with.
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.thumbnail((max_size, max_size), Image.LANCZOS, reducing_gap=THUMB_REDUCING_GAP)
+    img.save(target_path, "JPEG", quality=quality, optimize=True)
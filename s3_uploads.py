@@ -0,0 +1,201 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+PROMPT_HISTORY_LIMIT = 64
+JOB_HISTORY_LIMIT = 256
+
+
+@dataclass
+class UploadJob:
+    local_path: Optional[str]
+    key: str
+    content_type: Optional[str]
+    prompt_id: Optional[str]
+    journal_id: Optional[str] = None
+    data: Optional[bytes] = field(default=None, repr=False)
+    exclusive: bool = False
+    # Jobs with the same group were named together and keep one suffix.
+    group: Optional[str] = None
+    status: str = "queued"
+    error: Optional[str] = None
+
+
+@dataclass
+class _PromptUploads:
+    total: int = 0
+    done: int = 0
+    failed: int = 0
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.done - self.failed
+
+
+class UploadQueue:
+    def __init__(
+        self,
+        upload: Callable[[list[UploadJob]], list[Optional[BaseException]]],
+        workers: int,
+        max_pending: int,
+        notify: Optional[Callable[[dict], None]] = None,
+        max_pending_bytes: Optional[int] = None,
+    ):
+        self._upload = upload
+        self._notify = notify
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_pending))
+        self._cond = threading.Condition()
+        self._prompts: OrderedDict[Optional[str], _PromptUploads] = OrderedDict()
+        self._jobs: OrderedDict[str, UploadJob] = OrderedDict()
+        self._unfinished = 0
+        self._max_pending_bytes = max_pending_bytes
+        self._pending_bytes = 0
+        for index in range(max(1, workers)):
+            threading.Thread(target=self._work, name=f"s3io-upload-{index}", daemon=True).start()
+
+    def submit(self, jobs: list[UploadJob]) -> list[UploadJob]:
+        # A batch is one queue item; the upload callable moves its files
+        # concurrently and reports an error (or None) per job, in order.
+        if not jobs:
+            return jobs
+        size = sum(len(job.data) for job in jobs if job.data is not None)
+        with self._cond:
+            # In-memory jobs also wait for their bytes to fit, so a batch of
+            # large images cannot pile up max_pending times over. A batch
+            # larger than the whole budget still goes once nothing else is held.
+            if self._max_pending_bytes is not None:
+                while self._pending_bytes and self._pending_bytes + size > self._max_pending_bytes:
+                    self._cond.wait()
+            self._pending_bytes += size
+            self._unfinished += len(jobs)
+            for job in jobs:
+                self._prompt(job.prompt_id).total += 1
+                self._jobs.pop(job.key, None)
+                self._jobs[job.key] = job
+        for job in jobs:
+            self._emit(job)
+        # Blocks once the queue is full, so a flood of outputs slows the
+        # producer down instead of growing memory without bound.
+        self._queue.put(jobs)
+        return jobs
+
+    def status(self, prompt_id: Optional[str]) -> dict:
+        with self._cond:
+            prompt = self._prompts.get(prompt_id) or _PromptUploads()
+            return self._summary(prompt_id, prompt)
+
+    def job(self, key: str) -> Optional[UploadJob]:
+        # The last job submitted under `key`. Its own key is the final one if
+        # the name had to be reallocated.
+        with self._cond:
+            return self._jobs.get(key)
+
+    def wait(self, prompt_id: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if prompt_id is None:
+                    if self._unfinished == 0:
+                        return True
+                else:
+                    prompt = self._prompts.get(prompt_id)
+                    if prompt is None or prompt.pending == 0:
+                        return True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            pending = self._unfinished
+        if pending:
+            logger.info("Waiting for %d S3 upload(s) to finish", pending)
+        if self.wait(timeout=timeout):
+            return True
+        with self._cond:
+            left = [job for job in self._jobs.values() if job.status in ("queued", "uploading")]
+        for job in left:
+            if job.journal_id is not None:
+                logger.warning("S3 upload of %s did not finish; it resumes on the next start", job.key)
+            else:
+                logger.warning("S3 upload of %s did not finish and is lost", job.key)
+        return False
+
+    def _prompt(self, prompt_id: Optional[str]) -> _PromptUploads:
+        prompt = self._prompts.get(prompt_id)
+        if prompt is None:
+            prompt = self._prompts[prompt_id] = _PromptUploads()
+            # Forget the oldest finished prompts; unfinished ones are kept.
+            for old_id in list(self._prompts)[:-PROMPT_HISTORY_LIMIT]:
+                if self._prompts[old_id].pending == 0:
+                    del self._prompts[old_id]
+        return prompt
+
+    def _forget_finished_jobs(self) -> None:
+        for key in list(self._jobs)[:-JOB_HISTORY_LIMIT]:
+            if self._jobs[key].status in ("done", "failed"):
+                del self._jobs[key]
+
+    @staticmethod
+    def _summary(prompt_id: Optional[str], prompt: _PromptUploads) -> dict:
+        return {
+            "prompt_id": prompt_id,
+            "total": prompt.total,
+            "done": prompt.done,
+            "failed": prompt.failed,
+            "pending": prompt.pending,
+            "errors": list(prompt.errors),
+        }
+
+    def _emit(self, job: UploadJob) -> None:
+        if self._notify is None:
+            return
+        event = self.status(job.prompt_id)
+        event.update({"key": job.key, "status": job.status, "error": job.error})
+        try:
+            self._notify(event)
+        except Exception:
+            logger.debug("S3 upload notification failed", exc_info=True)
+
+    def _work(self) -> None:
+        while True:
+            jobs = self._queue.get()
+            for job in jobs:
+                job.status = "uploading"
+                self._emit(job)
+            try:
+                errors = self._upload(jobs)
+            except Exception as exc:
+                errors = [exc] * len(jobs)
+            for job, error in zip(jobs, errors):
+                if error is None:
+                    job.status = "done"
+                else:
+                    job.status = "failed"
+                    job.error = f"{job.key}: {error}"
+                    logger.error("S3 upload failed for %s", job.key, exc_info=error)
+                with self._cond:
+                    if job.data is not None:
+                        self._pending_bytes -= len(job.data)
+                        # Finished jobs stay in the history; their bytes do not.
+                        job.data = None
+                    prompt = self._prompt(job.prompt_id)
+                    if job.status == "done":
+                        prompt.done += 1
+                    else:
+                        prompt.failed += 1
+                        prompt.errors.append(job.error)
+                    self._unfinished -= 1
+                    self._forget_finished_jobs()
+                    self._cond.notify_all()
+                self._emit(job)
+            self._queue.task_done()
@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pytest_collect_directory(path, parent):
+    # The repository root is a ComfyUI custom node package whose __init__
+    # needs a running ComfyUI; collect it as a plain directory instead.
+    if str(path) == ROOT:
+        return pytest.Dir.from_parent(parent, path=path)
+    return None
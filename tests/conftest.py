@@ -0,0 +1,106 @@
+import importlib
+import os
+import sys
+import types
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "s3io"
+BUCKET = "s3io-test"
+
+
+def _install_folder_paths(base: str) -> None:
+    # ComfyUI's folder_paths, reduced to the directories the package asks for.
+    module = types.ModuleType("folder_paths")
+    for name in ("input", "output", "temp", "user"):
+        path = os.path.join(base, name)
+        os.makedirs(path, exist_ok=True)
+        setattr(module, f"get_{name}_directory", lambda path=path: path)
+    module.annotated_filepath = lambda name: (name, None)
+    sys.modules["folder_paths"] = module
+
+
+@pytest.fixture(scope="session")
+def s3_server(tmp_path_factory):
+    moto_server = pytest.importorskip("moto.server")
+    server = moto_server.ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def s3io(s3_server, tmp_path_factory):
+    # The package loaded without its __init__, which registers ComfyUI nodes
+    # and routes.
+    _install_folder_paths(str(tmp_path_factory.mktemp("comfyui")))
+    os.environ.update(
+        S3IO_ACCESS_KEY_ID="testing",
+        S3IO_SECRET_ACCESS_KEY="testing",
+        S3IO_BUCKET=BUCKET,
+        S3IO_ENDPOINT_URL=s3_server,
+        S3IO_REGION="us-east-1",
+        S3IO_INPUT_PREFIX="input",
+    )
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [ROOT]
+    sys.modules[PACKAGE] = package
+    helpers = importlib.import_module(f"{PACKAGE}.s3_helpers")
+    helpers.get_s3_client().create_bucket(Bucket=BUCKET)
+    return package
+
+
+def _install_server() -> None:
+    # ComfyUI's PromptServer, reduced to what the route module touches.
+    from aiohttp import web
+
+    class PromptServer:
+        instance = None
+
+        def __init__(self):
+            self.app = web.Application()
+            self.routes = web.RouteTableDef()
+            self.last_prompt_id = None
+
+        def send_sync(self, event, data, sid=None):
+            pass
+
+    module = types.ModuleType("server")
+    module.web = web
+    module.PromptServer = PromptServer
+    PromptServer.instance = PromptServer()
+    sys.modules["server"] = module
+
+
+@pytest.fixture(scope="session")
+def s3io_server(s3io):
+    _install_server()
+    return importlib.import_module(f"{PACKAGE}.s3_server")
+
+
+@pytest.fixture
+def s3io_app(s3io_server, s3_async):
+    # Makes a fresh application with the package's routes: one can only run
+    # on one event loop.
+    from aiohttp import web
+
+    def make_app():
+        app = web.Application()
+        app.add_routes(sys.modules["server"].PromptServer.instance.routes)
+        app.on_cleanup.append(lambda app: s3_async.close())
+        return app
+
+    return make_app
+
+
+@pytest.fixture
+def s3_helpers(s3io):
+    return sys.modules[f"{PACKAGE}.s3_helpers"]
+
+
+@pytest.fixture
+def s3_async(s3io):
+    return importlib.import_module(f"{PACKAGE}.s3_async")
@@ -0,0 +1,55 @@
+import dataclasses
+import importlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def s3_backfill(s3io, s3_helpers, tmp_path, monkeypatch):
+    # Prefixes of its own, so objects from other tests are not in the backlog.
+    config = dataclasses.replace(s3_helpers.get_config(), input_prefix="backfill-in/", thumb_prefix="backfill-thumbs/")
+    monkeypatch.setattr(s3_helpers, "_cached_config", config)
+    monkeypatch.setattr(s3_helpers, "thumbnail_backfill_state_path", lambda: str(tmp_path / "backfill.json"))
+    return importlib.import_module("s3io.s3_backfill")
+
+
+def _jpeg(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_render_pool_uses_threads_in_a_threaded_process(s3_backfill):
+    parked = threading.Event()
+    threading.Thread(target=parked.wait, daemon=True).start()
+    try:
+        with s3_backfill._render_pool(2) as pool:
+            assert isinstance(pool, ThreadPoolExecutor)
+    finally:
+        parked.set()
+
+
+def test_backfill_makes_missing_thumbnails_and_skips_failures(s3_backfill, s3_helpers):
+    client = s3_helpers.get_s3_client()
+    bucket = s3_helpers.get_config().bucket
+    keys = [s3_helpers.input_key_for(f"{index}.jpg") for index in range(3)]
+    for key in keys:
+        client.put_object(Bucket=bucket, Key=key, Body=_jpeg(1200, 600))
+    broken = s3_helpers.input_key_for("broken.png")
+    client.put_object(Bucket=bucket, Key=broken, Body=b"not an image")
+    client.put_object(Bucket=bucket, Key=s3_helpers.thumb_key_for(keys[0]), Body=_jpeg(8, 8))
+
+    status = s3_backfill.run_backfill(workers=2)
+    assert (status["total"], status["done"], status["failed"]) == (3, 2, 1)
+    assert list(status["failures"]) == [broken]
+    thumb = client.get_object(Bucket=bucket, Key=s3_helpers.thumb_key_for(keys[1]))["Body"].read()
+    assert Image.open(io.BytesIO(thumb)).size == (s3_helpers.THUMB_MAX_SIZE, s3_helpers.THUMB_MAX_SIZE // 2)
+
+    status = s3_backfill.run_backfill(workers=2)
+    assert (status["total"], status["skipped"]) == (0, 1)
+    status = s3_backfill.run_backfill(workers=2, retry_failed=True)
+    assert (status["total"], status["failed"]) == (1, 1)
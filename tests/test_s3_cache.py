@@ -0,0 +1,118 @@
+import importlib
+import os
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def s3_cache(s3io):
+    return importlib.import_module("s3io.s3_cache")
+
+
+def _write(path, nbytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * nbytes)
+    return str(path)
+
+
+def test_eviction_removes_the_lock_file(s3_cache, tmp_path):
+    manager = s3_cache.CacheManager(str(tmp_path), max_bytes=10)
+    first = _write(tmp_path / "a" / "first.png", 8)
+    with s3_cache.FileLock(s3_cache.lock_path_for(first)):
+        manager.add(first)
+    assert os.path.exists(s3_cache.lock_path_for(first))
+    manager.add(_write(tmp_path / "a" / "second.png", 8))
+    assert not os.path.exists(first)
+    assert not os.path.exists(s3_cache.lock_path_for(first))
+
+
+def test_held_lock_is_not_removed(s3_cache, tmp_path):
+    lock_path = s3_cache.lock_path_for(str(tmp_path / "held.png"))
+    with s3_cache.FileLock(lock_path):
+        s3_cache.remove_lock_file(lock_path)
+        assert os.path.exists(lock_path)
+        assert not s3_cache.FileLock(lock_path).acquire(blocking=False)
+
+
+def test_waiter_on_a_removed_lock_file_locks_its_replacement(s3_cache, tmp_path):
+    lock_path = s3_cache.lock_path_for(str(tmp_path / "busy.png"))
+    holder = s3_cache.FileLock(lock_path)
+    holder.acquire()
+    waiter = s3_cache.FileLock(lock_path)
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (waiter.acquire(), acquired.set()))
+    thread.start()
+    # Removed while the waiter blocks on the old file, as remove_lock_file does.
+    os.remove(lock_path)
+    holder.release()
+    assert acquired.wait(5)
+    assert os.path.exists(lock_path)
+    assert not s3_cache.FileLock(lock_path).acquire(blocking=False)
+    waiter.release()
+    thread.join(5)
+
+
+def test_rebuild_removes_orphaned_lock_files(s3_cache, tmp_path):
+    kept = _write(tmp_path / "kept.png", 1)
+    open(s3_cache.lock_path_for(kept), "w").close()
+    orphan = s3_cache.lock_path_for(str(tmp_path / "gone.png"))
+    open(orphan, "w").close()
+    s3_cache.CacheManager(str(tmp_path), max_bytes=0).rebuild()
+    assert os.path.exists(s3_cache.lock_path_for(kept))
+    assert not os.path.exists(orphan)
+
+
+def test_link_or_copy_prefers_a_hardlink(s3_cache, tmp_path):
+    source = _write(tmp_path / "source.png", 5)
+    s3_cache.link_or_copy(source, str(tmp_path / "target.png"))
+    assert os.path.samefile(source, tmp_path / "target.png")
+
+
+def test_link_or_copy_falls_back_to_a_reflink(s3_cache, tmp_path, monkeypatch):
+    source = _write(tmp_path / "source.png", 5)
+
+    def no_link(*args):
+        raise OSError("cross-device link")
+
+    def clone(dst, request, src):
+        # What FICLONE leaves behind: the target holds the source's bytes.
+        assert request == s3_cache.FICLONE
+        os.write(dst, os.pread(src, 1024, 0))
+
+    def no_copy(*args):
+        raise AssertionError("copied instead of cloned")
+
+    monkeypatch.setattr(s3_cache.os, "link", no_link)
+    monkeypatch.setattr(s3_cache.fcntl, "ioctl", clone)
+    monkeypatch.setattr(s3_cache.shutil, "copyfile", no_copy)
+    s3_cache.link_or_copy(source, str(tmp_path / "target.png"))
+    assert (tmp_path / "target.png").read_bytes() == b"xxxxx"
+
+
+def test_link_or_copy_falls_back_to_a_copy(s3_cache, tmp_path, monkeypatch):
+    source = _write(tmp_path / "source.png", 5)
+
+    def fail(*args):
+        raise OSError("not supported")
+
+    monkeypatch.setattr(s3_cache.os, "link", fail)
+    monkeypatch.setattr(s3_cache.fcntl, "ioctl", fail)
+    s3_cache.link_or_copy(source, str(tmp_path / "target.png"))
+    assert (tmp_path / "target.png").read_bytes() == b"xxxxx"
+    assert not os.path.samefile(source, tmp_path / "target.png")
+
+
+def test_links_are_free_and_go_with_their_entry(s3_cache, tmp_path):
+    manager = s3_cache.CacheManager(str(tmp_path / "cache"), max_bytes=10)
+    first = _write(tmp_path / "cache" / "first.png", 8)
+    manager.add(first)
+    preview = str(tmp_path / "temp" / "first.png")
+    os.makedirs(os.path.dirname(preview))
+    os.link(first, preview)
+    assert manager.link(first, preview)
+    assert manager.total_bytes == 8
+    assert not manager.link(str(tmp_path / "cache" / "unknown.png"), preview)
+    manager.add(_write(tmp_path / "cache" / "second.png", 8))
+    assert not os.path.exists(first)
+    assert not os.path.exists(preview)
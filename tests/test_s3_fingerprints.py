@@ -0,0 +1,53 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def s3_fingerprints(s3io):
+    return importlib.import_module("s3io.s3_fingerprints")
+
+
+def _files(tmp_path, count):
+    paths = []
+    for index in range(count):
+        path = tmp_path / f"{index}.png"
+        path.write_bytes(str(index).encode())
+        paths.append(str(path))
+    return paths
+
+
+def _rows(cache):
+    return cache._db.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+
+
+def test_eviction_keeps_recently_used_paths(s3_fingerprints, tmp_path, monkeypatch):
+    cache = s3_fingerprints.FingerprintCache(str(tmp_path / "db" / "fingerprints.db"), max_entries=10)
+    paths = _files(tmp_path, 15)
+    for path in paths[:10]:
+        cache.get(path)
+    assert _rows(cache) == 10
+    # Make the oldest entry the most recently used, then overflow the cache.
+    monkeypatch.setattr(s3_fingerprints.time, "time", lambda: 2e9)
+    cache.get(paths[0])
+    for path in paths[10:]:
+        cache.get(path)
+    remaining = {row[0] for row in cache._db.execute("SELECT path FROM fingerprints")}
+    assert len(remaining) <= 10
+    assert paths[0] in remaining
+    assert paths[1] not in remaining
+
+
+def test_lookups_do_not_write_until_a_batch_is_full(s3_fingerprints, tmp_path, monkeypatch):
+    monkeypatch.setattr(s3_fingerprints, "TOUCH_BATCH_SIZE", 3)
+    cache = s3_fingerprints.FingerprintCache(str(tmp_path / "db" / "fingerprints.db"), max_entries=100)
+    paths = _files(tmp_path, 3)
+    for path in paths:
+        cache.get(path)
+    statements = []
+    cache._db.set_trace_callback(statements.append)
+    cache.get(paths[0])
+    cache.get(paths[1])
+    assert not [sql for sql in statements if sql.startswith("UPDATE")]
+    cache.get(paths[2])
+    assert len([sql for sql in statements if sql.startswith("UPDATE")]) == 3
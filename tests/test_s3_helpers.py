@@ -0,0 +1,193 @@
+import asyncio
+import gc
+import io
+import json
+import os
+import sys
+import time
+import urllib.request
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image, UnidentifiedImageError
+
+
+def _failing(s3_helpers, status, code):
+    def call(**kwargs):
+        error = {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}
+        raise s3_helpers.ClientError(error, "GetObject")
+
+    return call
+
+
+@pytest.mark.parametrize("status, code", [(403, "AccessDenied"), (503, "SlowDown"), (500, "InternalError")])
+def test_download_errors_are_not_reported_as_missing(s3_helpers, monkeypatch, status, code):
+    client = s3_helpers.get_s3_client()
+    monkeypatch.setattr(client, "get_object", _failing(s3_helpers, status, code))
+    monkeypatch.setattr(client, "head_object", _failing(s3_helpers, status, code))
+    key = f"input/unreachable-{status}.png"
+    with pytest.raises(s3_helpers.ClientError):
+        s3_helpers.download_to_cache(key)
+    with pytest.raises(s3_helpers.ClientError):
+        s3_helpers.head_object(key)
+
+
+def test_missing_object_is_reported_as_missing(s3_helpers):
+    with pytest.raises(FileNotFoundError):
+        s3_helpers.download_to_cache("input/never-uploaded.png")
+    with pytest.raises(FileNotFoundError):
+        s3_helpers.head_object("input/never-uploaded-either.png")
+
+
+def test_video_stream_counts_against_the_cache_until_complete(s3_helpers, monkeypatch):
+    monkeypatch.setenv("S3IO_RANGE_CHUNK_MB", "1")
+    key = "input/streamed video.mp4"
+    data = os.urandom(3 * 1024 * 1024 + 5)
+    s3_helpers.get_s3_client().put_object(Bucket=s3_helpers.get_config().bucket, Key=key, Body=data)
+    manager = s3_helpers._get_cache_manager()
+    before = manager.total_bytes
+
+    url = s3_helpers.open_object_stream(key)
+    assert url.startswith("http://127.0.0.1:")
+    assert manager.total_bytes >= before + len(data)
+    with urllib.request.urlopen(url) as response:
+        assert response.read() == data
+    # Committed by the thread that fetched the last chunk, which may still be
+    # running when the reader has the last byte.
+    deadline = time.monotonic() + 5
+    while s3_helpers.cached_object_path(key) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert s3_helpers.cached_object_path(key) is not None
+    assert list(manager._reserved) == []
+
+
+def test_cached_thumbnail_is_found_without_the_original(s3_helpers, tmp_path):
+    source_key = s3_helpers.input_key_for("local-thumb.png")
+    assert s3_helpers.cached_thumbnail(source_key) is None
+    source = tmp_path / "local-thumb.png"
+    Image.new("RGB", (64, 32)).save(source)
+    thumb_path, thumb_key = s3_helpers.make_thumbnail(str(source), source_key)
+    assert s3_helpers.cached_thumbnail(source_key) == (thumb_path, thumb_key)
+
+
+def test_next_prompt_releases_the_previous_prompts_pins(s3_helpers, s3io_server, monkeypatch):
+    instance = sys.modules["server"].PromptServer.instance
+    # Pins are found from the prompt ComfyUI is executing, not a wrapped send_sync.
+    assert "send_sync" not in vars(instance)
+    manager = s3_helpers._get_cache_manager()
+    monkeypatch.setattr(instance, "last_prompt_id", "first")
+    s3_helpers._pin_cached_file("first.png")
+    assert manager._pins == {"first.png"}
+    monkeypatch.setattr(instance, "last_prompt_id", "second")
+    s3_helpers._pin_cached_file("second.png")
+    assert (manager._pin_owner, manager._pins) == ("second", {"second.png"})
+    s3_helpers.release_cached_files("second")
+    assert manager._pins == set()
+
+
+def test_preview_of_a_cached_object_is_removed_with_it(s3_helpers):
+    key = s3_helpers.input_key_for("linked-preview.png")
+    s3_helpers.get_s3_client().put_object(Bucket=s3_helpers.get_config().bucket, Key=key, Body=b"png bytes")
+    cache_path = s3_helpers.download_to_cache(key)
+    manager = s3_helpers._get_cache_manager()
+    total = manager.total_bytes
+    subfolder, filename = s3_helpers.local_temp_preview_path(cache_path, key)
+    preview = os.path.join(s3_helpers.folder_paths.get_temp_directory(), subfolder, filename)
+    assert os.path.samefile(cache_path, preview)
+    assert manager.total_bytes == total
+    manager.remove(cache_path)
+    assert not os.path.exists(preview)
+
+
+@pytest.mark.parametrize("durable, syncs", [(False, 0), (True, 2)])
+def test_write_json_atomic_syncs_only_when_durable(s3_helpers, tmp_path, monkeypatch, durable, syncs):
+    s3_cache = sys.modules["s3io.s3_cache"]
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(s3_cache.os, "fsync", lambda fd: synced.append(fd) or fsync(fd))
+    path = str(tmp_path / "state" / "state.json")
+    s3_cache.write_json_atomic(path, {"a": 1}, durable=durable)
+    with open(path) as handle:
+        assert json.load(handle) == {"a": 1}
+    # The file itself, then the directory entry that names it.
+    assert len(synced) == syncs
+    assert os.listdir(tmp_path / "state") == ["state.json"]
+
+
+def test_failed_write_json_atomic_keeps_the_old_file(s3_helpers, tmp_path):
+    s3_cache = sys.modules["s3io.s3_cache"]
+    path = str(tmp_path / "state.json")
+    s3_cache.write_json_atomic(path, {"a": 1}, durable=True)
+    with pytest.raises(TypeError):
+        s3_cache.write_json_atomic(path, {"a": object()}, durable=True)
+    with open(path) as handle:
+        assert json.load(handle) == {"a": 1}
+    assert not os.path.exists(s3_cache.temp_path_for(path))
+    assert os.listdir(tmp_path) == ["state.json"]
+
+
+def _put_image(s3_helpers, name):
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 320), (40, 50, 60)).save(buffer, "PNG")
+    key = s3_helpers.input_key_for(name)
+    s3_helpers.get_s3_client().put_object(Bucket=s3_helpers.get_config().bucket, Key=key, Body=buffer.getvalue())
+    return key
+
+
+def test_thumbnail_whose_upload_failed_is_reused(s3_helpers, s3io_server, s3io_app, monkeypatch):
+    key = _put_image(s3_helpers, "unuploaded-thumb.png")
+    rendered = []
+    make_thumbnail = s3_helpers.make_thumbnail
+
+    def counting(*args, **kwargs):
+        rendered.append(args[1])
+        return make_thumbnail(*args, **kwargs)
+
+    async def failing_upload(path, key, **kwargs):
+        raise OSError("upload failed")
+
+    monkeypatch.setattr(s3_helpers, "make_thumbnail", counting)
+    monkeypatch.setattr(s3io_server, "_upload_file", failing_upload)
+
+    async def run():
+        statuses = []
+        async with TestClient(TestServer(s3io_app())) as client:
+            for _ in range(2):
+                response = await client.get("/s3io/preview/image?name=unuploaded-thumb.png")
+                statuses.append(response.status)
+                # Let the failed upload settle so the next preview starts afresh.
+                while (key, False) in s3io_server._thumb_flights:
+                    await asyncio.sleep(0.01)
+        return statuses
+
+    assert asyncio.run(run()) == [200, 200]
+    assert rendered == [key]
+
+
+def test_thumbnail_failures_reach_every_waiter_and_no_one_else(s3_helpers, s3io_server, s3_async):
+    key = s3_helpers.input_key_for("broken-thumb.png")
+    s3_helpers.get_s3_client().put_object(Bucket=s3_helpers.get_config().bucket, Key=key, Body=b"not an image")
+    unhandled = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unhandled.append(context))
+        waiters = await asyncio.gather(
+            s3io_server._thumbnail_for(key), s3io_server._thumbnail_for(key), return_exceptions=True
+        )
+        # A flight whose only waiter went away, as a closed preview request does.
+        abandoned = asyncio.ensure_future(s3io_server._thumbnail_for(key))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        while (key, False) in s3io_server._thumb_flights:
+            await asyncio.sleep(0.01)
+        errors = [type(error) for error in waiters]
+        shared = waiters[0] is waiters[1]
+        # The errors' tracebacks hold the flights; drop them so unretrieved
+        # failures are reported now.
+        del waiters
+        gc.collect()
+        await s3_async.close()
+        return errors, shared
+
+    assert asyncio.run(run()) == ([UnidentifiedImageError, UnidentifiedImageError], True)
+    assert unhandled == []
@@ -0,0 +1,68 @@
+import importlib
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def s3_listing(s3io):
+    return importlib.import_module("s3io.s3_listing")
+
+
+def test_changes_during_a_scan_survive_it(s3_listing):
+    objects = ["input/a.png", "input/b.png"]
+    scanning = threading.Event()
+    finish = threading.Event()
+
+    def scan(prefix):
+        snapshot = list(objects)
+        scanning.set()
+        finish.wait(5)
+        return snapshot
+
+    index = s3_listing.ListingIndex(scan, ttl_seconds=60)
+    result = []
+    worker = threading.Thread(target=lambda: result.append(index.get("input/", ["png"])))
+    worker.start()
+    assert scanning.wait(5)
+    index.add_key("input/c.png")
+    index.remove_key("input/a.png")
+    finish.set()
+    worker.join(5)
+    assert result == [["b.png", "c.png"]]
+    assert index.get("input/", ["png"]) == ["b.png", "c.png"]
+
+
+def test_refresh_scans_synchronously(s3_listing):
+    objects = ["input/a.png"]
+    index = s3_listing.ListingIndex(lambda prefix: list(objects), ttl_seconds=60)
+    assert index.get("input/", ["png"]) == ["a.png"]
+    objects.append("input/b.png")
+    assert index.get("input/", ["png"]) == ["a.png"]
+    assert index.get("input/", ["png"], refresh=True) == ["a.png", "b.png"]
+
+
+def test_failed_background_refresh_keeps_the_snapshot(s3_listing, caplog):
+    scans = []
+    failed = threading.Event()
+
+    def scan(prefix):
+        scans.append(prefix)
+        if len(scans) > 1:
+            failed.set()
+            raise OSError("listing failed")
+        return ["input/a.png"]
+
+    index = s3_listing.ListingIndex(scan, ttl_seconds=0)
+    assert index.get("input/", ["png"]) == ["a.png"]
+    with caplog.at_level("DEBUG", logger=s3_listing.__name__):
+        assert index.get("input/", ["png"]) == ["a.png"]
+        assert failed.wait(5)
+        for _ in range(50):
+            if not index._refreshing:
+                break
+            time.sleep(0.1)
+    assert not index._refreshing
+    assert "Background listing refresh of input/ failed" in caplog.text
+    assert index.get("input/", ["png"]) == ["a.png"]
@@ -0,0 +1,197 @@
+import asyncio
+import importlib
+import io
+import json
+import os
+import threading
+import urllib.request
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+
+STREAM_NAME = "stream.bin"
+STREAM_DATA = os.urandom(3 * 1024 * 1024 + 17)
+
+
+def _request(make_app, method, path, **kwargs):
+    async def run():
+        async with TestClient(TestServer(make_app())) as client:
+            response = await client.request(method, path, allow_redirects=False, **kwargs)
+            return response.status, response.headers, await response.read()
+
+    return asyncio.run(run())
+
+
+def _get(make_app, path, **kwargs):
+    return _request(make_app, "GET", path, **kwargs)
+
+
+@pytest.fixture
+def streamed(s3_helpers, s3io_app):
+    key = s3_helpers.input_key_for(STREAM_NAME)
+    s3_helpers.get_s3_client().put_object(Bucket=s3_helpers.get_config().bucket, Key=key, Body=STREAM_DATA)
+    s3_helpers.forget_object_metadata(key)
+    return key
+
+
+def _stream(app, **headers):
+    return _get(app, f"/s3io/stream/input?name={STREAM_NAME}", headers=headers)
+
+
+def test_stream_serves_the_whole_object(s3io_app, streamed):
+    status, headers, body = _stream(s3io_app)
+    assert (status, body) == (200, STREAM_DATA)
+    assert headers["Accept-Ranges"] == "bytes"
+    # The full read was kept, so the second one comes from the cache.
+    status, _, body = _stream(s3io_app)
+    assert (status, body) == (200, STREAM_DATA)
+
+
+def test_stream_ranges(s3io_app, streamed):
+    size = len(STREAM_DATA)
+    status, headers, body = _stream(s3io_app, Range="bytes=10-19")
+    assert (status, body) == (206, STREAM_DATA[10:20])
+    assert headers["Content-Range"] == f"bytes 10-19/{size}"
+    status, _, body = _stream(s3io_app, Range="bytes=-5")
+    assert (status, body) == (206, STREAM_DATA[-5:])
+    status, headers, _ = _stream(s3io_app, Range=f"bytes={size}-")
+    assert status == 416
+    assert headers["Content-Range"] == f"bytes */{size}"
+
+
+def test_stream_conditional_requests(s3io_app, streamed):
+    _, headers, _ = _stream(s3io_app)
+    etag = headers["ETag"]
+    status, _, body = _stream(s3io_app, **{"If-None-Match": etag})
+    assert (status, body) == (304, b"")
+    status, _, body = _stream(s3io_app, **{"If-None-Match": '"other"'})
+    assert (status, body) == (200, STREAM_DATA)
+    status, _, body = _stream(s3io_app, Range="bytes=0-9", **{"If-Range": etag})
+    assert (status, body) == (206, STREAM_DATA[:10])
+    # A stale If-Range gets the whole current object instead of a range of it.
+    status, _, body = _stream(s3io_app, Range="bytes=0-9", **{"If-Range": '"other"'})
+    assert (status, body) == (200, STREAM_DATA)
+
+
+def test_cached_stream_survives_a_refresh_mid_response(s3io_app, s3_helpers, streamed, monkeypatch):
+    assert _stream(s3io_app)[2] == STREAM_DATA
+    cache_path = s3_helpers.cache_path_for(streamed)
+    open_cached_object = s3_helpers.open_cached_object
+    opened = []
+
+    def open_then_refresh(key, etag, kind="objects"):
+        handle = open_cached_object(key, etag, kind)
+        opened.append(handle)
+        # Another download commits a new version right after the handle opened.
+        replacement = cache_path + ".new"
+        with open(replacement, "wb") as new:
+            new.write(b"y" * len(STREAM_DATA))
+        s3_helpers.commit_cached_file(cache_path, replacement, "newer")
+        return handle
+
+    monkeypatch.setattr(s3_helpers, "open_cached_object", open_then_refresh)
+    status, _, body = _stream(s3io_app)
+    assert opened[0] is not None
+    assert (status, body) == (200, STREAM_DATA)
+
+
+@pytest.fixture
+def direct_uploads(s3_helpers, monkeypatch):
+    monkeypatch.setenv("S3IO_DIRECT_UPLOADS", "1")
+    return s3_helpers.get_direct_uploads()
+
+
+def _start_direct(make_app, filename):
+    status, _, body = _request(make_app, "POST", "/s3io/upload/direct/start", json={"filename": filename, "size": 5})
+    assert status == 200
+    return json.loads(body)
+
+
+def _open_uploads(s3_helpers):
+    listed = s3_helpers.get_s3_client().list_multipart_uploads(Bucket=s3_helpers.get_config().bucket)
+    return {upload["UploadId"] for upload in listed.get("Uploads", [])}
+
+
+def test_direct_upload_is_kept_on_disk_until_completed(s3io_app, s3_helpers, direct_uploads):
+    started = _start_direct(s3io_app, "direct.bin")
+    sessions = importlib.import_module("s3io.s3_sessions")
+    # What a restarted server would load.
+    assert sessions.UploadSessions(direct_uploads._path).get(started["upload_id"])["name"] == started["name"]
+
+    request = urllib.request.Request(
+        started["urls"][0], data=b"bytes", method="PUT", headers={"Content-Type": "application/octet-stream"}
+    )
+    with urllib.request.urlopen(request) as response:
+        etag = response.headers["ETag"]
+    status, _, body = _request(
+        s3io_app, "POST", "/s3io/upload/direct/complete",
+        json={"upload_id": started["upload_id"], "parts": [{"part_number": 1, "etag": etag}]},
+    )
+    assert status == 200
+    assert direct_uploads.get(started["upload_id"]) is None
+    key = s3_helpers.input_key_for(started["name"])
+    assert s3_helpers.get_s3_client().get_object(Bucket=s3_helpers.get_config().bucket, Key=key)["Body"].read() == b"bytes"
+
+
+def test_stale_direct_uploads_are_aborted(s3io_app, s3_helpers, direct_uploads):
+    started = _start_direct(s3io_app, "stale.bin")
+    assert started["upload_id"] in _open_uploads(s3_helpers)
+    # Started before the part URLs' lifetime, twice over.
+    direct_uploads._sessions[started["upload_id"]]["created_at"] -= 2 * s3_helpers.presign_expires_seconds() + 1
+    assert s3_helpers.abort_stale_uploads() >= 1
+    assert direct_uploads.get(started["upload_id"]) is None
+    assert started["upload_id"] not in _open_uploads(s3_helpers)
+
+
+def test_listing_scans_use_the_asyncio_client_off_the_loop(s3io_server, s3_helpers, s3_async, monkeypatch):
+    boto3_scans = []
+    monkeypatch.setattr(s3_helpers, "list_objects", lambda prefix: boto3_scans.append(prefix) or [])
+    monkeypatch.setattr(s3_async, "list_objects", _async_listing)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        assert s3io_server._list_on_loop(loop, "input/") == ["input/async.png"]
+        on_loop = asyncio.run_coroutine_threadsafe(_call(s3io_server._list_on_loop, loop, "input/"), loop)
+        assert on_loop.result(5) == []
+        assert boto3_scans == ["input/"]
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+        loop.close()
+
+
+async def _async_listing(prefix):
+    return [f"{prefix}async.png"]
+
+
+async def _call(func, *args):
+    # As a node's INPUT_TYPES does: synchronously, on the loop's own thread.
+    return func(*args)
+
+
+def test_presigned_preview_makes_a_missing_thumbnail(s3io_app, s3_helpers, monkeypatch):
+    monkeypatch.setenv("S3IO_PRESIGNED_PREVIEW", "1")
+    buffer = io.BytesIO()
+    Image.new("RGB", (1600, 800), (10, 20, 30)).save(buffer, "JPEG")
+    key = s3_helpers.input_key_for("presigned-original.jpg")
+    s3_helpers.get_s3_client().put_object(Bucket=s3_helpers.get_config().bucket, Key=key, Body=buffer.getvalue())
+
+    status, _, body = _get(s3io_app, "/s3io/preview/image?name=presigned-original.jpg")
+    assert status == 200
+    with urllib.request.urlopen(json.loads(body)["url"]) as response:
+        preview = Image.open(io.BytesIO(response.read()))
+    assert max(preview.size) == s3_helpers.THUMB_MAX_SIZE
+    s3_helpers.get_s3_client().head_object(Bucket=s3_helpers.get_config().bucket, Key=s3_helpers.thumb_key_for(key))
+
+
+def test_presigned_preview_of_a_non_image_is_the_original(s3io_app, s3_helpers, monkeypatch):
+    monkeypatch.setenv("S3IO_PRESIGNED_PREVIEW", "1")
+    key = s3_helpers.input_key_for("presigned-broken.png")
+    s3_helpers.get_s3_client().put_object(Bucket=s3_helpers.get_config().bucket, Key=key, Body=b"not an image")
+    status, _, body = _get(s3io_app, "/s3io/preview/image?name=presigned-broken.png")
+    assert status == 200
+    with urllib.request.urlopen(json.loads(body)["url"]) as response:
+        assert response.read() == b"not an image"
@@ -0,0 +1,50 @@
+import importlib
+import time
+
+import pytest
+
+
+class _Download:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def s3_stream(s3io):
+    return importlib.import_module("s3io.s3_stream")
+
+
+def test_pinned_and_busy_sessions_survive_eviction(s3_stream):
+    sessions = s3_stream._Sessions()
+    pinned, busy, idle, newest = _Download(), _Download(), _Download(), _Download()
+    assert sessions.add("pinned", pinned, "prompt", limit=1) == []
+    sessions.add("busy", busy, None, limit=3)
+    assert sessions.open("busy") is busy
+    sessions.add("idle", idle, None, limit=3)
+    assert sessions.add("newest", newest, None, limit=1) == [idle]
+    sessions.done("busy")
+    assert sessions.release("prompt", limit=1) == [pinned, busy]
+    assert sessions.open("newest") is newest
+
+
+def test_idle_sessions_expire(s3_stream):
+    sessions = s3_stream._Sessions()
+    old, recent = _Download(), _Download()
+    sessions.add("old", old, None, limit=8)
+    cutoff = time.monotonic()
+    sessions.add("recent", recent, None, limit=8)
+    assert sessions.evict(8, idle_before=cutoff) == [old]
+
+
+def test_reserved_bytes_push_files_out_of_the_cache(s3io, tmp_path):
+    manager = importlib.import_module("s3io.s3_cache").CacheManager(str(tmp_path), max_bytes=100)
+    cached = tmp_path / "cached.bin"
+    cached.write_bytes(b"x" * 60)
+    manager.add(str(cached))
+    manager.reserve("stream", 60)
+    assert not cached.exists()
+    assert manager.total_bytes == 60
+    manager.unreserve("stream")
+    assert manager.total_bytes == 0
@@ -0,0 +1,274 @@
+import asyncio
+import importlib
+import os
+import threading
+import time
+
+import pytest
+from aiohttp import FormData
+from aiohttp.payload import BytesPayload
+from aiohttp.test_utils import TestClient, TestServer
+
+
+@pytest.fixture
+def s3_uploads(s3io):
+    return importlib.import_module("s3io.s3_uploads")
+
+
+def test_job_is_found_by_its_submitted_key_after_reallocation(s3_uploads):
+    started = threading.Event()
+    release = threading.Event()
+
+    def upload(jobs):
+        started.set()
+        release.wait(5)
+        jobs[0].key = "output/taken (1).png"
+        return [None]
+
+    uploads = s3_uploads.UploadQueue(upload, workers=1, max_pending=4)
+    uploads.submit([s3_uploads.UploadJob(None, "output/taken.png", "image/png", "prompt", data=b"png")])
+    assert started.wait(5)
+    assert uploads.job("output/taken.png").status == "uploading"
+    release.set()
+    assert uploads.wait("prompt", timeout=5)
+    job = uploads.job("output/taken.png")
+    assert (job.status, job.key) == ("done", "output/taken (1).png")
+    assert uploads.job("output/other.png") is None
+
+
+def test_in_memory_uploads_wait_for_their_bytes_to_fit(s3_uploads):
+    release = threading.Event()
+    uploaded = []
+
+    def upload(jobs):
+        release.wait(5)
+        uploaded.extend(job.key for job in jobs)
+        return [None] * len(jobs)
+
+    uploads = s3_uploads.UploadQueue(upload, workers=1, max_pending=8, max_pending_bytes=10)
+    uploads.submit([s3_uploads.UploadJob(None, "output/a.png", "image/png", "prompt", data=b"x" * 8)])
+    second = threading.Thread(
+        target=uploads.submit,
+        args=([s3_uploads.UploadJob(None, "output/b.png", "image/png", "prompt", data=b"x" * 8)],),
+    )
+    second.start()
+    second.join(0.2)
+    assert second.is_alive()
+    assert uploads.job("output/b.png") is None
+    release.set()
+    second.join(5)
+    assert uploads.wait("prompt", timeout=5)
+    assert uploaded == ["output/a.png", "output/b.png"]
+    assert uploads.job("output/a.png").data is None
+
+
+def test_drain_gives_up_after_its_timeout(s3_uploads, caplog):
+    release = threading.Event()
+
+    def upload(jobs):
+        release.wait(5)
+        return [None] * len(jobs)
+
+    uploads = s3_uploads.UploadQueue(upload, workers=1, max_pending=4)
+    uploads.submit([
+        s3_uploads.UploadJob("/tmp/a.png", "output/a.png", "image/png", None, journal_id="a"),
+        s3_uploads.UploadJob(None, "output/b.png", "image/png", None, data=b"png"),
+    ])
+    with caplog.at_level("WARNING"):
+        assert not uploads.drain(timeout=0.1)
+    assert "output/a.png did not finish; it resumes on the next start" in caplog.text
+    assert "output/b.png did not finish and is lost" in caplog.text
+    release.set()
+    assert uploads.drain(timeout=5)
+
+
+def test_next_output_counter_matches_batch_numbers(s3_helpers):
+    client = s3_helpers.get_s3_client()
+    bucket = s3_helpers.get_config().bucket
+    for name in ("run_0_00004_.png", "run_1_00005_.png", "other_0_00009_.png"):
+        client.put_object(Bucket=bucket, Key=s3_helpers.output_key_for("counter", name), Body=b"png")
+    assert s3_helpers.next_output_counter("counter", "run_%batch_num%") == 6
+
+
+def test_batch_shares_one_part_budget(s3_helpers, monkeypatch):
+    transfer = s3_helpers.TransferConfig(multipart_threshold=5 * 1024 * 1024, max_concurrency=2)
+    monkeypatch.setattr(s3_helpers, "_cached_transfer_config", transfer)
+    monkeypatch.setattr(s3_helpers, "_transfer_pool", None)
+    monkeypatch.setattr(s3_helpers, "_part_pool", None)
+    client = s3_helpers.get_s3_client()
+    upload_part = client.upload_part
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def counting_upload_part(**kwargs):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        try:
+            return upload_part(**kwargs)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    monkeypatch.setattr(client, "upload_part", counting_upload_part)
+    data = b"x" * (11 * 1024 * 1024)
+    jobs = [
+        s3_helpers.UploadJob(None, s3_helpers.output_key_for("parts", f"{index}.bin"), None, None, data=data)
+        for index in range(3)
+    ]
+    assert s3_helpers._run_upload_batch(jobs) == [None, None, None]
+    assert active[1] <= 2
+
+
+@pytest.fixture
+def journal(s3_helpers, tmp_path, monkeypatch):
+    journal = importlib.import_module("s3io.s3_journal").UploadJournal(str(tmp_path / "uploads.json"))
+    monkeypatch.setattr(s3_helpers, "_upload_journal", journal)
+    monkeypatch.setattr(s3_helpers, "_journal_resumed", False)
+    monkeypatch.setattr(s3_helpers, "UPLOAD_RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setenv("S3IO_BACKGROUND_UPLOADS", "0")
+    return journal
+
+
+def test_failed_upload_is_retried(s3_helpers, journal, tmp_path, monkeypatch):
+    path = tmp_path / "out.png"
+    path.write_bytes(b"png")
+    put_file = s3_helpers._put_file
+    calls = []
+
+    def flaky_put_file(*args):
+        calls.append(args)
+        if len(calls) < 3:
+            raise OSError("connection reset")
+        put_file(*args)
+
+    monkeypatch.setattr(s3_helpers, "_put_file", flaky_put_file)
+    s3_helpers.enqueue_uploads([(str(path), s3_helpers.output_key_for("retry", "out.png"), "image/png")])
+    assert len(calls) == 3
+    assert journal.entries() == {}
+
+
+def test_resume_gives_up_after_repeated_failures(s3_helpers, journal, tmp_path, monkeypatch):
+    path = tmp_path / "out.png"
+    path.write_bytes(b"png")
+    key = s3_helpers.output_key_for("resume", "out.png")
+    entry_id = journal.add_many([(str(path), key, "image/png")])[0]
+
+    def failing_put_file(*args):
+        raise OSError("connection reset")
+
+    monkeypatch.setattr(s3_helpers, "_put_file", failing_put_file)
+    for run in range(s3_helpers.UPLOAD_RESUME_LIMIT):
+        monkeypatch.setattr(s3_helpers, "_journal_resumed", False)
+        assert s3_helpers.resume_pending_uploads() == 1
+        assert journal.get(entry_id)["failures"] == run + 1
+    monkeypatch.setattr(s3_helpers, "_journal_resumed", False)
+    assert s3_helpers.resume_pending_uploads() == 0
+    assert journal.entries() == {}
+
+
+def test_taken_name_moves_the_whole_group(s3_helpers, journal, tmp_path):
+    client = s3_helpers.get_s3_client()
+    bucket = s3_helpers.get_config().bucket
+    names, keys = s3_helpers.resolve_unique_output_filenames("group", ["clip.mp4", "clip.png"])
+    assert names == ["clip.mp4", "clip.png"]
+    # Another instance writes the preview name after the names were handed out.
+    client.put_object(Bucket=bucket, Key=keys[1], Body=b"theirs")
+    items = []
+    for name, key in zip(names, keys):
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        items.append((str(path), key, None))
+
+    s3_helpers.enqueue_uploads(items, exclusive=True, grouped=True)
+    listed = client.list_objects_v2(Bucket=bucket, Prefix=s3_helpers.output_key_for("group", ""))
+    stored = {item["Key"].rsplit("/", 1)[1] for item in listed["Contents"]}
+    assert stored == {"clip.png", "clip (1).mp4", "clip (1).png"}
+    assert client.get_object(Bucket=bucket, Key=keys[1])["Body"].read() == b"theirs"
+    assert journal.entries() == {}
+
+
+def test_store_without_conditional_writes_gets_plain_puts(s3_helpers, journal, tmp_path, monkeypatch):
+    client = s3_helpers.get_s3_client()
+    put_object = client.put_object
+
+    def put_object_without_conditions(**kwargs):
+        if "IfNoneMatch" in kwargs:
+            error = {"Error": {"Code": "NotImplemented"}, "ResponseMetadata": {"HTTPStatusCode": 501}}
+            raise s3_helpers.ClientError(error, "PutObject")
+        return put_object(**kwargs)
+
+    monkeypatch.setattr(client, "put_object", put_object_without_conditions)
+    monkeypatch.setattr(s3_helpers, "_conditional_writes_supported", True)
+    path = tmp_path / "plain.png"
+    path.write_bytes(b"png")
+    key = s3_helpers.output_key_for("plain", "plain.png")
+    s3_helpers.enqueue_uploads([(str(path), key, "image/png")], exclusive=True)
+    assert client.get_object(Bucket=s3_helpers.get_config().bucket, Key=key)["Body"].read() == b"png"
+    assert not s3_helpers._conditional_writes_supported
+    assert journal.entries() == {}
+
+
+def _spool_files(s3io_server):
+    upload_dir = s3io_server.folder_paths.get_input_directory()
+    return [name for name in os.listdir(upload_dir) if name.startswith(s3io_server.UPLOAD_SPOOL_PREFIX)]
+
+
+def _post_form(make_app, form):
+    async def run():
+        async with TestClient(TestServer(make_app())) as client:
+            response = await client.post("/s3io/upload/image", data=form)
+            return response.status
+
+    return asyncio.run(run())
+
+
+def _image_form():
+    form = FormData()
+    form.add_field("image", b"not really a png", filename="spooled.png", content_type="image/png")
+    return form
+
+
+def test_sweep_removes_only_stale_spool_files(s3io_server):
+    upload_dir = s3io_server.folder_paths.get_input_directory()
+    stale = os.path.join(upload_dir, f"{s3io_server.UPLOAD_SPOOL_PREFIX}stale.part")
+    fresh = os.path.join(upload_dir, f"{s3io_server.UPLOAD_SPOOL_PREFIX}fresh.part")
+    unrelated = os.path.join(upload_dir, "old-input.part")
+    for path in (stale, fresh, unrelated):
+        open(path, "wb").close()
+    old = time.time() - s3io_server.UPLOAD_SPOOL_MAX_AGE_SECONDS - 60
+    os.utime(stale, (old, old))
+    os.utime(unrelated, (old, old))
+    try:
+        s3io_server._sweep_upload_spool()
+        assert not os.path.exists(stale)
+        assert os.path.exists(fresh)
+        assert os.path.exists(unrelated)
+    finally:
+        for path in (fresh, unrelated):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def test_oversized_form_field_is_rejected_and_the_spool_removed(s3io_app, s3io_server):
+    form = _image_form()
+    # After the file, so the spool file exists when the field is refused.
+    form.add_field("subfolder", "x" * (s3io_server.FORM_FIELD_MAX_BYTES + 1))
+    assert _post_form(s3io_app, form) == 413
+    assert _spool_files(s3io_server) == []
+
+
+def test_too_many_form_fields_are_rejected(s3io_app, s3io_server):
+    form = _image_form()
+    for index in range(s3io_server.FORM_FIELDS_MAX + 1):
+        form.add_field(f"field{index}", "value")
+    assert _post_form(s3io_app, form) == 400
+    assert _spool_files(s3io_server) == []
+
+
+def test_undecodable_form_field_is_rejected(s3io_app, s3io_server):
+    form = _image_form()
+    # A payload rather than bytes, which FormData would send as a file.
+    form.add_field("subfolder", BytesPayload(b"\xff\xfe", content_type="text/plain; charset=utf-8"))
+    assert _post_form(s3io_app, form) == 400
+    assert _spool_files(s3io_server) == []
@@ -1,4 +1,5 @@
 import { app } from "../../../scripts/app.js";
+import { api } from "../../../scripts/api.js";
 
 const EXTENSION_NAME = "comfy.s3io.download";
 const TARGET_NODES = new Set(["SaveImageS3", "VideoCombineS3"]);
@@ -40,7 +41,16 @@ const buildRelativePath = (subfolder, filename) => {
     return safeSubfolder ? `${safeSubfolder}/${safeFilename}` : safeFilename;
 };
 
+const S3_OUTPUT_TYPE = "s3-output";
+
 const buildViewUrl = (filename, subfolder, type) => {
+    // Outputs kept only in S3 are served by the extension, not /view.
+    if (type === S3_OUTPUT_TYPE) {
+        const url = new URL("/s3io/download/output", window.location.origin);
+        url.searchParams.set("filename", filename);
+        if (subfolder) url.searchParams.set("subfolder", subfolder);
+        return url.toString();
+    }
     const url = new URL("/view", window.location.origin);
     url.searchParams.set("filename", filename);
     if (subfolder) url.searchParams.set("subfolder", subfolder);
@@ -49,8 +59,9 @@ const buildViewUrl = (filename, subfolder, type) => {
 };
 
 const collectEntries = (output) => {
+    // Explicit download references win over previews, which may be lossy.
+    if (Array.isArray(output?.downloads) && output.downloads.length) return [...output.downloads];
     const entries = [];
-    if (Array.isArray(output?.downloads)) entries.push(...output.downloads);
     if (Array.isArray(output?.images)) entries.push(...output.images);
     if (Array.isArray(output?.gifs)) entries.push(...output.gifs);
     return entries;
@@ -87,8 +98,26 @@ const requestDownloads = (output) => {
     }
 };
 
+const UPLOAD_EVENT = "s3io.upload";
+const reportedFailures = new Set();
+
+const onUploadEvent = ({ detail }) => {
+    if (!detail) return;
+    if (detail.status === "failed" && detail.error && !reportedFailures.has(detail.error)) {
+        reportedFailures.add(detail.error);
+        toast("S3 upload failed", detail.error, "error");
+    }
+    if (detail.status === "done" && detail.pending === 0) {
+        const failed = detail.failed ? `, ${detail.failed} failed` : "";
+        toast("S3 uploads finished", `${detail.done} file(s) uploaded${failed}`, detail.failed ? "warn" : "success");
+    }
+};
+
 app.registerExtension({
     name: EXTENSION_NAME,
+    setup() {
+        api.addEventListener(UPLOAD_EVENT, onUploadEvent);
+    },
     beforeRegisterNodeDef(nodeType, nodeData) {
         if (!TARGET_NODES.has(nodeData?.name)) return;
 
@@ -8,8 +8,18 @@ const PREVIEW_NODE_CONFIGS = {
     },
     LoadVideoUploadS3: {
         previewRoute: "/s3io/preview/video",
+        // Played straight from S3 with range requests, so scrubbing starts
+        // before the whole video has been downloaded.
+        streamRoute: "/s3io/stream/input",
     },
 };
+const DIRECT_UPLOAD_ROUTE = "/s3io/upload/direct";
+const SESSION_UPLOAD_ROUTE = "/s3io/upload/sessions";
+// Files at least this large go through a resumable upload session.
+const SESSION_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+const SESSION_STORAGE_PREFIX = "s3io.upload-session:";
+const PART_CONCURRENCY = 4;
+const PART_ATTEMPTS = 3;
 const ACCEPTED_IMAGE_TYPES = "image/png,image/jpeg,image/webp";
 const ACCEPTED_VIDEO_TYPES =
     "video/webm,video/mp4,video/quicktime,video/x-matroska,image/gif";
@@ -109,36 +119,274 @@ const setNodePreviewOutput = (node, entry) => {
     node.graph?.setDirtyCanvas(true);
 };
 
+// Presigned S3 URLs bypass /view, so the image is drawn from node.imgs.
+const setNodePreviewUrl = (node, url, isCurrent) => {
+    if (!node || !url) return;
+    const img = new Image();
+    img.onload = () => {
+        if (!isCurrent()) return;
+        if (app.nodeOutputs?.[`${node.id}`]) delete app.nodeOutputs[`${node.id}`];
+        node.imgs = [img];
+        node.imageIndex = null;
+        node.graph?.setDirtyCanvas(true);
+    };
+    img.src = url;
+};
+
+const VIDEO_STREAM_WIDGET = "s3io_video_preview";
+
+const setNodeVideoStream = (node, url) => {
+    let widget = node.widgets?.find((w) => w.name === VIDEO_STREAM_WIDGET);
+    if (!widget) {
+        if (!url) return;
+        const video = document.createElement("video");
+        video.controls = true;
+        video.muted = true;
+        video.loop = true;
+        video.preload = "metadata";
+        video.style.width = "100%";
+        widget = node.addDOMWidget(VIDEO_STREAM_WIDGET, "preview", video, {
+            serialize: false,
+        });
+        widget.serialize = false;
+    }
+    if (url) {
+        widget.element.src = url;
+    } else {
+        widget.element.removeAttribute("src");
+        widget.element.load();
+    }
+    node.graph?.setDirtyCanvas(true);
+};
+
 const clearNodePreviewOutput = (node) => {
-    if (!node || !app.nodeOutputs) return;
+    if (!node) return;
+    setNodeVideoStream(node, null);
+    if (node.imgs?.length) {
+        node.imgs = undefined;
+        node.graph?.setDirtyCanvas(true);
+    }
+    if (!app.nodeOutputs) return;
     if (app.nodeOutputs[`${node.id}`]) {
         delete app.nodeOutputs[`${node.id}`];
         node.graph?.setDirtyCanvas(true);
     }
 };
 
-const uploadFile = async (
-    file,
-    { isPasted = false, uploadRoute, formField }
-) => {
-    const body = new FormData();
-    body.append(formField, file);
-    if (isPasted) body.append("subfolder", "pasted");
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
 
-    const resp = await api.fetchApi(uploadRoute, {
+const postJson = (route, payload) =>
+    api.fetchApi(route, {
         method: "POST",
-        body,
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(payload),
     });
 
+const withRetries = async (send) => {
+    let lastError;
+    for (let attempt = 0; attempt < PART_ATTEMPTS; attempt++) {
+        if (attempt) await sleep(500 * 2 ** attempt);
+        try {
+            return await send();
+        } catch (err) {
+            if (err.final) throw err;
+            lastError = err;
+        }
+    }
+    throw lastError;
+};
+
+// Runs `task` over `items` with a bounded number in flight; stops handing
+// out work after the first failure and rejects with it.
+const runPool = async (items, concurrency, task) => {
+    let next = 0;
+    let failed = false;
+    const worker = async () => {
+        while (!failed && next < items.length) {
+            const item = items[next++];
+            try {
+                await task(item);
+            } catch (err) {
+                failed = true;
+                throw err;
+            }
+        }
+    };
+    await Promise.all(
+        Array.from({ length: Math.min(concurrency, items.length) }, worker)
+    );
+};
+
+const partNumbers = (count) => Array.from({ length: count }, (_, i) => i + 1);
+
+const uploadedPath = async (resp) => {
     if (resp.status !== 200) {
         toast("Upload failed", `${resp.status} - ${resp.statusText}`, "error");
         return null;
     }
-
     const data = await resp.json();
     return data.subfolder ? `${data.subfolder}/${data.name}` : data.name;
 };
 
+const putPart = (url, blob) =>
+    withRetries(async () => {
+        const resp = await fetch(url, { method: "PUT", body: blob });
+        if (!resp.ok) throw new Error(`${resp.status} - ${resp.statusText}`);
+        const etag = resp.headers.get("ETag");
+        if (!etag) {
+            // Retrying will not help: the part cannot be completed without it.
+            const err = new Error("The bucket's CORS rules do not expose the ETag header");
+            err.final = true;
+            throw err;
+        }
+        return etag;
+    });
+
+let directUploadsAvailable = true;
+
+// Resolves to the uploaded path, null on failure, or undefined when the file
+// should go through the ComfyUI server instead.
+const uploadFileDirect = async (file, { isPasted = false, mediaType }) => {
+    if (!directUploadsAvailable) return undefined;
+    const start = await postJson(`${DIRECT_UPLOAD_ROUTE}/start`, {
+        filename: file.name,
+        subfolder: isPasted ? "pasted" : "",
+        size: file.size,
+        media_type: mediaType,
+    });
+    if (start.status === 404) directUploadsAvailable = false;
+    if (start.status !== 200) return undefined;
+    const session = await start.json();
+
+    // Every way out but a completed upload aborts it, so the fallback upload
+    // never leaves an unfinished multipart upload behind in the bucket.
+    let completed = false;
+    const parts = [];
+    try {
+        await runPool(partNumbers(session.urls.length), PART_CONCURRENCY, async (number) => {
+            const offset = (number - 1) * session.part_size;
+            const etag = await putPart(
+                session.urls[number - 1],
+                file.slice(offset, offset + session.part_size)
+            );
+            parts.push({ part_number: number, etag });
+        });
+        const resp = await postJson(`${DIRECT_UPLOAD_ROUTE}/complete`, {
+            upload_id: session.upload_id,
+            parts,
+        });
+        if (resp.status !== 200) {
+            console.warn("Completing the direct S3 upload failed, uploading through ComfyUI", resp.status);
+            return undefined;
+        }
+        completed = true;
+        return uploadedPath(resp);
+    } catch (err) {
+        console.warn("Direct S3 upload failed, uploading through ComfyUI", err);
+        return undefined;
+    } finally {
+        if (!completed) {
+            try {
+                await postJson(`${DIRECT_UPLOAD_ROUTE}/abort`, {
+                    upload_id: session.upload_id,
+                });
+            } catch (err) {
+                console.warn("Aborting the direct S3 upload failed", err);
+            }
+        }
+    }
+};
+
+const sessionStorageKey = (file, isPasted) =>
+    `${SESSION_STORAGE_PREFIX}${isPasted ? "pasted/" : ""}${file.name}:${file.size}:${file.lastModified}`;
+
+// Picks up the session left behind by an interrupted upload of the same file.
+const openUploadSession = async (file, { isPasted, mediaType }) => {
+    const storageKey = sessionStorageKey(file, isPasted);
+    const savedId = localStorage.getItem(storageKey);
+    if (savedId) {
+        const resp = await api.fetchApi(`${SESSION_UPLOAD_ROUTE}/${savedId}`);
+        if (resp.status === 200) return resp.json();
+        localStorage.removeItem(storageKey);
+    }
+    const resp = await postJson(SESSION_UPLOAD_ROUTE, {
+        filename: file.name,
+        subfolder: isPasted ? "pasted" : "",
+        size: file.size,
+        media_type: mediaType,
+    });
+    if (resp.status !== 200) return null;
+    const session = await resp.json();
+    localStorage.setItem(storageKey, session.session_id);
+    return session;
+};
+
+const uploadFileInSession = async (file, { isPasted = false, mediaType }) => {
+    const session = await openUploadSession(file, { isPasted, mediaType });
+    if (!session) return undefined;
+
+    const received = new Set(session.parts);
+    const missing = partNumbers(session.part_count).filter((n) => !received.has(n));
+    try {
+        await runPool(missing, PART_CONCURRENCY, (number) => {
+            const offset = (number - 1) * session.part_size;
+            const chunk = file.slice(offset, offset + session.part_size);
+            return withRetries(async () => {
+                const resp = await api.fetchApi(
+                    `${SESSION_UPLOAD_ROUTE}/${session.session_id}?offset=${offset}`,
+                    { method: "PUT", body: chunk }
+                );
+                if (resp.status !== 200) {
+                    const err = new Error(`${resp.status} - ${resp.statusText}`);
+                    // The session is gone or the chunk was refused.
+                    err.final = resp.status === 400 || resp.status === 404;
+                    throw err;
+                }
+            });
+        });
+    } catch (err) {
+        toast(
+            "Upload interrupted",
+            `${err.message}. Upload the same file again to resume.`,
+            "error"
+        );
+        return null;
+    }
+
+    const resp = await api.fetchApi(
+        `${SESSION_UPLOAD_ROUTE}/${session.session_id}/finish`,
+        { method: "POST" }
+    );
+    if (resp.status === 200) {
+        localStorage.removeItem(sessionStorageKey(file, isPasted));
+    }
+    return uploadedPath(resp);
+};
+
+const uploadFile = async (
+    file,
+    { isPasted = false, uploadRoute, formField, mediaType }
+) => {
+    const direct = await uploadFileDirect(file, { isPasted, mediaType });
+    if (direct !== undefined) return direct;
+
+    if (file.size >= SESSION_UPLOAD_THRESHOLD) {
+        const resumable = await uploadFileInSession(file, { isPasted, mediaType });
+        if (resumable !== undefined) return resumable;
+    }
+
+    const body = new FormData();
+    body.append(formField, file);
+    if (isPasted) body.append("subfolder", "pasted");
+
+    return uploadedPath(
+        await api.fetchApi(uploadRoute, {
+            method: "POST",
+            body,
+        })
+    );
+};
+
 const deleteFile = async (name, { deleteRoute, mediaType }) => {
     const body = new FormData();
     body.append("name", name);
@@ -245,12 +493,25 @@ app.registerExtension({
                     const selected = normalizeComboValue(value ?? comboWidget.value);
                     if (!selected) return;
                     const token = ++previewToken;
+                    if (previewConfig.streamRoute && node.addDOMWidget) {
+                        setNodeVideoStream(
+                            node,
+                            api.apiURL(
+                                `${previewConfig.streamRoute}?name=${encodeURIComponent(selected)}`
+                            )
+                        );
+                        return;
+                    }
                     void (async () => {
                         const entry = await fetchS3PreviewEntry(
                             selected,
                             previewConfig.previewRoute
                         );
                         if (token !== previewToken) return;
+                        if (entry?.url) {
+                            setNodePreviewUrl(node, entry.url, () => token === previewToken);
+                            return;
+                        }
                         setNodePreviewOutput(node, entry);
                     })();
                 };
@@ -274,6 +535,7 @@ app.registerExtension({
                             isPasted,
                             uploadRoute: config.uploadRoute,
                             formField: config.formField,
+                            mediaType: isVideo ? "video" : "image",
                         })
                     )
                 );